@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Cache-n-DASH: A Caching Framework for DASH video streaming.
+
+Runs the cache server for a load test. The cache is started in its own working folder (config_cdash creates
+the cache folders in the current directory) with the content server, port and prefetch scheme of the test.
+The cache is terminated with SIGINT (as with ctrl-c).
+For the sessions on virtual time, SEGMENT_DURATION and the timers of config_benchmark.CACHE_SCALED_TIMERS are divided
+by the speedup of the sessions.
+
+    python cache_runner.py -w <WORK_FOLDER> -p 8001 -c http://127.0.0.1:9000/ -s SMART -x 10
+
+Authors: Parikshit Juluri, Sheyda Kiyani Meher, Rohit Abhishek
+Institution: University of Missouri-Kansas City
+Contact Email: pjuluri@umkc.edu
+"""
+from __future__ import division
+import os
+import sys
+from argparse import ArgumentParser
+import config_benchmark
+
+
+def create_arguments(parser):
+    """ Adding arguments to the parser """
+    parser.add_argument('-w', '--WORK_FOLDER', required=True,
+                        help="Working folder of the cache")
+    parser.add_argument('-p', '--PORT', type=int, required=True,
+                        help="Port of the cache server")
+    parser.add_argument('-c', '--CONTENT_SERVER', required=True,
+                        help="URL of the content server")
+    parser.add_argument('-s', '--SCHEME', default='BASIC',
+                        help="Prefetch scheme of the cache (BASIC or SMART)")
+    parser.add_argument('-l', '--CACHE_LIMIT', type=int, default=None,
+                        help="Cache size in bytes")
+    parser.add_argument('-x', '--SPEEDUP', type=float, default=1,
+                        help="Ratio of the time of the sessions to real time")
+
+
+def main():
+    """ Main program wrapper """
+    parser = ArgumentParser(description='Run the cache server for a load test')
+    create_arguments(parser)
+    args = parser.parse_args()
+    if not os.path.exists(args.WORK_FOLDER):
+        os.makedirs(args.WORK_FOLDER)
+    os.chdir(args.WORK_FOLDER)
+    sys.path[:0] = [config_benchmark.CACHE_FOLDER]
+    import config_cdash
+    # The defaults of the cache modules are read when they are imported
+    config_cdash.HOSTNAME = config_benchmark.HOSTNAME
+    config_cdash.PORT_NUMBER = args.PORT
+    config_cdash.CONTENT_SERVER = args.CONTENT_SERVER
+    config_cdash.PREFETCH_SCHEME = args.SCHEME
+    config_cdash.SEGMENT_DURATION = config_benchmark.SEGMENT_DURATION / args.SPEEDUP
+    for timer in config_benchmark.CACHE_SCALED_TIMERS:
+        setattr(config_cdash, timer, getattr(config_cdash, timer) / args.SPEEDUP)
+    config_cdash.LOG_LEVEL = config_benchmark.LOG_LEVEL
+    if args.CACHE_LIMIT:
+        config_cdash.CACHE_LIMIT = args.CACHE_LIMIT
+    import cache_server
+    cache_server.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
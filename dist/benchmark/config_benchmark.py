@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Cache-n-DASH: A Caching Framework for DASH video streaming.
+
+Configuration of the load-test and simulation harness.
+
+Authors: Parikshit Juluri, Sheyda Kiyani Meher, Rohit Abhishek
+Institution: University of Missouri-Kansas City
+Contact Email: pjuluri@umkc.edu
+"""
+import os
+import logging
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+CACHE_FOLDER = os.path.join(os.path.dirname(BENCHMARK_FOLDER), 'cache')
+CLIENT_FOLDER = os.path.join(os.path.dirname(BENCHMARK_FOLDER), 'client')
+
+# Each run is stored in a new folder under WORK_FOLDER (cache files, client logs, traces and the report)
+WORK_FOLDER = os.path.join(os.getcwd(), 'benchmark_runs')
+HOSTNAME = '127.0.0.1'
+
+# Stand-in content server
+# Delay (in seconds) added to every response to emulate the path from the cache to the origin
+ORIGIN_DELAY = 0.05
+# Segments are synthesized with bitrate * SEGMENT_DURATION / 8 bytes
+SEGMENT_DURATION = 4
+
+# The cache prefetch schemes compared in the report
+SCHEMES = ['BASIC', 'SMART']
+# Seconds to wait for the cache server to start
+CACHE_START_TIMEOUT = 30
+# Cache size in bytes for the runs. The cache default (config_cdash.CACHE_LIMIT) is used if None
+CACHE_LIMIT = None
+
+# Sessions
+SESSION_COUNT = 20
+# Number of segments played by each session
+SEGMENT_LIMIT = 30
+# Mean time (in seconds) between the arrivals of the sessions (exponentially distributed)
+ARRIVAL_INTERVAL = 2.0
+# The videos requested by the sessions. The popularity follows a Zipf distribution in this order
+VIDEOS = ['BigBuckBunny_4s_simple_2014_05_09.mpd', 'ElephantsDream_4s_simple_2014_05_09.mpd',
+          'OfForestAndMen_4s_simple_2014_05_09.mpd', 'TearsOfSteel_4s_simple_2014_05_09.mpd']
+ZIPF_EXPONENT = 1.0
+# Seed for the arrivals, the videos and the synthetic traces. Runs with the same seed are identical
+SEED = 1
+
+# Synthetic bandwidth traces: a random walk of TRACE_PERIOD second periods around the mean bandwidth of the session.
+# The mean bandwidth of each session is picked between TRACE_MIN_BANDWIDTH and TRACE_MAX_BANDWIDTH (bits/s)
+TRACE_PERIOD = 2
+TRACE_LENGTH = 600
+TRACE_MIN_BANDWIDTH = 300000
+TRACE_MAX_BANDWIDTH = 4000000
+# Standard deviation of the log of the bandwidth change between two periods
+TRACE_VARIATION = 0.3
+# Folder with the trace files (see client/bandwidth_trace.py) used instead of the synthetic traces
+TRACE_FOLDER = None
+
+# Virtual-clock mode: the sessions run in one process on virtual time
+# Round trip time (in seconds) added to every request of a session
+SESSION_RTT = 0.02
+# Maximum ratio of virtual time to real time. The timers of the cache (CACHE_SCALED_TIMERS and SEGMENT_DURATION)
+# run on real time and are divided by it, so the cache sees the sessions at their pace.
+# 0 runs the sessions as fast as possible with the timers of the cache unscaled: the sessions then run faster than
+# the playhead and session timeouts and the pre-fetch deadlines of the cache expect
+SPEEDUP = 10
+# Timers (in seconds) of config_cdash on the time of the sessions
+CACHE_SCALED_TIMERS = ['DASH_PLAYHEAD_TIMEOUT', 'PREFETCH_SESSION_TIMEOUT', 'THROUGHPUT_SESSION_TIMEOUT']
+
+# Log level of the harness and the simulated sessions
+LOG_NAME = 'benchmark_LOG'
+LOG_LEVEL = logging.WARNING
+# To be set by load_test.py
+LOG = None
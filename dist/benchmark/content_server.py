@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Cache-n-DASH: A Caching Framework for DASH video streaming.
+
+Stand-in content server for the load tests. Synthesizes the MPD files and the segments of the videos in
+VIDEO_CACHE_CONTENT instead of serving them from disk. A segment of bitrate B has B * SEGMENT_DURATION / 8 bytes.
+The server counts the requests and bytes it serves so that the harness can measure the origin traffic.
+
+Authors: Parikshit Juluri, Sheyda Kiyani Meher, Rohit Abhishek
+Institution: University of Missouri-Kansas City
+Contact Email: pjuluri@umkc.edu
+"""
+from __future__ import division
+import BaseHTTPServer
+import SocketServer
+import socket
+import sys
+import threading
+import time
+import re
+import os
+import config_benchmark
+
+HTTP_OK = 200
+HTTP_NOT_FOUND = 404
+# Every segment is made of copies of this block
+DATA_BLOCK = ''.join(chr(index % 256) for index in range(64 * 1024))
+LAST_MODIFIED = 'Mon, 12 May 2014 10:00:00 GMT'
+# MPD in the format written by GPAC (like the MPD files of the DASH dataset)
+MPD_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" minBufferTime="PT1.500000S" type="static" mediaPresentationDuration="{duration}" profiles="urn:mpeg:dash:profile:isoff-live:2011">
+  <Period duration="{duration}">
+    <AdaptationSet segmentAlignment="true" group="1" par="16:9">
+      <SegmentTemplate timescale="96" media="{video_id}_$Bandwidth$bps/{string_match}$Number$.m4s" startNumber="{start}" duration="{segment_duration}" initialization="{video_id}_$Bandwidth$bps/{string_match}_init.mp4" />
+{representations}
+    </AdaptationSet>
+  </Period>
+</MPD>
+'''
+REPRESENTATION_TEMPLATE = ('      <Representation id="{bitrate}bps" mimeType="video/mp4" codecs="avc1.42c01f" '
+                           'startWithSAP="1" bandwidth="{bitrate}" />')
+
+
+def get_duration_string(seconds):
+    """ Module to format the duration as in the MPD files. Eg: PT0H9M56.46S """
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return 'PT{}H{}M{:.2f}S'.format(int(hours), int(minutes), seconds)
+
+
+class ContentCatalog():
+    """ The MPD files and segments that the stand-in content server synthesizes """
+    def __init__(self, video_content, segment_duration=config_benchmark.SEGMENT_DURATION):
+        """
+        :param video_content: VIDEO_CACHE_CONTENT of config_cdash
+        """
+        self.segment_duration = segment_duration
+        self.videos = {}
+        # [(video_id, compiled pattern of the segment paths)]
+        self.segment_patterns = []
+        for video_id, video_info in video_content.items():
+            if len(video_info['segment-range']) != 2:
+                continue
+            self.videos[video_id] = video_info
+            self.segment_patterns.append((video_id, re.compile(r'{}_(\d+)bps/{}(\d+|_init)\.(?:m4s|mp4)$'.format(
+                re.escape(video_id), re.escape(video_info['string-match'])))))
+
+    def get_mpd(self, request_path):
+        """ :return: The MPD file for the request or None if the request is not for a known MPD """
+        mpd_name = os.path.basename(request_path)
+        if not mpd_name.endswith('.mpd'):
+            return None
+        for video_id, video_info in self.videos.items():
+            if mpd_name.startswith(video_info['string-match'].rstrip('_')):
+                start, end = video_info['segment-range']
+                representations = [REPRESENTATION_TEMPLATE.format(bitrate=bitrate)
+                                   for bitrate in sorted(video_info['available-bitrate'])]
+                return MPD_TEMPLATE.format(duration=get_duration_string((end - start + 1) * self.segment_duration),
+                                           video_id=video_id, string_match=video_info['string-match'],
+                                           start=start, segment_duration=self.segment_duration * 96,
+                                           representations='\n'.join(representations))
+        return None
+
+    def get_segment_size(self, request_path):
+        """ :return: Size in bytes of the segment for the request or None if it is not a valid segment """
+        for video_id, segment_pattern in self.segment_patterns:
+            match = segment_pattern.search(request_path)
+            if not match:
+                continue
+            video_info = self.videos[video_id]
+            bitrate = int(match.group(1))
+            if bitrate not in video_info['available-bitrate']:
+                return None
+            if match.group(2) == '_init':
+                return 1024
+            start, end = video_info['segment-range']
+            if not start <= int(match.group(2)) <= end:
+                return None
+            return int(bitrate * self.segment_duration / 8)
+        return None
+
+
+class ContentRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        request_path = self.path.split('?')[0]
+        catalog = self.server.catalog
+        if self.server.origin_delay:
+            time.sleep(self.server.origin_delay)
+        mpd_data = catalog.get_mpd(request_path)
+        if mpd_data is not None:
+            self.send_headers(len(mpd_data), 'application/dash+xml')
+            self.wfile.write(mpd_data)
+            self.server.add_request(len(mpd_data), False)
+            return
+        segment_size = catalog.get_segment_size(request_path)
+        if segment_size is None:
+            self.send_error(HTTP_NOT_FOUND)
+            self.server.add_request(0, False, found=False)
+            return
+        self.send_headers(segment_size, 'video/mp4')
+        remaining = segment_size
+        while remaining > 0:
+            self.wfile.write(DATA_BLOCK[:min(remaining, len(DATA_BLOCK))])
+            remaining -= len(DATA_BLOCK)
+        self.server.add_request(segment_size, True)
+
+    def send_headers(self, content_length, content_type):
+        self.send_response(HTTP_OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(content_length))
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+
+    def log_message(self, log_format, *args):
+        config_benchmark.LOG.debug('Content server: ' + log_format, *args)
+
+
+class ContentServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Threaded stand-in content server with the traffic counters """
+    daemon_threads = True
+
+    def __init__(self, server_address, catalog, origin_delay=config_benchmark.ORIGIN_DELAY):
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, ContentRequestHandler)
+        self.catalog = catalog
+        self.origin_delay = origin_delay
+        self.counter_lock = threading.Lock()
+        self.requests = 0
+        self.segment_requests = 0
+        self.not_found = 0
+        self.bytes_sent = 0
+        self.segment_bytes_sent = 0
+        self.server_thread = None
+
+    def add_request(self, size, is_segment, found=True):
+        with self.counter_lock:
+            self.requests += 1
+            self.bytes_sent += size
+            if is_segment:
+                self.segment_requests += 1
+                self.segment_bytes_sent += size
+            if not found:
+                self.not_found += 1
+
+    def handle_error(self, request, client_address):
+        """ The cache closing its connections (at the end of a test) is not an error """
+        if isinstance(sys.exc_info()[1], socket.error):
+            config_benchmark.LOG.debug('Content server: connection from {} closed'.format(client_address))
+            return
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def get_stats(self):
+        with self.counter_lock:
+            return {'requests': self.requests,
+                    'segment_requests': self.segment_requests,
+                    'not_found': self.not_found,
+                    'bytes_sent': self.bytes_sent,
+                    'segment_bytes_sent': self.segment_bytes_sent}
+
+    def get_url(self):
+        return 'http://{}:{}/'.format(*self.server_address[:2])
+
+    def start(self):
+        self.server_thread = threading.Thread(target=self.serve_forever, args=())
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_content_server(catalog, hostname=config_benchmark.HOSTNAME, port=0,
+                         origin_delay=config_benchmark.ORIGIN_DELAY):
+    """ Module to start the stand-in content server in a background thread
+    :param port: Port of the server. Any free port if 0
+    :return: ContentServer
+    """
+    content_server = ContentServer((hostname, port), catalog, origin_delay)
+    content_server.start()
+    config_benchmark.LOG.info('Started the stand-in content server on {}'.format(content_server.get_url()))
+    return content_server
@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+"""
+Cache-n-DASH: A Caching Framework for DASH video streaming.
+
+Load test of the cache with DASH client sessions. For every prefetch scheme (BASIC and SMART by default)
+a fresh cache server is started against the stand-in content server (content_server.py) and the same
+sessions are played through it:
+    - The sessions arrive at exponentially distributed intervals and pick the videos with Zipf popularity.
+    - Every session downloads over its own bandwidth trace (synthetic or from TRACE_FOLDER).
+    - Virtual-clock mode (default): all the sessions run in this process on virtual time (simulated_session.py).
+    - Real-time mode (-r): every session is a dash_client.py process shaped with its trace file.
+The report has the cache hit and coalesced fetch ratios, the origin bytes saved, the time to first segment,
+the rebuffering count and duration and the bitrate switches of every scheme. It is printed and written to report.json.
+
+Testing:
+    python load_test.py -n 50 -l 20
+    python load_test.py -n 5 -l 10 -r
+
+Authors: Parikshit Juluri, Sheyda Kiyani Meher, Rohit Abhishek
+Institution: University of Missouri-Kansas City
+Contact Email: pjuluri@umkc.edu
+"""
+from __future__ import division
+import glob
+import httplib
+import collections
+import json
+import logging
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+import config_benchmark
+
+# The client modules are imported before the cache folder is added: both folders have a read_mpd.py
+sys.path[:0] = [config_benchmark.CLIENT_FOLDER]
+sys.path.append(config_benchmark.CACHE_FOLDER)
+from bandwidth_trace import BandwidthTrace
+from content_server import ContentCatalog, start_content_server
+
+HTTP_OK = 200
+
+
+def generate_trace(rng, mean_bandwidth, trace_length=config_benchmark.TRACE_LENGTH,
+                   period=config_benchmark.TRACE_PERIOD, variation=config_benchmark.TRACE_VARIATION):
+    """ Module to generate a synthetic trace: a random walk of the log of the bandwidth around the mean
+    :param rng: random.Random
+    :return: BandwidthTrace
+    """
+    periods = []
+    log_mean = math.log(mean_bandwidth)
+    log_bandwidth = log_mean
+    for _ in range(int(trace_length / period)):
+        # Pull the walk back towards the mean so that it does not drift away
+        log_bandwidth += rng.gauss(0, variation) + 0.2 * (log_mean - log_bandwidth)
+        periods.append((period, int(math.exp(log_bandwidth))))
+    return BandwidthTrace(periods)
+
+
+def create_sessions(session_count, seed, trace_folder=None):
+    """ Module to create the plan of the sessions. The plan is the same for all the schemes
+    :return: [{'session_id', 'video', 'start_time', 'trace'}]
+    """
+    rng = random.Random(seed)
+    videos = config_benchmark.VIDEOS
+    weights = [1 / ((rank + 1) ** config_benchmark.ZIPF_EXPONENT) for rank in range(len(videos))]
+    trace_files = sorted(glob.glob(os.path.join(trace_folder, '*'))) if trace_folder else []
+    sessions = []
+    start_time = 0.0
+    for session_index in range(session_count):
+        # Weighted choice of the video
+        choice = rng.random() * sum(weights)
+        for video, weight in zip(videos, weights):
+            choice -= weight
+            if choice < 0:
+                break
+        if trace_files:
+            trace = BandwidthTrace.load(trace_files[session_index % len(trace_files)])
+        else:
+            trace = generate_trace(rng, rng.uniform(config_benchmark.TRACE_MIN_BANDWIDTH,
+                                                    config_benchmark.TRACE_MAX_BANDWIDTH))
+        sessions.append({'session_id': 'S{:04d}'.format(session_index),
+                         'video': video,
+                         'start_time': start_time,
+                         'trace': trace})
+        start_time += rng.expovariate(1 / config_benchmark.ARRIVAL_INTERVAL)
+    return sessions
+
+
+def get_free_port():
+    free_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    free_socket.bind((config_benchmark.HOSTNAME, 0))
+    port = free_socket.getsockname()[1]
+    free_socket.close()
+    return port
+
+
+def get_cache_stats(port):
+    """ :return: The /stats of the cache server as a dict """
+    connection = httplib.HTTPConnection(config_benchmark.HOSTNAME, port, timeout=10)
+    try:
+        connection.request('GET', '/stats')
+        response = connection.getresponse()
+        if response.status != HTTP_OK:
+            raise IOError('Cache /stats returned HTTP {}'.format(response.status))
+        return json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def start_cache(work_folder, scheme, content_server_url, cache_limit=None, speedup=1):
+    """ Module to start the cache server in a new process and wait until it serves requests
+    :param speedup: Ratio of the time of the sessions to real time. The timers of the cache are scaled by it
+    :return: (process, port)
+    """
+    port = get_free_port()
+    command = [sys.executable, os.path.join(config_benchmark.BENCHMARK_FOLDER, 'cache_runner.py'),
+               '-w', work_folder, '-p', str(port), '-c', content_server_url, '-s', scheme, '-x', str(speedup)]
+    if cache_limit:
+        command += ['-l', str(cache_limit)]
+    if not os.path.exists(work_folder):
+        os.makedirs(work_folder)
+    cache_output = open(os.path.join(work_folder, 'cache_output.log'), 'w')
+    process = subprocess.Popen(command, stdout=cache_output, stderr=subprocess.STDOUT)
+    cache_output.close()
+    timeout = time.time() + config_benchmark.CACHE_START_TIMEOUT
+    while time.time() < timeout:
+        if process.poll() is not None:
+            raise RuntimeError('The cache server exited with {}. See {}'.format(process.returncode, work_folder))
+        try:
+            get_cache_stats(port)
+            config_benchmark.LOG.info('Started the {} cache on port {}'.format(scheme, port))
+            return process, port
+        except (IOError, socket.error, httplib.HTTPException):
+            time.sleep(0.2)
+    stop_cache(process)
+    raise RuntimeError('The cache server did not start in {} seconds'.format(config_benchmark.CACHE_START_TIMEOUT))
+
+
+def stop_cache(process, timeout=30):
+    """ Module to stop the cache server with SIGINT (kill if it does not stop within the timeout) """
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+    stop_time = time.time() + timeout
+    while process.poll() is None and time.time() < stop_time:
+        time.sleep(0.2)
+    if process.poll() is None:
+        config_benchmark.LOG.warning('Killing the cache server')
+        process.kill()
+        process.wait()
+
+
+class VirtualTimeScheduler():
+    """ Orders the steps of the sessions that run concurrently on virtual time, one thread per session.
+    A step starts once no other session can send a request at an earlier virtual time: the session has the
+    earliest clock of the waiting sessions and the clock is within the lookahead of every running step.
+    Every step that does not end the session advances its clock by at least the round trip time (the lookahead),
+    so the steps within the lookahead of each other reach the cache concurrently.
+    """
+    def __init__(self, start_times, lookahead, speedup=config_benchmark.SPEEDUP):
+        """
+        :param start_times: Virtual start time of every session
+        :param speedup: Maximum ratio of virtual time to real time. As fast as possible if 0
+        """
+        self.condition = threading.Condition()
+        self.lookahead = lookahead
+        self.speedup = speedup
+        # {session index: virtual time of the next step} of the sessions waiting for their step
+        self.waiting = dict(enumerate(start_times))
+        # {session index: virtual time at which the step started}
+        self.running = {}
+        self.real_start = time.time()
+
+    def can_start(self, index, virtual_time):
+        """ Called with the condition held """
+        if min((waiting_time, waiting_index) for waiting_index, waiting_time in self.waiting.items()) != \
+                (virtual_time, index):
+            return False
+        return all(virtual_time <= start_time + self.lookahead for start_time in self.running.values())
+
+    def start_step(self, index, virtual_time):
+        """ Module to wait until the session can run its step at virtual_time. Ends the previous step of the session
+        """
+        with self.condition:
+            self.running.pop(index, None)
+            self.waiting[index] = virtual_time
+            self.condition.notify_all()
+            while not self.can_start(index, virtual_time):
+                self.condition.wait()
+            del self.waiting[index]
+            self.running[index] = virtual_time
+            # The next waiting session may start within the lookahead
+            self.condition.notify_all()
+        if self.speedup:
+            delay = self.real_start + virtual_time / self.speedup - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def finish(self, index):
+        """ Module to remove the finished session """
+        with self.condition:
+            self.running.pop(index, None)
+            self.waiting.pop(index, None)
+            self.condition.notify_all()
+
+
+def play_virtual_session(session, index, scheduler, cache_host, cache_port):
+    """ Module to play the session on its own connection to the cache """
+    connection = httplib.HTTPConnection(cache_host, cache_port)
+    try:
+        while True:
+            scheduler.start_step(index, session.clock.time())
+            if not session.step(connection):
+                break
+    except Exception as error:
+        config_benchmark.LOG.error('Session {} failed: {}'.format(session.session_id, error))
+        session.errors += 1
+    finally:
+        scheduler.finish(index)
+        connection.close()
+
+
+def run_virtual_sessions(sessions, cache_url, segment_limit, speedup=config_benchmark.SPEEDUP):
+    """ Module to play the sessions on virtual time in this process.
+    Every session has its own thread and connection to the cache. The VirtualTimeScheduler keeps the requests in
+    virtual time order, except for the requests within the round trip time of each other that are sent concurrently.
+    :param speedup: Maximum ratio of virtual time to real time. As fast as possible if 0
+    :return: List of the JSON logs of the sessions
+    """
+    # Imported here as the client configuration creates its log folder in the current directory
+    from simulated_session import SimulatedSession
+    cache_host, cache_port = cache_url.split('//')[1].strip('/').split(':')
+    simulated_sessions = [SimulatedSession(session['session_id'], cache_url + session['video'], session['trace'],
+                                           session['start_time'], segment_limit) for session in sessions]
+    scheduler = VirtualTimeScheduler([session.clock.time() for session in simulated_sessions],
+                                     config_benchmark.SESSION_RTT, speedup)
+    session_threads = []
+    for index, session in enumerate(simulated_sessions):
+        session_thread = threading.Thread(target=play_virtual_session,
+                                          args=(session, index, scheduler, cache_host, int(cache_port)))
+        session_thread.daemon = True
+        session_thread.start()
+        session_threads.append(session_thread)
+    for session_thread in session_threads:
+        # join with a timeout so that ctrl-c still stops the load test
+        while session_thread.is_alive():
+            session_thread.join(1)
+    config_benchmark.LOG.info('Played {} sessions on virtual time in {:.1f} seconds'.format(
+        len(sessions), time.time() - scheduler.real_start))
+    return [session.json_handle for session in simulated_sessions]
+
+
+def run_realtime_sessions(sessions, cache_url, work_folder, segment_limit):
+    """ Module to play every session with a dash_client.py process. The downloads are shaped with the trace
+    :return: List of the JSON logs of the sessions
+    """
+    import config_client
+    processes = []
+    real_start = time.time()
+    for session in sessions:
+        session_folder = os.path.join(work_folder, session['session_id'])
+        os.makedirs(session_folder)
+        trace_file = os.path.join(session_folder, 'trace.txt')
+        session['trace'].save(trace_file)
+        delay = real_start + session['start_time'] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        command = [sys.executable, os.path.join(config_benchmark.CLIENT_FOLDER, 'dash_client.py'),
+                   '-m', cache_url + session['video'], '-t', trace_file]
+        if segment_limit:
+            command += ['-n', str(segment_limit)]
+        client_output = open(os.path.join(session_folder, 'client_output.log'), 'w')
+        processes.append((session, session_folder, subprocess.Popen(command, cwd=session_folder,
+                                                                    stdout=client_output,
+                                                                    stderr=subprocess.STDOUT)))
+        client_output.close()
+    json_logs = []
+    for session, session_folder, process in processes:
+        process.wait()
+        json_files = glob.glob(os.path.join(session_folder, config_client.LOG_FOLDER, 'DASH_client_*.json'))
+        if process.returncode or not json_files:
+            config_benchmark.LOG.error('Session {} failed. See {}'.format(session['session_id'], session_folder))
+            continue
+        with open(json_files[0]) as json_file:
+            json_log = json.load(json_file)
+        json_log['session_id'] = session['session_id']
+        json_logs.append(json_log)
+    return json_logs
+
+
+def get_percentile(values, percentile):
+    """ Nearest-rank percentile. None if there are no values """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, int(math.ceil(percentile / 100 * len(values))) - 1)]
+
+
+def get_mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def summarize(json_logs, cache_stats, origin_stats):
+    """ Module to compute the metrics of the report for one scheme
+    :param json_logs: The JSON logs of the sessions (as written by dash_client.py)
+    :param cache_stats: /stats of the cache server
+    :param origin_stats: Counters of the stand-in content server
+    """
+    segments = [segment for json_log in json_logs for segment in json_log.get('segment_info', [])]
+    playback_info = [json_log['playback_info'] for json_log in json_logs]
+    client_bytes = sum(segment[2] for segment in segments)
+    time_to_first_segment = [info['time_to_first_segment'] for info in playback_info
+                             if info.get('time_to_first_segment') is not None]
+    rebuffering_count = [info['interruptions']['count'] for info in playback_info]
+    rebuffering_duration = [info['interruptions']['total_duration'] for info in playback_info]
+    switches = [info['up_shifts'] + info['down_shifts'] for info in playback_info]
+    metrics = cache_stats.get('metrics', {})
+    fetch_hits = metrics.get('cache_fetch_hits_total', 0)
+    fetch_misses = metrics.get('cache_fetch_misses_total', 0)
+    # Served by a download from the content server that was already in progress
+    fetch_coalesced = metrics.get('cache_fetch_coalesced_total', 0)
+    fetch_requests = fetch_hits + fetch_coalesced + fetch_misses
+    origin_bytes = origin_stats['segment_bytes_sent']
+    return {'sessions': len(json_logs),
+            'segments': len(segments),
+            'cache_hit_ratio': fetch_hits / fetch_requests if fetch_requests else None,
+            'cache_coalesced_ratio': fetch_coalesced / fetch_requests if fetch_requests else None,
+            'client_bytes': client_bytes,
+            'origin_bytes': origin_bytes,
+            'origin_bytes_saved': client_bytes - origin_bytes,
+            'origin_bytes_saved_ratio': (client_bytes - origin_bytes) / client_bytes if client_bytes else None,
+            'time_to_first_segment_mean': get_mean(time_to_first_segment),
+            'time_to_first_segment_p95': get_percentile(time_to_first_segment, 95),
+            'rebuffering_count_total': sum(rebuffering_count),
+            'rebuffering_count_mean': get_mean(rebuffering_count),
+            'rebuffering_duration_total': sum(rebuffering_duration),
+            'rebuffering_duration_mean': get_mean(rebuffering_duration),
+            'bitrate_switches_total': sum(switches),
+            'bitrate_switches_mean': get_mean(switches),
+            'average_bitrate': get_mean([segment[1] for segment in segments]),
+            'origin': origin_stats,
+            'cache': cache_stats.get('cache')}
+
+
+REPORT_ROWS = [('Sessions', 'sessions', '{}'),
+               ('Segments', 'segments', '{}'),
+               ('Cache hit ratio', 'cache_hit_ratio', '{:.3f}'),
+               ('Coalesced fetch ratio', 'cache_coalesced_ratio', '{:.3f}'),
+               ('Bytes to the clients', 'client_bytes', '{}'),
+               ('Bytes from the origin', 'origin_bytes', '{}'),
+               ('Origin bytes saved', 'origin_bytes_saved', '{}'),
+               ('Origin bytes saved ratio', 'origin_bytes_saved_ratio', '{:.3f}'),
+               ('Time to first segment mean (s)', 'time_to_first_segment_mean', '{:.3f}'),
+               ('Time to first segment p95 (s)', 'time_to_first_segment_p95', '{:.3f}'),
+               ('Rebuffering events', 'rebuffering_count_total', '{}'),
+               ('Rebuffering events / session', 'rebuffering_count_mean', '{:.2f}'),
+               ('Rebuffering duration (s)', 'rebuffering_duration_total', '{:.2f}'),
+               ('Rebuffering duration / session (s)', 'rebuffering_duration_mean', '{:.2f}'),
+               ('Bitrate switches', 'bitrate_switches_total', '{}'),
+               ('Bitrate switches / session', 'bitrate_switches_mean', '{:.2f}'),
+               ('Average bitrate (bps)', 'average_bitrate', '{:.0f}')]
+
+
+def format_report(report):
+    """ :return: The report as a table with a column for every scheme """
+    schemes = report['schemes'].keys()
+    lines = ['{:<36}'.format('Metric') + ''.join('{:>16}'.format(scheme) for scheme in schemes)]
+    for label, key, value_format in REPORT_ROWS:
+        values = []
+        for scheme in schemes:
+            value = report['schemes'][scheme][key]
+            values.append('{:>16}'.format('-' if value is None else value_format.format(value)))
+        lines.append('{:<36}'.format(label) + ''.join(values))
+    return '\n'.join(lines)
+
+
+def run_load_test(session_count=config_benchmark.SESSION_COUNT, schemes=config_benchmark.SCHEMES,
+                  realtime=False, seed=config_benchmark.SEED, trace_folder=config_benchmark.TRACE_FOLDER,
+                  speedup=config_benchmark.SPEEDUP, work_folder=config_benchmark.WORK_FOLDER):
+    """ Module to run the sessions through a cache for every scheme
+    :return: The report as a dict
+    """
+    run_folder = os.path.join(work_folder, time.strftime('run_%Y-%m-%d.%H_%M_%S'))
+    os.makedirs(run_folder)
+    # config_cdash and config_client create their folders in the current directory when they are imported
+    os.chdir(run_folder)
+    import config_cdash
+    import config_client
+    # The simulated sessions log with the client log
+    config_client.LOG = logging.getLogger(config_client.LOG_NAME)
+    config_client.LOG.setLevel(config_benchmark.LOG_LEVEL)
+    catalog = ContentCatalog(config_cdash.VIDEO_CACHE_CONTENT)
+    sessions = create_sessions(session_count, seed, trace_folder)
+    cache_speedup = 1
+    if not realtime:
+        if speedup:
+            cache_speedup = speedup
+        else:
+            config_benchmark.LOG.warning('SPEEDUP is 0: the timers of the cache are not scaled to the virtual time. '
+                                         'The sessions run faster than the playhead and session timeouts and the '
+                                         'pre-fetch deadlines of the cache expect')
+    report = {'parameters': {'session_count': session_count,
+                             'segment_limit': config_benchmark.SEGMENT_LIMIT,
+                             'mode': 'realtime' if realtime else 'virtual',
+                             'seed': seed,
+                             'speedup': None if realtime else speedup,
+                             'origin_delay': config_benchmark.ORIGIN_DELAY,
+                             'trace_folder': trace_folder,
+                             'average_bandwidth': [session['trace'].average_bandwidth() for session in sessions]},
+              'schemes': collections.OrderedDict()}
+    for scheme in schemes:
+        scheme_folder = os.path.join(run_folder, scheme)
+        content_server = start_content_server(catalog, origin_delay=config_benchmark.ORIGIN_DELAY)
+        cache_process, cache_port = start_cache(os.path.join(scheme_folder, 'cache'), scheme,
+                                                content_server.get_url(), config_benchmark.CACHE_LIMIT, cache_speedup)
+        cache_url = 'http://{}:{}/'.format(config_benchmark.HOSTNAME, cache_port)
+        try:
+            if realtime:
+                json_logs = run_realtime_sessions(sessions, cache_url, os.path.join(scheme_folder, 'clients'),
+                                                  config_benchmark.SEGMENT_LIMIT)
+            else:
+                json_logs = run_virtual_sessions(sessions, cache_url, config_benchmark.SEGMENT_LIMIT, speedup)
+            cache_stats = get_cache_stats(cache_port)
+        finally:
+            stop_cache(cache_process)
+            content_server.stop()
+        report['schemes'][scheme] = summarize(json_logs, cache_stats, content_server.get_stats())
+        with open(os.path.join(scheme_folder, 'sessions.json'), 'w') as sessions_file:
+            json.dump(json_logs, sessions_file)
+    with open(os.path.join(run_folder, 'report.json'), 'w') as report_file:
+        json.dump(report, report_file, indent=4)
+    config_benchmark.LOG.warning('Report written to {}'.format(os.path.join(run_folder, 'report.json')))
+    return report
+
+
+def create_arguments(parser):
+    """ Adding arguments to the parser """
+    parser.add_argument('-n', '--SESSION_COUNT', type=int, default=config_benchmark.SESSION_COUNT,
+                        help="Number of sessions")
+    parser.add_argument('-l', '--SEGMENT_LIMIT', type=int, default=config_benchmark.SEGMENT_LIMIT,
+                        help="Number of segments played by every session")
+    parser.add_argument('-s', '--SCHEMES', default=','.join(config_benchmark.SCHEMES),
+                        help="Comma separated prefetch schemes of the cache to compare")
+    parser.add_argument('-r', '--REALTIME', action='store_true', default=False,
+                        help="Play the sessions in real time with dash_client.py processes")
+    parser.add_argument('-t', '--TRACE_FOLDER', default=config_benchmark.TRACE_FOLDER,
+                        help="Folder with the bandwidth trace files. Synthetic traces are used if not given")
+    parser.add_argument('--SEED', type=int, default=config_benchmark.SEED,
+                        help="Seed for the arrivals, videos and synthetic traces")
+    parser.add_argument('--SPEEDUP', type=float, default=config_benchmark.SPEEDUP,
+                        help="Maximum ratio of virtual time to real time (virtual-clock mode). "
+                             "0: as fast as possible without scaling the timers of the cache")
+    parser.add_argument('--ORIGIN_DELAY', type=float, default=config_benchmark.ORIGIN_DELAY,
+                        help="Delay in seconds added to the responses of the content server")
+    parser.add_argument('--CACHE_LIMIT', type=int, default=config_benchmark.CACHE_LIMIT,
+                        help="Cache size in bytes")
+    parser.add_argument('-w', '--WORK_FOLDER', default=config_benchmark.WORK_FOLDER,
+                        help="Folder for the runs")
+
+
+def main():
+    """ Main program wrapper """
+    parser = ArgumentParser(description='Load test of the cache with DASH client sessions')
+    create_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s')
+    config_benchmark.LOG = logging.getLogger(config_benchmark.LOG_NAME)
+    config_benchmark.LOG.setLevel(config_benchmark.LOG_LEVEL)
+    config_benchmark.SEGMENT_LIMIT = args.SEGMENT_LIMIT
+    config_benchmark.ORIGIN_DELAY = args.ORIGIN_DELAY
+    config_benchmark.CACHE_LIMIT = args.CACHE_LIMIT
+    report = run_load_test(args.SESSION_COUNT, args.SCHEMES.split(','), args.REALTIME, args.SEED,
+                           args.TRACE_FOLDER, args.SPEEDUP, os.path.abspath(args.WORK_FOLDER))
+    print format_report(report)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Cache-n-DASH: A Caching Framework for DASH video streaming.
+
+DASH client session on virtual time. Follows start_playback of dash_client.py (BASIC adaptation, the same
+request headers and the BASIC_THRESHOLD delay) with a DashPlayer in the virtual-clock mode.
+The requests are sent to the cache over HTTP. A request takes the measured response time of the cache plus
+the round trip time plus the time to transfer the response over the bandwidth trace of the session.
+The segments are kept in memory only.
+
+Needs the client folder (config_benchmark.CLIENT_FOLDER) in sys.path.
+
+Authors: Parikshit Juluri, Sheyda Kiyani Meher, Rohit Abhishek
+Institution: University of Missouri-Kansas City
+Contact Email: pjuluri@umkc.edu
+"""
+from __future__ import division
+import httplib
+import socket
+import time
+import urlparse
+from StringIO import StringIO
+import basic_dash
+import config_client
+import dash_buffer
+import read_mpd
+from stop_watch import VirtualClock
+import config_benchmark
+
+HTTP_OK = 200
+USERNAME = 'benchmark'
+
+
+def new_playback_info():
+    """ :return: playback_info dict with the fields of config_client.JSON_HANDLE['playback_info'] """
+    return {'start_time': None,
+            'end_time': None,
+            'initial_buffering_duration': None,
+            'time_to_first_segment': None,
+            'interruptions': {'count': 0, 'events': list(), 'total_duration': 0},
+            'up_shifts': 0,
+            'down_shifts': 0,
+            'available_bitrates': []}
+
+
+class SimulatedSession():
+    def __init__(self, session_id, mpd_url, trace, start_time, segment_limit=config_benchmark.SEGMENT_LIMIT,
+                 rtt=config_benchmark.SESSION_RTT):
+        """
+        :param trace: BandwidthTrace of the link between the session and the cache
+        :param start_time: Virtual time at which the session starts
+        """
+        self.session_id = session_id
+        self.mpd_url = mpd_url
+        self.trace = trace
+        self.segment_limit = segment_limit
+        self.rtt = rtt
+        self.clock = VirtualClock(start_time)
+        self.start_time = start_time
+        # Same layout as the JSON log of dash_client.py
+        self.json_handle = {'playback_type': 'basic',
+                            'session_id': session_id,
+                            'mpd_url': mpd_url,
+                            'playback_info': new_playback_info(),
+                            'segment_info': []}
+        self.dp_object = None
+        self.dash_player = None
+        self.bitrates = None
+        # For basic adaptation
+        self.average_dwn_time = 0
+        self.previous_segment_times = []
+        self.recent_download_sizes = []
+        self.download_rate = None
+        self.current_bitrate = None
+        self.previous_bitrate = None
+        self.segment_number = None
+        self.downloaded_duration = 0
+        # Bitrate of the next segment once it is selected. The download waits for the BASIC_THRESHOLD delay
+        self.next_bitrate = None
+        self.errors = 0
+
+    def get_headers(self):
+        """ Module to get the request headers as sent by dash_client.get_opener """
+        headers = {'Username': USERNAME,
+                   'Session-ID': self.session_id,
+                   'Time': str(time.time())}
+        if self.download_rate:
+            headers['Throughput'] = str(self.download_rate)
+        if self.recent_download_sizes:
+            headers['segment_size'] = str(self.recent_download_sizes[-1] * 8)
+        if self.previous_segment_times:
+            headers['seg_time'] = str(self.previous_segment_times[-1])
+        return headers
+
+    def request(self, connection, url):
+        """ Module to get the url from the cache and advance the clock by the download time
+        :return: The response data or None if the request failed
+        """
+        request_path = urlparse.urlparse(url).path
+        request_start = time.time()
+        for attempt in range(2):
+            try:
+                connection.request('GET', request_path, headers=self.get_headers())
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                # The cache closed the idle keep-alive connection. Reconnect once
+                connection.close()
+                if attempt:
+                    raise
+        response_time = time.time() - request_start
+        download_time = response_time + self.rtt + self.trace.transfer_time(self.clock.time() - self.start_time,
+                                                                             len(data) * 8)
+        if self.dash_player:
+            self.dash_player.run_until(self.clock.time() + download_time)
+        else:
+            self.clock.sleep(download_time)
+        if response.status != HTTP_OK:
+            config_benchmark.LOG.error('Session {}: HTTP {} for {}'.format(self.session_id, response.status, url))
+            self.errors += 1
+            return None
+        return data
+
+    def start_playback(self, connection):
+        """ Module to download the MPD and start the player """
+        mpd_data = self.request(connection, self.mpd_url)
+        if mpd_data is None:
+            return False
+        self.dp_object = read_mpd.read_mpd(StringIO(mpd_data))
+        self.bitrates = sorted(self.dp_object.video['bandwidth_list'])
+        self.json_handle['playback_info']['available_bitrates'] = self.bitrates
+        self.segment_number = self.dp_object.video['start']
+        video_segment_duration = self.dp_object.video['duration'] / self.dp_object.video['timescale']
+        self.dash_player = dash_buffer.DashPlayer(self.dp_object.playback_duration, video_segment_duration,
+                                                  virtual_clock=self.clock,
+                                                  playback_info=self.json_handle['playback_info'])
+        self.dash_player.buffer_log_file = None
+        if self.segment_limit:
+            self.dash_player.segment_limit = int(self.segment_limit)
+        self.dash_player.start()
+        return True
+
+    def select_bitrate(self):
+        """ Module to select the bitrate of the next segment and the delay before it is downloaded
+        :return: Delay in seconds
+        """
+        delay = 0
+        if self.segment_number == self.dp_object.video['start']:
+            self.next_bitrate = self.bitrates[0]
+        else:
+            self.next_bitrate, self.average_dwn_time, self.download_rate = basic_dash.basic_dash(
+                self.segment_number, self.bitrates, self.average_dwn_time, self.recent_download_sizes,
+                self.previous_segment_times, self.current_bitrate)
+            if self.dash_player.buffer.qsize() > config_client.BASIC_THRESHOLD:
+                delay = ((self.dash_player.buffer.qsize() - config_client.BASIC_THRESHOLD) *
+                         self.dash_player.segment_duration)
+        return delay
+
+    def download_segment(self, connection):
+        """ Module to download the next segment and write it to the player """
+        self.current_bitrate = self.next_bitrate
+        self.next_bitrate = None
+        segment_path = read_mpd.get_segment_path(self.dp_object.video, self.dp_object.playback_duration,
+                                                 self.current_bitrate, self.segment_number)
+        segment_url = urlparse.urljoin(self.mpd_url, segment_path)
+        download_start = self.clock.time()
+        segment_data = self.request(connection, segment_url)
+        if segment_data is None:
+            return False
+        segment_size = len(segment_data)
+        segment_download_time = self.clock.time() - download_start
+        self.previous_segment_times.append(segment_download_time)
+        self.recent_download_sizes.append(segment_size)
+        self.json_handle['segment_info'].append((segment_path.split('/')[-1], self.current_bitrate, segment_size,
+                                                 segment_download_time))
+        segment_info = {'playback_length': self.dash_player.segment_duration,
+                        'size': segment_size,
+                        'bitrate': self.current_bitrate,
+                        'data': None,
+                        'URI': segment_url,
+                        'segment_number': self.segment_number}
+        self.dash_player.write(segment_info)
+        self.downloaded_duration += segment_info['playback_length']
+        self.segment_number += 1
+        if self.previous_bitrate:
+            if self.previous_bitrate < self.current_bitrate:
+                self.json_handle['playback_info']['up_shifts'] += 1
+            elif self.previous_bitrate > self.current_bitrate:
+                self.json_handle['playback_info']['down_shifts'] += 1
+        self.previous_bitrate = self.current_bitrate
+        return True
+
+    def is_downloaded(self):
+        """ Returns True once all the segments of the session are downloaded """
+        if self.downloaded_duration >= self.dp_object.playback_duration:
+            return True
+        if self.segment_limit and self.segment_number > int(self.segment_limit):
+            return True
+        return not read_mpd.get_segment_path(self.dp_object.video, self.dp_object.playback_duration,
+                                             self.bitrates[0], self.segment_number)
+
+    def step(self, connection):
+        """ Module to run the next action of the session at the current time of its clock.
+        Every action advances the clock of the session.
+        :param connection: HTTPConnection to the cache
+        :return: False once the session is finished
+        """
+        if not self.dash_player:
+            if not self.start_playback(connection):
+                self.json_handle['playback_info']['end_time'] = self.clock.time()
+                return False
+            return True
+        if self.next_bitrate is None:
+            if self.is_downloaded():
+                self.dash_player.finish()
+                return False
+            delay = self.select_bitrate()
+            if delay:
+                config_client.LOG.info("SLEEPING for {}seconds ".format(delay))
+                self.dash_player.run_until(self.clock.time() + delay)
+                return True
+        if not self.download_segment(connection):
+            self.dash_player.finish()
+            return False
+        return True
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Cache-n-DASH: A Caching Framework for DASH video streaming.
+
+In-process metrics for the cache. Counters and fixed-bucket histograms are updated on the hot path
+and rendered on the /metrics (Prometheus text format) and /stats (JSON) requests of the cache server.
+Values that are already kept elsewhere (queue sizes, cache statistics) are registered as functions
+and read only when the metrics are rendered.
+
+Authors: Parikshit Juluri, Sheyda Kiyani Meher, Rohit Abhishek
+Institution: University of Missouri-Kansas City
+Contact Email: pjuluri@umkc.edu
+"""
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+import config_cdash
+
+
+class Counter():
+    """ Monotonic counter. Optionally split by the value of one label """
+    metric_type = 'counter'
+
+    def __init__(self, name, help_text, label_name=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.lock = threading.Lock()
+        self.values = collections.defaultdict(float)
+
+    def inc(self, amount=1, label=None):
+        with self.lock:
+            self.values[label] += amount
+
+    def samples(self):
+        with self.lock:
+            values = self.values.items()
+        for label, value in values:
+            if label is None:
+                yield self.name, value
+            else:
+                yield '{}{{{}="{}"}}'.format(self.name, self.label_name, label), value
+
+    def as_dict(self):
+        with self.lock:
+            if self.label_name:
+                return dict(self.values)
+            return self.values[None]
+
+
+class Histogram():
+    """ Histogram with fixed bucket upper bounds """
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, buckets=config_cdash.METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = sorted(buckets)
+        self.lock = threading.Lock()
+        # The last count is for the values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.total, self.count
+        cumulative = 0
+        for bucket, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield '{}_bucket{{le="{}"}}'.format(self.name, bucket), cumulative
+        yield '{}_bucket{{le="+Inf"}}'.format(self.name), count
+        yield '{}_sum'.format(self.name), total
+        yield '{}_count'.format(self.name), count
+
+    def as_dict(self):
+        with self.lock:
+            return {'buckets': dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'], self.counts)),
+                    'sum': self.total,
+                    'count': self.count,
+                    'mean': self.total / self.count if self.count else 0.0}
+
+
+class FunctionMetric():
+    """ Metric read from a function when the metrics are rendered """
+    def __init__(self, name, help_text, function, metric_type='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.function = function
+        self.metric_type = metric_type
+
+    def samples(self):
+        yield self.name, self.function()
+
+    def as_dict(self):
+        return self.function()
+
+
+class MetricsRegistry():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = collections.OrderedDict()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, label_name=None):
+        return self.register(Counter(name, help_text, label_name))
+
+    def histogram(self, name, help_text, buckets=config_cdash.METRICS_LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def function(self, name, help_text, function, metric_type='gauge'):
+        return self.register(FunctionMetric(name, help_text, function, metric_type))
+
+    def render_prometheus(self):
+        """ Module to render the metrics in the Prometheus text format """
+        with self.lock:
+            metrics = self.metrics.values()
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help_text))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.metric_type))
+            try:
+                for sample_name, value in metric.samples():
+                    lines.append('{} {}'.format(sample_name, value))
+            except Exception as error:
+                config_cdash.LOG.error('Unable to read metric {}: {}'.format(metric.name, error))
+        return '\n'.join(lines) + '\n'
+
+    def as_dict(self):
+        with self.lock:
+            metrics = self.metrics.values()
+        stats = {}
+        for metric in metrics:
+            try:
+                stats[metric.name] = metric.as_dict()
+            except Exception as error:
+                config_cdash.LOG.error('Unable to read metric {}: {}'.format(metric.name, error))
+        return stats
+
+
+class SamplingProfiler():
+    """ Samples the innermost frame of every thread every `interval` seconds.
+    The hot spots show up in the /stats output as 'file:line function' with the number of samples.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.samples = collections.defaultdict(int)
+        self.sample_count = 0
+        self.stop = threading.Event()
+        self.profiler_thread = None
+
+    def start(self):
+        self.profiler_thread = threading.Thread(target=self.profiler_function, args=())
+        self.profiler_thread.daemon = True
+        self.profiler_thread.start()
+
+    def profiler_function(self):
+        own_thread_id = threading.current_thread().ident
+        while not self.stop.is_set():
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                self.sample_count += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own_thread_id:
+                        continue
+                    code = frame.f_code
+                    self.samples['{}:{} {}'.format(os.path.basename(code.co_filename), frame.f_lineno,
+                                                   code.co_name)] += 1
+
+    def top(self, count=config_cdash.PROFILER_TOP_COUNT):
+        """ :return: The `count` most sampled frames as [(frame, samples)] """
+        with self.lock:
+            return sorted(self.samples.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+METRICS = MetricsRegistry()
+PROFILER = None
+
+FETCH_HITS = METRICS.counter('cache_fetch_hits_total', 'Fetch requests served from the cache')
+FETCH_MISSES = METRICS.counter('cache_fetch_misses_total', 'Fetch requests downloaded from the content server')
+FETCH_COALESCED = METRICS.counter('cache_fetch_coalesced_total',
+                                  'Fetch requests that joined the download of the segment from the content server')
+PREFETCH_HITS = METRICS.counter('cache_prefetch_hits_total', 'Pre-fetch requests for segments already in the cache')
+SEGMENT_REQUESTS = METRICS.counter('cache_segment_requests_total', 'Segment requests by bitrate (bits per second)',
+                                   'bitrate')
+SEGMENT_REQUEST_TIME = METRICS.histogram('cache_segment_request_seconds',
+                                         'Time from receiving a segment request to having it served (T3 - T2)')
+ORIGIN_DOWNLOAD_TIME = METRICS.histogram('cache_origin_download_seconds',
+                                         'Time to download a segment from the content server')
+
+
+def start_profiler(interval=config_cdash.PROFILER_INTERVAL):
+    """ Module to start the sampling profiler if an interval is configured """
+    global PROFILER
+    if interval and not PROFILER:
+        PROFILER = SamplingProfiler(interval)
+        PROFILER.start()
+    return PROFILER
+
+
+def get_stats():
+    """ :return: The metrics and the profiler hot spots as a dict """
+    stats = {'metrics': METRICS.as_dict()}
+    if PROFILER:
+        stats['profile'] = {'samples': PROFILER.sample_count, 'top': PROFILER.top()}
+    return stats
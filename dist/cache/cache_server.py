@@ -24,177 +24,476 @@ Contact Email: pjuluri@umkc.edu
 
 """
 import BaseHTTPServer
+import Queue
+import select
+import socket
 import sys
 import os
 import urllib2
-import shutil
-import read_mpd
 import errno
 import hashlib
 import json
 import config_cdash
 import time
-from os import stat
+from os import fstat
 import threading
 from prioritycache import CacheManager
 import configure_cdash_log
-from prioritycache.cache_module import check_content_server
-import create_db
+import cache_metrics
+from prioritycache.content_catalog import CATALOG
 import datetime
 
-# Active state data structures
-MPD_DICT = {}
+# Use the zero-copy sendfile if available (pysendfile for python 2, os.sendfile for python 3)
+# In case of ImportError the files are copied in chunks of config_cdash.SEND_CHUNK_SIZE
+try:
+    from sendfile import sendfile
+except ImportError:
+    sendfile = getattr(os, 'sendfile', None)
 
+# Active state data structures
 USER_DICT_LOCK = threading.Lock()
 USER_DICT = {}
 
-TH_CONN = None
 #D_CONN=None
 cache_manager = None
 # HTTP CODES
 HTTP_OK = 200
+HTTP_PARTIAL_CONTENT = 206
+HTTP_NOT_MODIFIED = 304
 HTTP_NOT_FOUND = 404
+HTTP_RANGE_NOT_SATISFIABLE = 416
+# Headers of the content server that are not forwarded to the client.
+# Server and Date are already sent by send_response
+EXCLUDED_HEADERS = ['connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'te', 'trailer',
+                    'upgrade', 'content-length', 'content-range', 'accept-ranges', 'server', 'date']
 client_throughput = None
+
+
+class ThreadPoolHTTPServer(BaseHTTPServer.HTTPServer):
+    """HTTPServer that handles the requests in a fixed pool of worker threads.
+    The keep-alive connections do not hold a worker between their requests: the idle connections are polled
+    in a single thread and handed over to a worker when their next request arrives.
+    """
+    # MyHTTPRequestHandler handles one request at a time and leaves the connection open
+    dispatch_per_request = True
+
+    def __init__(self, server_address, handler_class, worker_count=config_cdash.SERVER_WORKERS,
+                 keep_alive_timeout=config_cdash.KEEP_ALIVE_TIMEOUT):
+        BaseHTTPServer.HTTPServer.__init__(self, server_address, handler_class)
+        self.keep_alive_timeout = keep_alive_timeout
+        # (request, client_address, handler) of the connections with a request to handle.
+        # handler is None for the new connections
+        self.connection_queue = Queue.Queue()
+        # Connections handed over to the poll thread
+        self.idle_queue = Queue.Queue()
+        # Wakes up the poll thread when a connection is added to the idle_queue
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        self.stop_polling = threading.Event()
+        self.workers = []
+        for _ in range(worker_count):
+            worker = threading.Thread(target=self.process_request_worker, args=())
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.poll_thread = threading.Thread(target=self.poll_idle_connections, args=())
+        self.poll_thread.daemon = True
+        self.poll_thread.start()
+
+    def server_close(self):
+        """ Stop the poll thread and close the listening socket """
+        self.stop_polling.set()
+        os.write(self.wakeup_write, 'x')
+        self.poll_thread.join()
+        BaseHTTPServer.HTTPServer.server_close(self)
+
+    def process_request(self, request, client_address):
+        """ Wait for the first request of the new connection """
+        self.park_connection(request, client_address, None)
+
+    def handle_error(self, request, client_address):
+        """ SocketServer handles any exception of process_request here. ctrl-c still stops the server """
+        if sys.exc_info()[0] is KeyboardInterrupt:
+            raise
+        BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def park_connection(self, request, client_address, handler):
+        """ Hand over the connection to the poll thread until it is readable """
+        self.idle_queue.put((request, client_address, handler))
+        os.write(self.wakeup_write, 'x')
+
+    def end_connection(self, request, handler):
+        """ Module to close the connection """
+        if handler:
+            handler.close_connection = 1
+            try:
+                handler.finish()
+            except socket.error:
+                pass
+        self.shutdown_request(request)
+
+    def poll_idle_connections(self):
+        """ Poll loop of the idle connections. Closes the connections idle for more than keep_alive_timeout """
+        poller = select.poll()
+        poller.register(self.wakeup_read, select.POLLIN)
+        # {file number: (request, client_address, handler, idle since)}
+        idle_connections = {}
+        while not self.stop_polling.is_set():
+            try:
+                events = poller.poll(1000)
+            except select.error as error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fileno, _ in events:
+                if fileno == self.wakeup_read:
+                    os.read(self.wakeup_read, 4096)
+                    continue
+                poller.unregister(fileno)
+                request, client_address, handler, _ = idle_connections.pop(fileno)
+                # Also on POLLHUP and POLLERR. The worker reads the end of the connection and closes it
+                self.connection_queue.put((request, client_address, handler))
+            while True:
+                try:
+                    request, client_address, handler = self.idle_queue.get_nowait()
+                except Queue.Empty:
+                    break
+                try:
+                    fileno = request.fileno()
+                except socket.error:
+                    self.end_connection(request, handler)
+                    continue
+                idle_connections[fileno] = (request, client_address, handler, time.time())
+                poller.register(fileno, select.POLLIN | select.POLLPRI)
+            expire_time = time.time() - self.keep_alive_timeout
+            for fileno, (request, client_address, handler, idle_since) in idle_connections.items():
+                if idle_since < expire_time:
+                    poller.unregister(fileno)
+                    del idle_connections[fileno]
+                    self.end_connection(request, handler)
+        for request, _, handler, _ in idle_connections.values():
+            self.end_connection(request, handler)
+
+    def process_request_worker(self):
+        while True:
+            request, client_address, handler = self.connection_queue.get()
+            try:
+                if handler is None:
+                    # Sets up the connection and handles its first request
+                    handler = self.RequestHandlerClass(request, client_address, self)
+                else:
+                    handler.handle()
+            except Exception:
+                self.handle_error(request, client_address)
+                self.end_connection(request, handler)
+                continue
+            if handler.close_connection:
+                self.end_connection(request, handler)
+            elif handler.has_buffered_request():
+                # Pipelined request already read from the socket. Poll would not report it
+                self.connection_queue.put((request, client_address, handler))
+            else:
+                self.park_connection(request, client_address, handler)
+
+
+def get_byte_range(range_header, file_size):
+    """ Module to parse the HTTP Range header. Only single byte ranges are supported.
+    :param range_header: Eg: 'bytes=0-499', 'bytes=500-', 'bytes=-500'
+    :param file_size: Size of the file in bytes
+    :return: (first_byte, last_byte) or None if the header is to be ignored.
+             Raises ValueError if the range cannot be satisfied
+    """
+    if not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    first_byte, _, last_byte = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if first_byte:
+            first_byte = int(first_byte)
+            last_byte = int(last_byte) if last_byte else file_size - 1
+        else:
+            # Suffix range with the last N bytes
+            first_byte = max(file_size - int(last_byte), 0)
+            last_byte = file_size - 1 if int(last_byte) else -1
+    except ValueError:
+        return None
+    if first_byte >= file_size or last_byte < first_byte:
+        raise ValueError('Range {} not satisfiable for size {}'.format(range_header, file_size))
+    return first_byte, min(last_byte, file_size - 1)
+
+
 class MyHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     """HTTPHandler to serve the video"""
-    # check if MPD_DICT file in cache exists
+    # Keep the connections alive between the segment requests
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections are closed after these many seconds
+    timeout = config_cdash.KEEP_ALIVE_TIMEOUT
+
+    def handle(self):
+        """ Module to handle the requests of the connection.
+        ThreadPoolHTTPServer hands over the connection for one request at a time
+        """
+        if not getattr(self.server, 'dispatch_per_request', False):
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+            return
+        self.close_connection = 1
+        self.handle_one_request()
+
+    def finish(self):
+        """ The connections kept alive by ThreadPoolHTTPServer are finished by the server when they are closed """
+        if self.close_connection or not getattr(self.server, 'dispatch_per_request', False):
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+
+    def has_buffered_request(self):
+        """ :return: True if the next request was already read into the buffer of rfile (pipelining) """
+        read_buffer = getattr(self.rfile, '_rbuf', None)
+        return bool(read_buffer and read_buffer.getvalue())
+
+    def send_file(self, local_path, http_headers):
+        """ Module to send the file with the http_headers. Honours single byte Range requests.
+        The file is opened before the response is started: raises IOError if it is missing
+        :return: Number of bytes of the file sent
+        """
+        with open(local_path, 'rb') as request_file:
+            file_size = fstat(request_file.fileno()).st_size
+            first_byte, last_byte = 0, file_size - 1
+            status = HTTP_OK
+            range_header = self.headers.getheader('Range')
+            if range_header and file_size:
+                try:
+                    byte_range = get_byte_range(range_header, file_size)
+                except ValueError:
+                    config_cdash.LOG.warning('Range {} not satisfiable for {}'.format(range_header, local_path))
+                    self.send_response(HTTP_RANGE_NOT_SATISFIABLE)
+                    self.send_header('Content-Range', 'bytes */{}'.format(file_size))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return 0
+                if byte_range:
+                    first_byte, last_byte = byte_range
+                    status = HTTP_PARTIAL_CONTENT
+            content_length = last_byte - first_byte + 1
+            self.send_response(status)
+            self.send_cached_headers(http_headers, content_length)
+            if status == HTTP_PARTIAL_CONTENT:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first_byte, last_byte, file_size))
+            self.end_headers()
+            if sendfile:
+                self.wfile.flush()
+                return self.sendfile_all(request_file, first_byte, content_length)
+            return self.copy_file(request_file, first_byte, content_length)
+
+    def send_stream(self, in_flight):
+        """ Module to send a segment while it is downloaded from the content server
+        :param in_flight: InFlightDownload of the segment
+        :return: Number of bytes sent
+        """
+        http_headers = in_flight.wait_headers()
+        content_length = http_headers.get('content-length')
+        if content_length is None or self.headers.getheader('Range'):
+            # Cannot stream without the length or for a part of the file. Wait for the complete file
+            local_path, http_headers = in_flight.wait()
+            return self.send_file(local_path, http_headers)
+        self.send_response(HTTP_OK)
+        self.send_cached_headers(http_headers, content_length)
+        self.end_headers()
+        sent = 0
+        try:
+            for data in in_flight.iter_data():
+                self.wfile.write(data)
+                sent += len(data)
+        except Exception as error:
+            # The headers are already sent. Close the connection to signal the incomplete response
+            config_cdash.LOG.error('Download of {} failed while streaming: {}'.format(in_flight.key, error))
+            self.close_connection = 1
+        return sent
+
+    def send_mpd(self, mpd_entry):
+        """ Module to send the MPD file from memory. Answers 304 if the If-None-Match header matches the ETag
+        :param mpd_entry: MpdEntry of the catalog
+        :return: Number of bytes of the MPD sent
+        """
+        if_none_match = self.headers.getheader('If-None-Match')
+        if if_none_match and mpd_entry.matches(if_none_match):
+            self.send_response(HTTP_NOT_MODIFIED)
+            self.send_header('ETag', mpd_entry.etag)
+            self.end_headers()
+            return 0
+        self.send_response(HTTP_OK)
+        self.send_cached_headers(mpd_entry.http_headers, len(mpd_entry.data))
+        self.end_headers()
+        self.wfile.write(mpd_entry.data)
+        return len(mpd_entry.data)
+
+    def send_text(self, text, content_type):
+        """ Module to send the text generated by the cache server (metrics and statistics) """
+        self.send_response(HTTP_OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(text)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(text)
+
+    def send_cached_headers(self, http_headers, content_length):
+        """ Send the headers stored from the content server along with the Content-Length """
+        for header, header_value in http_headers.items():
+            if header.lower() not in EXCLUDED_HEADERS:
+                self.send_header(header, header_value)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(content_length))
+
+    def sendfile_all(self, request_file, offset, count):
+        """ Zero-copy transfer of count bytes of the file to the client """
+        out_fd = self.connection.fileno()
+        in_fd = request_file.fileno()
+        sent = 0
+        while sent < count:
+            try:
+                bytes_sent = sendfile(out_fd, in_fd, offset + sent, count - sent)
+            except OSError as error:
+                if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                # The socket has a timeout and is non-blocking. Wait until it is writable
+                if not select.select([], [out_fd], [], self.timeout)[1]:
+                    raise socket.timeout('Timed out sending {} bytes'.format(count))
+                continue
+            if bytes_sent == 0:
+                break
+            sent += bytes_sent
+        return sent
+
+    def copy_file(self, request_file, offset, count):
+        """ Copy count bytes of the file to the client in chunks of SEND_CHUNK_SIZE """
+        request_file.seek(offset)
+        sent = 0
+        while sent < count:
+            data = request_file.read(min(config_cdash.SEND_CHUNK_SIZE, count - sent))
+            if not data:
+                break
+            self.wfile.write(data)
+            sent += len(data)
+        return sent
+
     def do_GET(self):
   
         """Function to handle the get message"""
         start_time=time.time()
-        config_cdash.LOG.info('T2 = {}'.format(start_time))
+        # Metrics and statistics of the cache server
+        if self.path.strip("/") == config_cdash.METRICS_PATH:
+            self.send_text(cache_metrics.METRICS.render_prometheus(), 'text/plain; version=0.0.4')
+            return
+        elif self.path.strip("/") == config_cdash.STATS_PATH:
+            stats = cache_metrics.get_stats()
+            stats['cache'] = cache_manager.cache.get_stats()
+            self.send_text(json.dumps(stats, indent=4, default=str), 'application/json')
+            return
+        config_cdash.LOG.info('T2 = %s', start_time)
         entry_id = username = session_id = request_id = "NULL"
         request_size = throughput = request_time=request_t =time_c= "NULL"
         segment_size=seg_time="NULL"
+        # Sent by the clients from their second segment on. None makes the SMART scheme start from the average
+        # throughput of the session and is stored as NULL
+        client_throughput = None
+        # The optional headers are read with getheader. A missing header must not skip the others
+        if self.headers.getheader('Time'):
+            time_c=self.headers.getheader('Time')
+        config_cdash.LOG.info("time_c %s", time_c)
+        if self.headers.getheader('Throughput') not in (None, 'NULL'):
+            client_throughput=self.headers.getheader('Throughput')
+        config_cdash.LOG.info("Client Throughput %s", client_throughput)
+        segment_size = self.headers.getheader('segment_size', segment_size)
+        config_cdash.LOG.info("segment_size %s", segment_size)
+        seg_time = self.headers.getheader('seg_time', seg_time)
+        config_cdash.LOG.info("seg_time %s", seg_time)
         try:
             username = self.headers['Username']
-            config_cdash.LOG.info("username {}".format(username))
+            config_cdash.LOG.info("username %s", username)
             session_id = self.headers['Session-ID']
-            config_cdash.LOG.info("Session-ID {}".format(session_id))
-            if self.headers['Time']:
-                time_c=self.headers['Time']
-            else:
-                time_c=0
-            config_cdash.LOG.info("time_c {}".format(time_c))
-            global client_throughput
-            client_throughput=self.headers['Throughput']
-            if client_throughput==None:
-                client_throughput=0.0
-            if client_throughput=='NULL':
-                client_throughput=0.0
-            config_cdash.LOG.info("Client Throughput {}".format(client_throughput))
-            segment_size = self.headers['segment_size']
-            config_cdash.LOG.info("segment_size {}".format(segment_size))
-            seg_time = self.headers['seg_time']
-            config_cdash.LOG.info("seg_time {}".format(seg_time))
-            #global client_throughput
-            #client_throughput=self.headers['Throughput']
-            #if client_throughput==None:
-            #    client_throughput=0.0
-            #if client_throughput=='NULL':
-            #    client_throughput=0.0
-            #config_cdash.LOG.info("Client Throughput {}".format(client_throughput))
+            config_cdash.LOG.info("Session-ID %s", session_id)
         except KeyError:
             config_cdash.LOG.warning('Could not find the username or session-ID for request from host:{}'.format(
                 self.client_address))
         #start_time=time.time()
         #config_cdash.LOG.info('T2 = {}'.format(start_time))
         #s_time=str(datetime.datetime.time(datetime.datetime.now()))
-        global MPD_DICT
         request = self.path.strip("/").split('?')[0]
-        config_cdash.LOG.info("Received request {}".format(request))
-        # check if mpd file requested is in Cache Server (dictionary)
-        if request in MPD_DICT:
-            config_cdash.LOG.info('Found MPD in MPD_DICT')
-            request_path = request.replace('/', os.path.sep)
-            make_sure_path_exists(config_cdash.MPD_FOLDER)
-            local_mpd_path = os.path.join(config_cdash.MPD_FOLDER, request_path)
-            for header in self.headers:
-                config_cdash.LOG.info(header)
-            self.send_response(HTTP_OK)
-            for header, header_value in MPD_DICT[request]['http_headers'].items():
-                self.send_header(header, header_value)
-            self.end_headers()
-
-            with open(local_mpd_path, 'rb') as request_file:
-                #start_time = timeit.default_timer()
-                self.wfile.write(request_file.read())
-                # Elapsed time in seconds
-                T3=time.time()
-                request_t = T3 - start_time
-                config_cdash.LOG.info('T3 = {}'.format(T3))
-                config_cdash.LOG.info('Served the MPD file from the cache server')
-            request_size = stat(local_mpd_path).st_size
-
-        elif request in config_cdash.MPD_SOURCE_LIST:
-            config_cdash.LOG.info("MPD: not in cache. Retrieving from Content server".format(request))
-            # if mpd is in content server save it in cache server and put it in MPD_DICT and json file
-            mpd_headers = None
-            if "Big" in request:
-                mpd_url = config_cdash.CONTENT_SERVER +config_cdash.SERVER[0]+ request
-            elif "Elephants" in request:
-                mpd_url = config_cdash.CONTENT_SERVER +config_cdash.SERVER[1]+ request
-            elif "OfForest" in request:
-                mpd_url = config_cdash.CONTENT_SERVER +config_cdash.SERVER[2]+ request
-            elif "Tears" in request:
-                mpd_url = config_cdash.CONTENT_SERVER +config_cdash.SERVER[3]+ request
-            #mpd_url = config_cdash.CONTENT_SERVER + request
+        config_cdash.LOG.info("Received request %s", request)
+        # check if mpd file requested is in Cache Server (catalog)
+        mpd_entry = CATALOG.get_mpd(request)
+        if mpd_entry:
+            config_cdash.LOG.info('Found MPD in the catalog')
+            request_size = self.send_mpd(mpd_entry)
+            # Elapsed time in seconds
+            T3=time.time()
+            request_t = T3 - start_time
+            config_cdash.LOG.info('T3 = %s', T3)
+            config_cdash.LOG.info('Served the MPD file from the cache server')
+            update_user_dict(mpd_entry, (username, session_id))
+        elif request in config_cdash.MPD_SOURCES:
+            config_cdash.LOG.info("MPD: not in cache. Retrieving from Content server")
+            # if mpd is in content server add it to the catalog of the cache server
+            folder = config_cdash.MPD_SOURCES[request]
+            mpd_url = CATALOG.get_origin(folder) + request
             try:
-                content_server_response = urllib2.urlopen(mpd_url)
-                mpd_headers = content_server_response.headers
-                config_cdash.LOG.info('Fetching MPD from {}'.format(mpd_url))
+                content_server_response = urllib2.urlopen(mpd_url, timeout=config_cdash.ORIGIN_TIMEOUT)
+                config_cdash.LOG.info('Fetching MPD from %s', mpd_url)
+                mpd_data = content_server_response.read()
             except urllib2.HTTPError as http_error:
                 config_cdash.LOG.error('Unable to fetch MPD file from the content server url {}. HTTPError: {}'.format(
                     mpd_url, http_error.code))
-            request_path = request.replace('/', os.path.sep)
-            local_mpd_path = os.path.join(config_cdash.MPD_FOLDER, request_path)
-            make_sure_path_exists(os.path.dirname(local_mpd_path))
-            with open(local_mpd_path, 'wb') as local_mpd_file:
-                shutil.copyfileobj(content_server_response, local_mpd_file)
-            config_cdash.LOG.info('Downloaded the MPD: {} to {}'.format(content_server_response, local_mpd_path))
-            self.send_response(HTTP_OK)
-            for header, header_value in mpd_headers.items():
-                self.send_header(header, header_value)
-            self.end_headers()
-
-            with open(local_mpd_path, 'rb') as request_file:
-                #start_time = timeit.default_timer()
-                self.wfile.write(request_file.read())
-                # Elapsed time in seconds
-                T3=time.time()
-                request_t = T3 - start_time
-                config_cdash.LOG.info('T3 = {}'.format(T3))
-            # file_size in bytes
-            request_size = stat(local_mpd_path).st_size
-            config_cdash.LOG.info('Served MPD file:{}'.format(local_mpd_path))
-            # client_ip, client_port = self.client_address
-            mpd_headers_dict = dict(mpd_headers)
+                self.send_error(HTTP_NOT_FOUND)
+                return
+            except (urllib2.URLError, IOError) as error:
+                config_cdash.LOG.error('Unable to fetch MPD file from the content server url {}: {}'.format(
+                    mpd_url, error))
+                self.send_error(HTTP_NOT_FOUND)
+                return
             config_cdash.LOG.info('Parsing MPD file')
-            parse_mpd(local_mpd_path, request, mpd_headers_dict, (username, session_id ))
-        elif 'm4s' in request:
+            mpd_entry = CATALOG.add_mpd(request, mpd_data, dict(content_server_response.headers), folder)
+            # file_size in bytes
+            request_size = self.send_mpd(mpd_entry)
+            # Elapsed time in seconds
+            T3=time.time()
+            request_t = T3 - start_time
+            config_cdash.LOG.info('T3 = %s', T3)
+            config_cdash.LOG.info('Served MPD file:%s', request)
+            update_user_dict(mpd_entry, (username, session_id))
+        else:
             # Check if it is a valid request
-            config_cdash.LOG.info('Request for m4s {}'.format(request))
-            if check_content_server(request):
-                local_file_path, http_headers = cache_manager.fetch_file(request, username, session_id)
-                T3=time.time()
-                request_t = T3 - start_time
-                config_cdash.LOG.info('T3 = {}'.format(T3))
-                #cache_manager.current_queue.put((request, username, session_id))
-                config_cdash.LOG.debug('M4S request: local {}, http_headers: {}'.format(local_file_path, http_headers))
-                self.send_response(HTTP_OK)
-                for header, header_value in http_headers.items():
-                    self.send_header(header, header_value)
-                self.end_headers()
-                with open(local_file_path, 'rb') as request_file:
-                    #start_time = timeit.default_timer()
-                    self.wfile.write(request_file.read())
-                    #T3=time.time()
-                    #request_t = T3 - start_time
-                    #config_cdash.LOG.info('T3 = {}'.format(T3))
-                request_size = stat(local_file_path).st_size
+            config_cdash.LOG.info('Request for segment %s', request)
+            segment = CATALOG.lookup(request)
+            if segment:
+                local_file_path, http_headers, in_flight = cache_manager.fetch_file(request, username, session_id)
+                if in_flight:
+                    # The segment is streamed as it is downloaded. T3 is when the download is complete
+                    request_size = self.send_stream(in_flight)
+                    T3=time.time()
+                    request_t = T3 - start_time
+                    config_cdash.LOG.info('T3 = %s', T3)
+                else:
+                    T3=time.time()
+                    request_t = T3 - start_time
+                    config_cdash.LOG.info('T3 = %s', T3)
+                    #cache_manager.current_queue.put((request, username, session_id))
+                    config_cdash.LOG.debug('M4S request: local %s, http_headers: %s', local_file_path, http_headers)
+                    try:
+                        request_size = self.send_file(local_file_path, http_headers)
+                    except IOError as error:
+                        if error.errno != errno.ENOENT:
+                            raise
+                        # The file was deleted from the harddisk after the cache started. Download it again
+                        config_cdash.LOG.warning('File {} of the cached segment {} not found. Downloading it '
+                                                 'again'.format(local_file_path, request))
+                        cache_manager.cache.drop_missing_file(request, local_file_path)
+                        local_file_path, http_headers, in_flight = cache_manager.fetch_file(request, username,
+                                                                                            session_id)
+                        if in_flight:
+                            request_size = self.send_stream(in_flight)
+                        else:
+                            request_size = self.send_file(local_file_path, http_headers)
+                cache_metrics.SEGMENT_REQUEST_TIME.observe(request_t)
+                bitrate = CATALOG.get_title(segment.title).bitrates[segment.bitrate_index]
+                cache_metrics.SEGMENT_REQUESTS.inc(label=bitrate)
                 # If valid request sent
                 entry_id = datetime.datetime.now()
-                cursor = TH_CONN.cursor()
                 #Client_transfer=abs(float(time_c)-start_time)
                 #FMT = '%H:%M:%S.%f'
                 #Client_transfer = datetime.datetime.strptime(s_time, FMT) - datetime.datetime.strptime(time_c, FMT)
@@ -204,16 +503,16 @@ class MyHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                     Client_transfer=0
                 else:
                     Client_transfer=abs(float(time_c)-start_time)
-                config_cdash.LOG.info('sent header time {}'.format(time_c))
-                config_cdash.LOG.info('start time {}'.format(start_time))
-                config_cdash.LOG.info('Client transfer time {}'.format(Client_transfer))
-                config_cdash.LOG.info('request time {}'.format(request_t))
+                config_cdash.LOG.info('sent header time %s', time_c)
+                config_cdash.LOG.info('start time %s', start_time)
+                config_cdash.LOG.info('Client transfer time %s', Client_transfer)
+                config_cdash.LOG.info('request time %s', request_t)
                 if request_t=='NULL':
                     request_t=0.0
                 if request_size=='NULL':
                     request_size=0.0
                 request_size = float(request_size)*8
-                config_cdash.LOG.info('transfer size:{} '.format(request_size))
+                config_cdash.LOG.info('transfer size:%s ', request_size)
                 request_time=float(request_t+(Client_transfer*2))
                 throughput = float(request_size)/(request_time)
                 #config_cdash.LOG.info('Adding row to Throughput database : '
@@ -221,40 +520,31 @@ class MyHTTPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 #cursor.execute('INSERT INTO THROUGHPUTDATA(ENTRYID, USERNAME, SESSIONID, REQUESTSIZE, REQUESTTIME, THROUGHPUT, C_THROUGHPUT) '
                 #                      'VALUES (?,?, ?, ?, ?, ?, ?);', (entry_id, username, session_id, request_size, request_time,throughput,client_throughput))
                 #TH_CONN.commit()
-                cache_manager.list_data.append((entry_id, username, session_id, request_size, request_time,throughput,client_throughput,None,None))
-                #config_cdash.LOG.info('list_data in the begining:{} '.format(cache_manager.list_data))
-                cache_manager.current_queue.put((request, username, session_id))
+                throughput_sample = cache_manager.throughput_store.add_sample(entry_id, username, session_id,
+                                                                              request_size, request_time, throughput,
+                                                                              client_throughput)
+                cache_manager.current_queue.put((request, username, session_id, throughput_sample))
 
             else:
-                config_cdash.LOG.warning('Invalid video file request: {}'.format(request))
-        else:
-            self.send_response(HTTP_NOT_FOUND)
-            config_cdash.LOG.warning('Could not find file {}'.format(request))
-            return
+                self.send_error(HTTP_NOT_FOUND)
+                config_cdash.LOG.warning('Could not find file {}'.format(request))
+                return
 
 
-def parse_mpd(mpd_file, request, mpd_headers, client_id):
-    """ Module to parse the MPD_file and update the global dictionaries MPD_DICT, USER_DICT
-    :param mpd_file: Path to mpd_file on local machine
-    :param request: HTTP request path string
-    :param mpd_headers: HPP Headers
-    :param client_address: (ip_address, port) of the user
+def update_user_dict(mpd_entry, client_id):
+    """ Module to update the global dictionary USER_DICT with the bitrates of the MPD requested by the client
+    :param mpd_entry: MpdEntry of the catalog
+    :param client_id: (username, session_id) of the client
     :return:
     """
-    #parse mpd that you have in cache
-    global USER_DICT, MPD_DICT, USER_DICT_LOCK
-    dash_playback_object = read_mpd.read_mpd(mpd_file)
-    MPD_DICT[request] = {'bandwidth_list': dash_playback_object.video['bandwidth_list'],
-                         'http_headers': mpd_headers}
-    # use json file in cache
-    config_cdash.LOG.info('Added info of {}: {} to MPD_DICT'.format(request, MPD_DICT))
-    with open(config_cdash.MPD_DICT_JSON_FILE, 'wb') as outfile:
-        json.dump(MPD_DICT, outfile)
+    global USER_DICT, USER_DICT_LOCK
+    if not mpd_entry.title:
+        return
+    bitrates = CATALOG.get_title(mpd_entry.title).bitrates
     with USER_DICT_LOCK:
-        USER_DICT[client_id] = {'bitrates': dash_playback_object.video['bandwidth_list'],
+        USER_DICT[client_id] = {'bitrates': bitrates,
                                 'created': time.time()}
-        config_cdash.LOG.info('Updated the USER_DICT with {} and bitrates {}'.format(
-            client_id, dash_playback_object.video['bandwidth_list']))
+        config_cdash.LOG.debug('Updated the USER_DICT with %s and bitrates %s', client_id, bitrates)
 
 
 def hash_code(file_name):
@@ -279,32 +569,33 @@ def main():
 
     config_cdash.LOG = configure_cdash_log.configure_log(config_cdash.LOG_FILENAME, config_cdash.LOG_NAME,
                                                          config_cdash.LOG_LEVEL)
-    global MPD_DICT
-    global TH_CONN
     #global D_CONN
-    global cursor
     config_cdash.LOG.info('Starting the cache in {} mode'.format(config_cdash.PREFETCH_SCHEME))
-    if TH_CONN == None:
-        TH_CONN = create_db.create_db(config_cdash.THROUGHPUT_DATABASE, config_cdash.THROUGHPUT_TABLES)
+    # The THROUGHPUTDATA table is created and written by the throughput store of the Cache Manager
     #if D_CONN == None:
     #    D_CONN = create_db.create_db(config_cdash.DELTA_DATABASE, config_cdash.DELTA_TABLES)
-    try:
-        with open(config_cdash.MPD_DICT_JSON_FILE, 'rb') as infile:
-            MPD_DICT = json.load(infile)
-    except IOError:
-        config_cdash.LOG.warning('Starting Cache for first time. Could not find any MPD_json file. ')
+    # The MPD files and titles fetched in the previous runs
+    CATALOG.load()
     # Starting the Cache Manager
     global cache_manager
     config_cdash.LOG.info('Starting the Cache Manager')
     cache_manager = CacheManager.CacheManager()
+    if cache_metrics.start_profiler():
+        config_cdash.LOG.info('Started the sampling profiler. Interval = {}s'.format(config_cdash.PROFILER_INTERVAL))
     # Function to start server
-    http_server = BaseHTTPServer.HTTPServer((config_cdash.HOSTNAME, config_cdash.PORT_NUMBER),
-                                            MyHTTPRequestHandler)
+    if config_cdash.SERVER_WORKERS:
+        http_server = ThreadPoolHTTPServer((config_cdash.HOSTNAME, config_cdash.PORT_NUMBER),
+                                           MyHTTPRequestHandler, config_cdash.SERVER_WORKERS)
+        config_cdash.LOG.info('Serving the requests with {} worker threads'.format(config_cdash.SERVER_WORKERS))
+    else:
+        http_server = BaseHTTPServer.HTTPServer((config_cdash.HOSTNAME, config_cdash.PORT_NUMBER),
+                                                MyHTTPRequestHandler)
     config_cdash.LOG.info("Cache-Server listening on {}, port:{} - press ctrl-c to stop".format(config_cdash.HOSTNAME,
                                                                                             config_cdash.PORT_NUMBER))
     try:
         http_server.serve_forever()
     except KeyboardInterrupt:
+        http_server.server_close()
         config_cdash.LOG.info('Terminating the Cache Manager')
         cache_manager.terminate()
         return
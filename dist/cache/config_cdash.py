@@ -31,38 +31,95 @@ from time import strftime
 # CACHE Server Parameters
 HOSTNAME = '10.10.3.1'
 PORT_NUMBER = 8001
-MPD_SOURCE_LIST = ['BigBuckBunny_4s_simple_2014_05_09.mpd', 'mpd/BigBuckBunny_4s.mpd','ElephantsDream_4s_simple_2014_05_09.mpd','mpd/ElephantsDream_4s.mpd','OfForestAndMen_4s_simple_2014_05_09.mpd','mpd/OfForestAndMen_4s.mpd','TearsOfSteel_4s_simple_2014_05_09.mpd','mpd/TearsOfSteel_4s.mpd']
+# Number of worker threads serving the requests. The idle keep-alive connections do not hold a worker.
+# Set to 0 to serve the requests in a single thread
+SERVER_WORKERS = 64
+# Idle keep-alive connections are closed after these many seconds
+KEEP_ALIVE_TIMEOUT = 15
+# Chunk size (in bytes) used to send the files when sendfile is not available
+SEND_CHUNK_SIZE = 64 * 1024
 CWD = os.getcwd()
 
-MPD_DICT_JSON_FILE = os.path.join(CWD, 'MPD_DICT.json')
-MPD_FOLDER = os.path.join(CWD, 'MPD_FILES')
-if not os.path.exists(MPD_FOLDER):
-    os.makedirs(MPD_FOLDER)
+# Append-only log of the content catalog (one JSON line per MPD file). Replayed when the cache starts
+CATALOG_LOG_FILE = os.path.join(CWD, 'CATALOG.log')
 # Parameters for the priority cache
 FETCH_CODE = 'FETCH'
 PREFETCH_CODE = 'PRE-FETCH'
 #CONTENT_SERVER = 'http://www-itec.uni-klu.ac.at/ftp/datasets/DASHDataset2014/BigBuckBunny/4sec/'
 #CONTENT_SERVER = 'http://127.0.0.1/media/BigBuckBunny/4sec/'
 CONTENT_SERVER = 'http://10.10.2.1/www-itec.uni-klu.ac.at/ftp/datasets/DASHDataset2014/'
-SERVER =['BigBuckBunny/4sec/','ElephantsDream/4sec/','OfForestAndMen/4sec/','TearsOfSteel/4sec']
+# MPD files served by the cache: {MPD request path: folder of the video on the CONTENT_SERVER}
+# The MPD and the segments of the video are fetched from CONTENT_SERVER + folder + request path.
+# The segments are known to the cache once the MPD is fetched (see prioritycache/content_catalog.py)
+MPD_SOURCES = {'BigBuckBunny_4s_simple_2014_05_09.mpd': 'BigBuckBunny/4sec/',
+               'mpd/BigBuckBunny_4s.mpd': 'BigBuckBunny/4sec/',
+               'ElephantsDream_4s_simple_2014_05_09.mpd': 'ElephantsDream/4sec/',
+               'mpd/ElephantsDream_4s.mpd': 'ElephantsDream/4sec/',
+               'OfForestAndMen_4s_simple_2014_05_09.mpd': 'OfForestAndMen/4sec/',
+               'mpd/OfForestAndMen_4s.mpd': 'OfForestAndMen/4sec/',
+               'TearsOfSteel_4s_simple_2014_05_09.mpd': 'TearsOfSteel/4sec/',
+               'mpd/TearsOfSteel_4s.mpd': 'TearsOfSteel/4sec/'}
 VIDEO_FOLDER = os.path.join(CWD, 'Videos')
 VIDEO_FILE_EXTENTION = 'm4s'
 if not os.path.exists(VIDEO_FOLDER):
     os.makedirs(VIDEO_FOLDER)
-else:
-    print "Clearing the Cache"
-    import glob
-    video_match = os.path.join(VIDEO_FOLDER, "*")
-    video_list = glob.glob(video_match)
-    for video_file in video_list:
-        os.remove(video_file)
-
-CACHE_LIMIT = 100
+# Keep the segments in VIDEO_FOLDER across restarts. The cache is restored from the manifest when it starts.
+# Set to False to clear the cache at start
+CACHE_WARM_RESTART = True
+# Manifest of the segments in the cache (sqlite): file name, size, HTTP headers, hits and last access
+CACHE_MANIFEST_DATABASE = os.path.join(CWD, 'cache_manifest.db')
+CACHE_MANIFEST_TABLES = ["CREATE TABLE IF NOT EXISTS CACHEMANIFEST("
+                         "SEGMENTKEY TEXT PRIMARY KEY,"
+                         "FILENAME TEXT,"
+                         "SIZE INTEGER,"
+                         "HTTPHEADERS TEXT,"
+                         "HITS INTEGER,"
+                         "LASTACCESS FLOAT);"]
+# The manifest updates are written in batches of up to CACHE_MANIFEST_WRITE_BATCH updates
+# or every CACHE_MANIFEST_WRITE_INTERVAL seconds. Updates are dropped if more than CACHE_MANIFEST_WRITE_QUEUE_LIMIT
+# are pending
+CACHE_MANIFEST_WRITE_BATCH = 1000
+CACHE_MANIFEST_WRITE_INTERVAL = 1
+CACHE_MANIFEST_WRITE_QUEUE_LIMIT = 100000
+
+# Size of the cache in bytes. Segments are evicted once the cache grows beyond this limit
+CACHE_LIMIT = 2 * 1024 * 1024 * 1024
+# Replacement policy for the cache. Could be 'LRU', 'LFU' or 'DASH'
+CACHE_REPLACEMENT_POLICY = 'DASH'
+# Policies that are simulated on the same requests (without storing the files) to compare the hit rates
+CACHE_SHADOW_POLICIES = ['LRU', 'LFU', 'DASH']
+# Parameters for the DASH replacement policy
+DASH_POPULARITY_WEIGHT = 1.0
+DASH_PLAYHEAD_WEIGHT = 2.0
+# Applied to the pre-fetched segments that were never requested once every live playhead is past them
+DASH_UNUSED_PREFETCH_PENALTY = 0.5
+# Playheads of the sessions that have not made a request in these many seconds are ignored
+DASH_PLAYHEAD_TIMEOUT = 60
+# Maximum number of entries re-scored to find one victim. The top entry is evicted once the limit is reached
+DASH_VICTIM_RESCORE_LIMIT = 16
 #PREFETCH_LIMIT = 100
 PREFETCH_SCHEME = 'BASIC'
 #PREFETCH_SCHEME = 'SMART'
 CURRENT_THREAD = True
 PREFETCH_THREAD = True
+# Number of threads pre-fetching the segments
+PREFETCH_WORKERS = 4
+# Number of segments pre-fetched ahead of the current request of each session
+PREFETCH_DEPTH = 3
+# Duration of the segments in seconds. Used to order the pre-fetch queue by the deadline of the segments
+SEGMENT_DURATION = 4
+# Sessions that have not made a request in these many seconds no longer keep their pre-fetches in the queue
+PREFETCH_SESSION_TIMEOUT = 60
+# Number of threads downloading the segments requested by the clients from the content server
+# Bounds the concurrent downloads and the data held in memory for the segments that are streamed
+DOWNLOAD_WORKERS = 8
+# Persistent connections to the content server
+ORIGIN_TIMEOUT = 10
+ORIGIN_MAX_IDLE_CONNECTIONS = 8
+# Read size (in bytes) for the downloads from the content server
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Suffix of the files of the segments that are being downloaded. Renamed to the segment file once complete
+DOWNLOAD_TEMPORARY_SUFFIX = '.part'
 
 # The number of previous samples to be considered, If set as None then all samples are considered
 # Throughput measurement limits
@@ -71,6 +128,15 @@ LIMIT = 10
 SCHEME ='average'
 #SCHEME = 'harmonic_mean'
 TABLE_RETRY_TIME = 5
+# Number of recent throughput samples kept for each session
+THROUGHPUT_HISTORY = 32
+# Sessions that have not made a request in these many seconds are dropped from the throughput store
+THROUGHPUT_SESSION_TIMEOUT = 300
+# The throughput samples are written to the database in batches of up to THROUGHPUT_WRITE_BATCH rows
+# or every THROUGHPUT_WRITE_INTERVAL seconds. Rows are dropped if more than THROUGHPUT_WRITE_QUEUE_LIMIT are pending
+THROUGHPUT_WRITE_BATCH = 500
+THROUGHPUT_WRITE_INTERVAL = 1
+THROUGHPUT_WRITE_QUEUE_LIMIT = 100000
 
 # We store the throughput values in a local database
 THROUGHPUT_DATABASE_FOLDER = os.path.join(CWD, 'Throughput_db')
@@ -115,8 +181,21 @@ LOG_FILENAME = os.path.join(LOG_FOLDER, strftime('cache_n_dash_LOG_{}_%Y-%m-%d.%
 LOG_FILE_HANDLE = None
 # To be set by configure_log_file.py
 LOG = None
-
-# TODO: Maybe put the following in a JSON?
+# The log records are queued and written by a background thread. Records are dropped when the queue is full
+LOG_QUEUE_SIZE = 10000
+
+# Metrics served on /metrics (Prometheus text format) and /stats (JSON)
+METRICS_PATH = 'metrics'
+STATS_PATH = 'stats'
+# Upper bounds (in seconds) of the latency histogram buckets
+METRICS_LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# Interval (in seconds) of the sampling profiler. Set to None to disable the profiler
+PROFILER_INTERVAL = None
+# Number of hot spots of the profiler reported on /stats
+PROFILER_TOP_COUNT = 20
+
+# Videos of the DASH dataset. The cache reads the segments from the MPD files (MPD_SOURCES).
+# Used by the stand-in content server of the load tests (benchmark/content_server.py)
 VIDEO_CACHE_CONTENT = {
     'bunny': {'available-bitrate': [45226, 88783, 128503, 177437, 217761, 255865, 323047, 378355, 509091,
                                     577751, 782553, 1008699, 1207152, 1473801, 2087347, 2409742, 2944291,
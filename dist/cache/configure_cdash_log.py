@@ -7,31 +7,90 @@ Institution: University of Missouri-Kansas City
 Contact Email: pjuluri@umkc.edu
 """
 
+import atexit
 import logging
+import threading
+import Queue
 import config_cdash
 import sys
 
 
+class QueueHandler(logging.Handler):
+    """ Handler that puts the log records in a queue without blocking.
+    The records are written to the target handlers by a QueueListener.
+    """
+    def __init__(self, record_queue):
+        logging.Handler.__init__(self)
+        self.record_queue = record_queue
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            # Format the message in the calling thread. The arguments might change before the record is written
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.record_queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener():
+    """ Thread that writes the queued log records to the handlers """
+    def __init__(self, record_queue, handlers):
+        self.record_queue = record_queue
+        self.handlers = handlers
+        self.listener_thread = threading.Thread(target=self.listener_function, args=())
+        self.listener_thread.daemon = True
+
+    def start(self):
+        self.listener_thread.start()
+
+    def stop(self):
+        """ Write the queued records and stop the thread """
+        self.record_queue.put(None)
+        self.listener_thread.join()
+
+    def listener_function(self):
+        while True:
+            record = self.record_queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
 def configure_log(log_filename, log_name, log_level):
     """ Module to configure the log file and the log parameters.
     Logs are streamed to the log file as well as the screen.
+    The records are written by a background thread so that logging does not block the requests.
     """
     log = logging.getLogger(log_name)
     log.setLevel(log_level)
     log_formatter = logging.Formatter('%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s')
+    handlers = []
 
     # Add the handler to print to the screen
     handler1 = logging.StreamHandler(sys.stdout)
     handler1.setFormatter(log_formatter)
-    log.addHandler(handler1)
-    
+    handlers.append(handler1)
+
     # Add the handler to for the file if present
     if log_filename:
         print("Configuring log file: {}".format(log_filename))
         handler2 = logging.FileHandler(filename=log_filename)
         handler2.setFormatter(log_formatter)
-        log.addHandler(handler2)
+        handlers.append(handler2)
         print("Started logging in the log file:{}".format(log_filename))
-    return log
-
 
+    record_queue = Queue.Queue(maxsize=config_cdash.LOG_QUEUE_SIZE)
+    log.addHandler(QueueHandler(record_queue))
+    listener = QueueListener(record_queue, handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return log
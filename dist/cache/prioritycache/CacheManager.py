@@ -24,9 +24,12 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 import threading
 import time
 from prioritycache.cache_module import check_content_server
-from prioritycache.cache_module import segment_exists
 from prioritycache.prefetch_scheme import get_prefetch
+from prioritycache.prefetch_scheme import get_lookahead
+from prioritycache.prefetch_queue import DeadlinePrefetchQueue
+from prioritycache.throughput_store import ThroughputStore
 import configure_cdash_log
+import cache_metrics
 from PriorityCache import PriorityCache
 import config_cdash
 import Queue
@@ -53,47 +56,68 @@ class CacheManager():
         self.prefetch_request_count = 0
         config_cdash.LOG.info('Initializing the Cache Manager')
         self.cache = PriorityCache(cache_size)
-        self.prefetch_queue = CheckableQueue()
-        self.backup_prefetch_queue = CheckableQueue()
+        self.prefetch_queue = DeadlinePrefetchQueue()
+        self.prefetch_count_lock = threading.Lock()
         self.current_queue = CheckableQueue()
+        self.throughput_store = ThroughputStore(config_cdash.THROUGHPUT_DATABASE)
         self.stop = threading.Event()
         self.current_thread = threading.Thread(target=self.current_function, args=())
         self.current_thread.daemon = True
         self.current_thread.start()
         config_cdash.LOG.info('Started the Current fetch thread')
-        self.prefetch_thread = threading.Thread(target=self.prefetch_function, args=())
-        self.prefetch_thread.daemon = True
-        self.prefetch_thread.start()
-        config_cdash.LOG.info('Started the Preftech thread')
-        self.list_data=[]
+        self.prefetch_threads = []
+        for _ in range(config_cdash.PREFETCH_WORKERS):
+            prefetch_thread = threading.Thread(target=self.prefetch_function, args=())
+            prefetch_thread.daemon = True
+            prefetch_thread.start()
+            self.prefetch_threads.append(prefetch_thread)
+        config_cdash.LOG.info('Started {} Preftech threads'.format(config_cdash.PREFETCH_WORKERS))
+        self.register_metrics()
+
+    def register_metrics(self):
+        """ Register the queue sizes and cache statistics. They are read only when the metrics are rendered """
+        metrics = cache_metrics.METRICS
+        metrics.function('cache_current_queue_size', 'Requests waiting for the current thread',
+                         self.current_queue.qsize)
+        metrics.function('cache_download_queue_size', 'Fetched segments waiting for a download thread',
+                         self.cache.download_queue.qsize)
+        metrics.function('cache_prefetch_queue_size', 'Segments waiting to be pre-fetched',
+                         self.prefetch_queue.qsize)
+        metrics.function('cache_prefetch_cancelled_total', 'Stale pre-fetch requests that were cancelled',
+                         lambda: self.prefetch_queue.cancelled, 'counter')
+        metrics.function('cache_prefetch_requests_total', 'Segments pre-fetched from the content server',
+                         lambda: self.prefetch_request_count, 'counter')
+        metrics.function('cache_bytes', 'Bytes of the segments in the cache',
+                         lambda: self.cache.index.current_bytes)
+        metrics.function('cache_evicted_bytes_total', 'Bytes evicted from the cache',
+                         lambda: self.cache.index.stats.evicted_bytes, 'counter')
+        metrics.function('cache_wasted_prefetch_bytes_total', 'Pre-fetched bytes evicted before they were requested',
+                         lambda: self.cache.index.stats.wasted_prefetch_bytes, 'counter')
 
     def terminate(self):
+        for policy_name, stats in self.cache.get_stats().items():
+            config_cdash.LOG.info('Cache stats for {}: {}'.format(policy_name, stats))
         self.stop.set()
-        self.prefetch_thread.join()
+        # Wake up the current thread. The pre-fetch threads are daemon threads blocked on the pre-fetch queue
+        self.current_queue.put(None)
         self.current_thread.join()
+        self.throughput_store.terminate()
+        self.cache.terminate()
 
     def fetch_file(self, file_path, username=None,session_id=None):
-        """ Module to get the file """
-        config_cdash.LOG.info('Fetching the file {}'.format(file_path))
-        n=self.backup_prefetch_queue.qsize()
-        config_cdash.LOG.info('size of backup_prefetch_queue {} '.format(n))
-        if n!=0:
-            #item = self.backup_prefetch_queue.get()
-            #config_cdash.LOG.info('item {}'.format(item))
-            #config_cdash.LOG.info('size of backup_prefetch_queue {} '.format(n))
-            while file_path in self.backup_prefetch_queue.queue and not segment_exists(file_path):
-                config_cdash.LOG.warning('Witing untill Prefetch is complete')
-                time.sleep(1)
-                continue
-            if file_path not in self.backup_prefetch_queue.queue and not segment_exists(file_path):
-                config_cdash.LOG.warning('the request is not prefetched yet and not in the cache')
-
-        local_filepath, http_headers = self.cache.get_file(file_path, config_cdash.FETCH_CODE)
-        config_cdash.LOG.info('Added {} to current queue'.format(file_path))
-        #self.current_queue.put((file_path, username, session_id))
+        """ Module to get the file.
+        Does not wait for segments that are being downloaded (fetched or pre-fetched)
+        :return: (local_filepath, http_headers, None) if the file is in the cache
+                 (None, None, in_flight) with the InFlightDownload to stream the file from otherwise
+        """
+        config_cdash.LOG.debug('Fetching the file %s', file_path)
+        local_filepath, http_headers, in_flight = self.cache.get_stream(file_path, config_cdash.FETCH_CODE,
+                                                                        (username, session_id))
+        if in_flight:
+            config_cdash.LOG.debug('Streaming %s from the in-flight download', file_path)
         self.fetch_requests += 1
-        config_cdash.LOG.info('Total fetch Requests = {}'.format(self.fetch_requests))
-        return local_filepath, http_headers
+        config_cdash.LOG.debug('Total fetch Requests = %s', self.fetch_requests)
+        return local_filepath, http_headers, in_flight
 
     def current_function(self):
         """
@@ -103,133 +127,95 @@ class CacheManager():
         We use a separate prefetch queue to ensure that the prefetch does not affect the performance
         of the current requests
         """
-        config_cdash.LOG.info('Current Thread: Started thread. Stop value = {}'.format(self.stop.is_set()))
+        config_cdash.LOG.debug('Current Thread: Started thread. Stop value = %s', self.stop.is_set())
         while not self.stop.is_set():
             try:
-                current_request, username, session_id = self.current_queue.get(timeout=None)
-                config_cdash.LOG.info('Retrieved the file: {}'.format(current_request))
+                current_item = self.current_queue.get(timeout=None)
             except Queue.Empty:
                 config_cdash.LOG.error('Current Thread: Thread GET returned Empty value')
                 current_request = None
                 continue
+            if current_item is None:
+                continue
+            current_request, username, session_id, throughput_sample = current_item
+            config_cdash.LOG.debug('Retrieved the file: %s', current_request)
             # Determining the next bitrates and adding to the prefetch list
             if current_request:
                 if config_cdash.PREFETCH_SCHEME == 'SMART':
                     a=0.8
                     d=0.2
-                    config_cdash.LOG.info('smart')
-                    throughput_client= self.get_throughput_client(username, session_id)
+                    config_cdash.LOG.debug('smart')
+                    throughput_client = throughput_sample.client_throughput
                     if throughput_client== None:
-                        config_cdash.LOG.info('throughput client:=None')
-                        throughput= self.get_throughput_info(username, session_id, config_cdash.LIMIT, config_cdash.SCHEME)
-                        config_cdash.LOG.info('average of throughput: = {}'.format(throughput))
+                        config_cdash.LOG.debug('throughput client:=None')
+                        throughput= self.throughput_store.get_throughput(username, session_id, config_cdash.LIMIT,
+                                                                         config_cdash.SCHEME)
+                        config_cdash.LOG.debug('average of throughput: = %s', throughput)
                         forecast_throughput=throughput
-                        self.insert_forecast(username, session_id,0.0)
-                        self.insert_trend(username, session_id,0.0)
-                        config_cdash.LOG.info('forecast throughput equal throughput:= {}'.format(forecast_throughput))
+                        self.throughput_store.update_forecast(throughput_sample, 0.0, 0.0)
+                        config_cdash.LOG.debug('forecast throughput equal throughput:= %s', forecast_throughput)
                         prefetch_request, prefetch_bitrate = get_prefetch(current_request, config_cdash.PREFETCH_SCHEME,forecast_throughput)
                     else:
-                        config_cdash.LOG.info('throughput client:= {}'.format(throughput_client))
+                        config_cdash.LOG.debug('throughput client:= %s', throughput_client)
                         At_1=float(throughput_client)
-                        config_cdash.LOG.info('type of At_1:= {}'.format(type(At_1)))
-                        FIT_t_1=self.get_previous_forecast(username, session_id)
-                        config_cdash.LOG.info('previous forecast:= {}'.format(FIT_t_1))
-                        config_cdash.LOG.info('type of FIT_t_1:= {}'.format(type(FIT_t_1)))
-                        Tt_1=self.get_previous_trend(username, session_id)
-                        config_cdash.LOG.info('previous trend:= {}'.format(Tt_1))
-                        config_cdash.LOG.info('type of Tt_1:= {}'.format(type(Tt_1)))
+                        config_cdash.LOG.debug('type of At_1:= %s', type(At_1))
+                        # Forecast and trend of the previous request of this session
+                        FIT_t_1, Tt_1 = self.throughput_store.get_forecast(username, session_id)
+                        config_cdash.LOG.debug('previous forecast:= %s', FIT_t_1)
+                        config_cdash.LOG.debug('type of FIT_t_1:= %s', type(FIT_t_1))
+                        config_cdash.LOG.debug('previous trend:= %s', Tt_1)
+                        config_cdash.LOG.debug('type of Tt_1:= %s', type(Tt_1))
                         Ft=FIT_t_1+a*(At_1-FIT_t_1)
                         Tt=Tt_1+d*(Ft-FIT_t_1)
                         FIT_t=Ft+Tt
-                        self.insert_forecast(username, session_id,FIT_t)
-                        self.insert_trend(username, session_id,Tt)
-                        config_cdash.LOG.info('forecast throughput: {}'.format(FIT_t))
+                        self.throughput_store.update_forecast(throughput_sample, FIT_t, Tt)
+                        config_cdash.LOG.debug('forecast throughput: %s', FIT_t)
                         prefetch_request, prefetch_bitrate = get_prefetch(current_request, config_cdash.PREFETCH_SCHEME,FIT_t)
                 else:
                     prefetch_request, prefetch_bitrate = get_prefetch(current_request, config_cdash.PREFETCH_SCHEME, None)
-                    config_cdash.LOG.info('not smart')
-            if not segment_exists(prefetch_request):
-                config_cdash.LOG.info('Segment not there {}'.format(prefetch_request))
-                if check_content_server(prefetch_request):
-                    t=type(prefetch_request)
-                    config_cdash.LOG.info('Type will be saved in queue: {}'.format(t))
-                    config_cdash.LOG.info('Current Thread: Current segment: {}, Next segment: {}'.format(current_request,
-                                                                                                  prefetch_request))
-                    self.prefetch_queue.put(prefetch_request)
-                    self.backup_prefetch_queue.put(prefetch_request)
-                    config_cdash.LOG.info('Pre-fetch queue count = {}'.format(self.prefetch_queue.qsize()))
+                    config_cdash.LOG.debug('not smart')
+                self.throughput_store.write(throughput_sample)
+            # Queued segments that the session moved past or switched away from are cancelled
+            self.prefetch_queue.update_session((username, session_id), current_request, prefetch_bitrate)
+            # No pre-fetch after the last segment of the video
+            prefetch_requests = [prefetch_request] if prefetch_request else []
+            if prefetch_request and config_cdash.PREFETCH_DEPTH > 1:
+                prefetch_requests += get_lookahead(prefetch_request, config_cdash.PREFETCH_DEPTH - 1)
+            for prefetch_request in prefetch_requests:
+                # Answered from the cache index. Segments that are being downloaded count as existing
+                if not self.cache.segment_exists(prefetch_request):
+                    config_cdash.LOG.debug('Segment not there %s', prefetch_request)
+                    if check_content_server(prefetch_request):
+                        config_cdash.LOG.debug('Current Thread: Current segment: %s, Next segment: %s',
+                                               current_request, prefetch_request)
+                        self.prefetch_queue.put(prefetch_request, (username, session_id))
+                        config_cdash.LOG.debug('Pre-fetch queue count = %s', self.prefetch_queue.qsize())
+                    else:
+                        config_cdash.LOG.debug('Current Thread: Invalid Next segment: %s', prefetch_request)
+                        break
                 else:
-                    config_cdash.LOG.info('Current Thread: Invalid Next segment: {}'.format(current_request, prefetch_request))
-            else:
-                config_cdash.LOG.info('Segment already there {}'.format(prefetch_request))
+                    config_cdash.LOG.debug('Segment already there %s', prefetch_request)
         else:
             config_cdash.LOG.warning('Current Thread: terminated')
 
     def prefetch_function(self):
-        """ Function that reads the contents of the prefetch table in the database and pre-fetches the file into
-            the cache
+        """ Function that reads the pre-fetch queue (earliest deadline first) and pre-fetches the file into
+            the cache. PREFETCH_WORKERS threads run this function.
             We use a separate prefetch queue to ensure that the prefetch does not affect the performance
             of the current requests
         """
         while not self.stop.is_set():
+            # Pre-fetching the files
+            prefetch_request = self.prefetch_queue.get()
+            #config_cdash.LOG.info('user {} Pre-fetching the segment: {}'.format(username,prefetch_request))
+            config_cdash.LOG.debug('Pre-fetching the segment: %s', prefetch_request)
             try:
-                # Pre-fetching the files
-                prefetch_request = self.prefetch_queue.get(timeout=None)
-            except Queue.Empty:
-                config_cdash.LOG.error('Could not read from the Pre-fetch queue')
-                time.sleep(config_cdash.WAIT_TIME)
+                self.cache.get_file(prefetch_request, config_cdash.PREFETCH_CODE)
+            except Exception as error:
+                config_cdash.LOG.error('Unable to pre-fetch the segment {}: {}'.format(prefetch_request, error))
                 continue
-            #config_cdash.LOG.info('user {} Pre-fetching the segment: {}'.format(username,prefetch_request))
-            config_cdash.LOG.info('Pre-fetching the segment: {}'.format(prefetch_request))
-            self.cache.get_file(prefetch_request, config_cdash.PREFETCH_CODE)
-            self.prefetch_request_count += 1
-            config_cdash.LOG.info('Pre-fetch request count = {}'.format(self.prefetch_request_count))
+            with self.prefetch_count_lock:
+                self.prefetch_request_count += 1
+            config_cdash.LOG.debug('Pre-fetch request count = %s', self.prefetch_request_count)
         else:
             config_cdash.LOG.warning('Pre-fetch thread terminated')
-
-
-    def get_throughput_info(self,username, session_id, limit, scheme='average'):
-        last_row_tuple=self.list_data[-1]
-        config_cdash.LOG.info('last row = {}'.format(last_row_tuple))
-        cache_throughput=last_row_tuple[5]
-        return cache_throughput
-
-
-    def get_throughput_client(self,username, session_id):
-        last_row_tuple=self.list_data[-1]
-        config_cdash.LOG.info('last row = {}'.format(last_row_tuple))
-        client_throughput=last_row_tuple[6]
-        return client_throughput
-
-    def insert_forecast(self,username, session_id,forecast):
-        last_row_tuple=self.list_data[-1]
-        config_cdash.LOG.info('last row = {}'.format(last_row_tuple))
-        last_row=list(last_row_tuple)
-        last_row[8]=forecast
-        last_row_tuple=tuple(last_row)
-        config_cdash.LOG.info('last row = {}'.format(last_row_tuple))
-        self.list_data[-1]=last_row_tuple
-        #config_cdash.LOG.info('list_data= {}'.format(self.list_data))
-
-    def get_previous_forecast(self,username, session_id):
-        previous_row_tuple=self.list_data[-2]
-        config_cdash.LOG.info('previos row = {}'.format(previous_row_tuple))
-        forecast=previous_row_tuple[8]
-        return forecast
-
-    def insert_trend(self,username, session_id,trend):
-        last_row_tuple=self.list_data[-1]
-        config_cdash.LOG.info('last row = {}'.format(last_row_tuple))
-        last_row=list(last_row_tuple)
-        last_row[7]=trend
-        last_row_tuple=tuple(last_row)
-        config_cdash.LOG.info('last row = {}'.format(last_row_tuple))
-        self.list_data[-1]=last_row_tuple
-        #config_cdash.LOG.info('list_data= {}'.format(self.list_data))
-
-    def get_previous_trend(self,username, session_id):
-        previous_row_tuple=self.list_data[-2]
-        config_cdash.LOG.info('previous row = {}'.format(previous_row_tuple))
-        trend=previous_row_tuple[7]
-        return trend
-
@@ -1,10 +1,16 @@
 __author__ = 'pjuluri'
 
 from download_file import download_file
-import collections
-import glob
+from replacement_policy import CacheIndex
+from in_flight import InFlightDownload
+from content_catalog import CATALOG
+from cache_manifest import CacheManifest, ManifestEntry
 import os
+import threading
+import Queue
+import time
 import config_cdash
+import cache_metrics
 
 def get_segment_local_path(segment_path):
     """ Module to get the path of the segment on the local harddisk"""
@@ -13,32 +19,22 @@ def get_segment_local_path(segment_path):
     return local_filepath
 
 
-def download_segment(segment_path):
-    """ Function to download the segment"""
-    #segment_url = config_cdash.CONTENT_SERVER + segment_path
-    if "Big" in segment_path:
-        segment_url = config_cdash.CONTENT_SERVER + config_cdash.SERVER[0]+ segment_path
-    elif "Elephants" in segment_path:
-        segment_url = config_cdash.CONTENT_SERVER + config_cdash.SERVER[1]+segment_path
-    elif "OfForest" in segment_path:
-        segment_url = config_cdash.CONTENT_SERVER + config_cdash.SERVER[2]+segment_path
-    elif "Tears" in segment_path:
-        segment_url = config_cdash.CONTENT_SERVER + config_cdash.SERVER[3]+segment_path
+def download_segment(segment_path, in_flight=None):
+    """ Function to download the segment
+    :param in_flight: InFlightDownload that receives the data as it is downloaded
+    """
+    segment = CATALOG.lookup(segment_path)
+    if not segment:
+        raise ValueError('Segment {} is not in the catalog'.format(segment_path))
     local_filepath = get_segment_local_path(segment_path)
-    return download_file(segment_url, local_filepath)
-
-
-class Counter(dict):
-    """Dictionary where the default value is 0"""
-    def __missing__(self, key):
-        return 0
+    return download_file(segment.origin_url, local_filepath, in_flight)
 
 
 def remove_file(segment_path):
     """ Module to delete file from the harddisk"""
     # TDOD: Configure for MPD files as well
+    local_filepath = get_segment_local_path(segment_path)
     if config_cdash.VIDEO_FILE_EXTENTION in segment_path:
-        local_filepath = get_segment_local_path(segment_path)
         try:
             os.remove(local_filepath)
             config_cdash.LOG.info("Deleteing segment {} from harddisk".format(local_filepath))
@@ -52,113 +48,257 @@ def remove_file(segment_path):
 
 
 class PriorityCache():
-    """Least-recently-used cache decorator.
-    Arguments to the cached function must be hashable.
-    Cache performance statistics stored in f.hits and f.misses.
-    Clear the cache with f.clear().
-    http://en.wikipedia.org/wiki/Cache_algorithms#Least_Recently_Used
+    """Size-aware segment cache.
+    The segments are stored on the harddisk and evicted once the total size exceeds
+    max_bytes. The eviction order is decided by the replacement policy
+    (config_cdash.CACHE_REPLACEMENT_POLICY). The same requests are replayed on metadata-only
+    shadow indexes (config_cdash.CACHE_SHADOW_POLICIES) to compare the hit rates of the policies.
+    The segments are recorded in the manifest and restored from it when the cache starts
+    (config_cdash.CACHE_WARM_RESTART).
     """
-    def __init__(self, maxsize):
+    def __init__(self, max_bytes, policy=config_cdash.CACHE_REPLACEMENT_POLICY,
+                 shadow_policies=config_cdash.CACHE_SHADOW_POLICIES, manifest=None):
+        """
+        :param manifest: CacheManifest of the segments. The default manifest database if None
+        """
         self.cache = {}
-        # Creating a queue for the FIFO cache
-        self.cache_queue = collections.deque()
-        # Creating a dict for the weighted cache
-        self.cache_dict = collections.defaultdict(int)
-        # order that keys have been used
-        self.maxsize = maxsize
-        self.maxqueue = maxsize * 10
-        self.use_count = Counter()
-        # times each key is in the queue
-        self.refcount = Counter()
-        self.kwd_mark = object()
+        self.max_bytes = max_bytes
+        self.index = CacheIndex(policy, max_bytes)
+        self.shadow_indexes = [CacheIndex(shadow_policy, max_bytes) for shadow_policy in shadow_policies
+                               if shadow_policy.upper() != self.index.name]
+        self.cache_lock = threading.Lock()
+        # Segments that are being downloaded from the content server {key: InFlightDownload}
+        self.in_flight = {}
         self.misses = 0
         self.fetch_hits = 0
+        # Fetch requests that joined an in-flight download
+        self.fetch_coalesced = 0
         self.prefetch_hits = 0
+        self.manifest = manifest or CacheManifest()
         self.initialize_cache()
+        # Downloads of the fetch requests that are streamed to the client: (key, code, client_id, in_flight)
+        self.download_queue = Queue.Queue()
+        for _ in range(config_cdash.DOWNLOAD_WORKERS):
+            download_thread = threading.Thread(target=self.download_function, args=())
+            download_thread.daemon = True
+            download_thread.start()
+
+    def initialize_cache(self, local_folder=config_cdash.VIDEO_FOLDER, warm_restart=config_cdash.CACHE_WARM_RESTART):
+        """ Module to restore the segments of the manifest in the order of their last access.
+        The cache folder is listed once: the segments without a file are dropped from the manifest and the files
+        without a segment in the manifest (Eg: downloads interrupted by the previous shutdown) are deleted.
+        Clears the cache folder if warm_restart is False
+        """
+        local_files = set(os.listdir(local_folder))
+        if not warm_restart:
+            config_cdash.LOG.info('Clearing the Cache')
+            self.remove_files(local_folder, local_files)
+            self.manifest.clear()
+            return
+        load_start = time.time()
+        entries = self.manifest.load()
+        evicted = []
+        missing_files = 0
+        with self.cache_lock:
+            for entry in entries:
+                if entry.filename not in local_files:
+                    missing_files += 1
+                    self.manifest.remove(entry.key)
+                    continue
+                local_files.discard(entry.filename)
+                # The cache limit may be smaller than in the previous run
+                evicted += self.index.insert(entry.key, entry.size, None)
+                for shadow_index in self.shadow_indexes:
+                    shadow_index.insert(entry.key, entry.size, None)
+                self.cache[entry.key] = (os.path.join(local_folder, entry.filename), entry.http_headers)
+            for evicted_key in evicted:
+                self.delete_segment(evicted_key)
+        if missing_files:
+            config_cdash.LOG.warning('Dropped {} segments of the cache manifest without a file'.format(missing_files))
+        if local_files:
+            config_cdash.LOG.warning('Deleting {} files of the cache folder without a segment in the manifest'.format(
+                len(local_files)))
+            self.remove_files(local_folder, local_files)
+        config_cdash.LOG.info('Restored {} segments ({} bytes) from the cache manifest in {:.3f} seconds'.format(
+            len(self.cache), self.index.current_bytes, time.time() - load_start))
 
-    def initialize_cache(self, local_folder=config_cdash.VIDEO_FOLDER):
-        current_files = glob.glob(local_folder + '*.m4s')
-        for current_file in current_files:
+    def remove_files(self, local_folder, filenames):
+        """ Module to delete the files from the cache folder """
+        for filename in filenames:
             try:
-                os.remove(current_file)
-            except IOError:
-                config_cdash.LOG.error('Unable to delete the cache file {}. Skipping'.format(current_file))
-                continue
+                os.remove(os.path.join(local_folder, filename))
+            except OSError:
+                config_cdash.LOG.error('Unable to delete the cache file {}. Skipping'.format(filename))
 
-    def get_file(self, key, code=config_cdash.FETCH_CODE):
+    def segment_exists(self, key):
+        """ Module to check if the segment is in the cache or being downloaded """
+        with self.cache_lock:
+            return key in self.cache or key in self.in_flight
+
+    def get_file(self, key, code=config_cdash.FETCH_CODE, client_id=None):
         """ Get the file from the cache.
-        If not get it from the content server
+        If not get it from the content server. Blocks until the file is on the harddisk
+        :param client_id: (username, session_id) of the client requesting the file
         """
-        config_cdash.LOG.info("code = {}".format(code))
-        # config_cdash.LOG.info('Current Cache Dict= {}'.format(self.cache.keys()))
-        try:
-            local_filepath, http_headers = self.cache[key]
-            try:
-                self.cache_dict[key] += 1
-            except KeyError:
-                self.cache_dict[key] = 1
-            if code == config_cdash.FETCH_CODE:
-                self.fetch_hits += 1
-                config_cdash.LOG.info('Fetch hit count = {} Fetch : {}'.format(self.fetch_hits, key))
-            elif code == config_cdash.PREFETCH_CODE:
-                self.prefetch_hits += 1
-                config_cdash.LOG.info('Prefetch hit count = {}. Prefetch hit: {}'.format(self.prefetch_hits, key))
-        except KeyError:
-            # The file is not in the cache.
-            # Need to fetch from content server
-            # TODO: Check if the request is valid (Use Rohit's code)
-            if key not in self.cache:
-                local_filepath, http_headers = download_segment(key)
-                self.cache[key] = (local_filepath, http_headers)
-                self.cache_queue.append(key)
-                config_cdash.LOG.info('Adding key {} to cache'.format(key))
-                if code == config_cdash.FETCH_CODE:
-                    self.misses += 1
-                    config_cdash.LOG.info('Cache miss: count = {},{}'.format(self.misses, key))
-            else:
-                local_filepath, http_headers = self.cache[key]
-                config_cdash.LOG.info('key {} already in Cache'.format(key))
-            #while True:
-            #    if len(self.cache) > self.maxsize:
-            #        self.pop_cache()
-            #    else:
-            #        break
+        local_filepath, http_headers, in_flight = self.get_stream(key, code, client_id, background=False)
+        if in_flight:
+            local_filepath, http_headers = in_flight.wait()
         return local_filepath, http_headers
 
-    def pop_cache(self):
-        """ Module to pop an item from the cache.
-            Based on LRU
+    def get_stream(self, key, code=config_cdash.FETCH_CODE, client_id=None, background=True):
+        """ Get the file from the cache without waiting for the download from the content server.
+        Concurrent requests for a segment that is being downloaded share the same download.
+        :param background: Queue the download of the missing segment to the download threads instead of
+                           downloading it in the calling thread
+        :return: (local_filepath, http_headers, None) if the file is in the cache
+                 (None, None, in_flight) with the InFlightDownload of the segment otherwise
         """
-        key = self.cache_queue.popleft()
+        config_cdash.LOG.debug("code = %s", code)
+        with self.cache_lock:
+            if key in self.cache:
+                self.record_hit(key, code, client_id)
+                local_filepath, http_headers = self.cache[key]
+                return local_filepath, http_headers, None
+            in_flight = self.in_flight.get(key)
+            if in_flight:
+                in_flight.joined.append((code, client_id))
+                config_cdash.LOG.debug('Joining the in-flight download of %s', key)
+                return None, None, in_flight
+            in_flight = InFlightDownload(key)
+            self.in_flight[key] = in_flight
+        # The file is not in the cache.
+        # Need to fetch from content server
+        if background:
+            self.download_queue.put((key, code, client_id, in_flight))
+        else:
+            self.download(key, code, client_id, in_flight)
+        return None, None, in_flight
+
+    def download_function(self):
+        """ Download thread. Downloads the segments of the download queue """
+        while True:
+            key, code, client_id, in_flight = self.download_queue.get()
+            self.download(key, code, client_id, in_flight)
+
+    def download(self, key, code, client_id, in_flight):
+        """ Download the segment into the cache and complete the in_flight download """
         try:
+            local_filepath, http_headers = download_segment(key, in_flight)
+            size = os.path.getsize(local_filepath)
+        except Exception as error:
+            config_cdash.LOG.error('Unable to download {} from the content server: {}'.format(key, error))
+            with self.cache_lock:
+                del self.in_flight[key]
+            in_flight.fail(error)
+            return
+        with self.cache_lock:
+            evicted = self.index.insert(key, size, code, client_id)
+            for evicted_key in evicted:
+                self.delete_segment(evicted_key)
+            self.cache[key] = (local_filepath, http_headers)
+            del self.in_flight[key]
+            config_cdash.LOG.debug('Adding key %s to cache', key)
+            if code == config_cdash.FETCH_CODE:
+                self.misses += 1
+                cache_metrics.FETCH_MISSES.inc()
+                config_cdash.LOG.debug('Cache miss: count = %s,%s', self.misses, key)
+            for shadow_index in self.shadow_indexes:
+                shadow_index.access(key, size, code, client_id)
+            # Queued before the touches of the joined requests so that they count in the hits of the row
+            self.manifest.put(ManifestEntry(key, os.path.basename(local_filepath), size, http_headers, 0,
+                                            time.time()))
+            # The requests that joined the download are counted apart from the hits and the misses
+            for joined_code, joined_client_id in in_flight.joined:
+                self.record_coalesced(key, joined_code, joined_client_id)
+        in_flight.finish((local_filepath, http_headers))
+
+    def delete_segment(self, key):
+        """ Module to delete the evicted segment from the cache, the harddisk and the manifest.
+        Called with the cache_lock held: a new download of the key cannot start before its file is deleted and the
+        manifest updates stay in the order of the cache updates
+        """
+        del self.cache[key]
+        remove_file(key)
+        self.manifest.remove(key)
+        config_cdash.LOG.debug('Deleted Key %s from Cache', key)
+
+    def drop_missing_file(self, key, local_filepath):
+        """ Module to drop the segment whose file is no longer on the harddisk. The next request downloads it again
+        :param local_filepath: The path that was not found. The segment is kept if it was downloaded again since
+        """
+        with self.cache_lock:
+            if key not in self.cache or self.cache[key][0] != local_filepath:
+                return
             del self.cache[key]
-            remove_file(key)
-            config_cdash.LOG.info('Deleted Key {} from Cache'.format(key))
-        except KeyError:
-            config_cdash.LOG.error('Key {} not found in Cache'.format(key))
+            self.index.remove(key)
+            self.manifest.remove(key)
 
-    def pop_dict(self):
+    def record_hit(self, key, code, client_id):
+        """ Update the hit counters. Called with the cache_lock held """
+        self.index.lookup(key, code, client_id)
+        self.manifest.touch(key, time.time())
+        for shadow_index in self.shadow_indexes:
+            shadow_index.access(key, self.index.sizes[key], code, client_id)
+        if code == config_cdash.FETCH_CODE:
+            self.fetch_hits += 1
+            cache_metrics.FETCH_HITS.inc()
+            config_cdash.LOG.debug('Fetch hit count = %s Fetch : %s', self.fetch_hits, key)
+        elif code == config_cdash.PREFETCH_CODE:
+            self.prefetch_hits += 1
+            cache_metrics.PREFETCH_HITS.inc()
+            config_cdash.LOG.debug('Prefetch hit count = %s. Prefetch hit: %s', self.prefetch_hits, key)
+
+    def record_coalesced(self, key, code, client_id):
+        """ Update the replacement policy and the coalesced counter for a request that joined the download of the
+        segment. Called with the cache_lock held
+        """
+        self.index.touch(key, code, client_id)
+        self.manifest.touch(key, time.time())
+        for shadow_index in self.shadow_indexes:
+            shadow_index.touch(key, code, client_id)
+        if code == config_cdash.FETCH_CODE:
+            self.fetch_coalesced += 1
+            cache_metrics.FETCH_COALESCED.inc()
+            config_cdash.LOG.debug('Fetch coalesced count = %s Fetch : %s', self.fetch_coalesced, key)
+
+    def pop_cache(self):
+        """ Module to pop an item from the cache.
+            Based on the replacement policy
+        :return: The key of the item or None if the cache is empty
         """
-        Module to remove an element from the dict
-        :param self:
-        :return:
+        with self.cache_lock:
+            key = self.index.policy.victim()
+            if key is None:
+                config_cdash.LOG.warning('Unable to pop from the empty cache')
+                return None
+            self.index.remove(key)
+            if key not in self.cache:
+                config_cdash.LOG.error('Key {} not found in Cache'.format(key))
+                return None
+            self.delete_segment(key)
+        return key
+
+    def get_stats(self):
+        """ Module to get the hit/miss counters of the cache and the shadow indexes
+        :return: {policy_name: stats_dict}
         """
-        lowest_value = min(self.cache_dict.values())
-        for key in self.cache_dict:
-            if self.cache_dict[key] == lowest_value:
-                try:
-                    del self.cache_dict[key]
-                except KeyError:
-                    config_cdash.LOG.error('Could not find key: {} in cache_dict'.format(key))
-                try:
-                    del self.cache[key]
-                except KeyError:
-                    config_cdash.LOG.error('Could not find key: {} in cache'.format(key))
-                config_cdash.LOG.info('Deleting key {}'.format(key))
-                break
+        with self.cache_lock:
+            stats = {self.index.name: self.index.stats.as_dict()}
+            stats[self.index.name]['bytes'] = self.index.current_bytes
+            stats[self.index.name]['entries'] = len(self.index)
+            for shadow_index in self.shadow_indexes:
+                stats[shadow_index.name] = shadow_index.stats.as_dict()
+        return stats
 
     def clear(self):
+        with self.cache_lock:
             self.cache.clear()
-            self.cache_queue.clear()
-            self.refcount.clear()
-            self.misses = self.fetch_hits = self.prefetch_hits = 0
+            self.manifest.clear()
+            self.index = CacheIndex(self.index.name, self.max_bytes)
+            self.shadow_indexes = [CacheIndex(shadow_index.name, self.max_bytes)
+                                   for shadow_index in self.shadow_indexes]
+            self.misses = self.fetch_hits = self.fetch_coalesced = self.prefetch_hits = 0
+
+    def terminate(self):
+        """ Write the pending updates of the manifest """
+        self.manifest.terminate()
@@ -0,0 +1,190 @@
+__author__ = 'pjuluri'
+
+"""
+Persistent index (manifest) of the segments in the cache.
+Every segment in VIDEO_FOLDER has a row in the CACHEMANIFEST table with its file name, size, the HTTP headers
+of the content server, the number of hits and the time of the last access.
+The manifest is read with a single query when the cache starts (warm restart). The updates are queued and
+written by a background writer in batches. Updates of the same segment within a batch are merged.
+"""
+import collections
+import json
+import sqlite3
+import threading
+import time
+import Queue
+import config_cdash
+import create_db
+
+SELECT_QUERY = ('SELECT SEGMENTKEY, FILENAME, SIZE, HTTPHEADERS, HITS, LASTACCESS FROM CACHEMANIFEST '
+                'ORDER BY LASTACCESS;')
+INSERT_QUERY = ('INSERT OR REPLACE INTO CACHEMANIFEST(SEGMENTKEY, FILENAME, SIZE, HTTPHEADERS, HITS, LASTACCESS) '
+                'VALUES (?, ?, ?, ?, ?, ?);')
+UPDATE_QUERY = 'UPDATE CACHEMANIFEST SET HITS = HITS + ?, LASTACCESS = ? WHERE SEGMENTKEY = ?;'
+DELETE_QUERY = 'DELETE FROM CACHEMANIFEST WHERE SEGMENTKEY = ?;'
+CLEAR_QUERY = 'DELETE FROM CACHEMANIFEST;'
+
+# Operations of the write queue
+PUT = 'PUT'
+TOUCH = 'TOUCH'
+REMOVE = 'REMOVE'
+CLEAR = 'CLEAR'
+
+
+class ManifestEntry():
+    """ A segment of the manifest """
+    def __init__(self, key, filename, size, http_headers, hits=0, last_access=None):
+        """
+        :param filename: Name of the file in VIDEO_FOLDER
+        """
+        self.key = key
+        self.filename = filename
+        self.size = size
+        self.http_headers = http_headers
+        self.hits = hits
+        self.last_access = last_access
+
+    def as_row(self):
+        return (self.key, self.filename, self.size, json.dumps(self.http_headers), self.hits, self.last_access)
+
+    @staticmethod
+    def from_row(row):
+        key, filename, size, http_headers, hits, last_access = row
+        # sqlite and json return unicode. The keys, paths and headers are str in the cache
+        http_headers = dict((header.encode('utf-8'), header_value.encode('utf-8'))
+                            for header, header_value in json.loads(http_headers).items())
+        return ManifestEntry(key.encode('utf-8'), filename.encode('utf-8'), size, http_headers, hits, last_access)
+
+
+class CacheManifest():
+    def __init__(self, database=config_cdash.CACHE_MANIFEST_DATABASE):
+        """ Start the background writer for the manifest.
+        :param database: sqlite database file. The manifest is not persisted if None
+        """
+        self.database = database
+        self.dropped_updates = 0
+        self.write_queue = Queue.Queue(maxsize=config_cdash.CACHE_MANIFEST_WRITE_QUEUE_LIMIT)
+        self.stop = threading.Event()
+        self.writer_thread = None
+        if database:
+            self.writer_thread = threading.Thread(target=self.writer_function, args=())
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+
+    def load(self):
+        """ Module to read the manifest
+        :return: List of ManifestEntry in the order of their last access
+        """
+        if not self.database:
+            return []
+        connection = create_db.create_db(self.database, config_cdash.CACHE_MANIFEST_TABLES)
+        try:
+            entries = [ManifestEntry.from_row(row) for row in connection.execute(SELECT_QUERY)]
+        except (sqlite3.Error, ValueError) as error:
+            config_cdash.LOG.error('Unable to read the cache manifest {}: {}'.format(self.database, error))
+            entries = []
+        finally:
+            connection.close()
+        return entries
+
+    def put(self, entry):
+        """ Add or replace the segment in the manifest """
+        self.queue_update((PUT, entry.key, entry))
+
+    def touch(self, key, last_access):
+        """ Count a hit of the segment """
+        self.queue_update((TOUCH, key, last_access))
+
+    def remove(self, key):
+        self.queue_update((REMOVE, key, None))
+
+    def clear(self):
+        self.queue_update((CLEAR, None, None))
+
+    def queue_update(self, update):
+        if not self.writer_thread:
+            return
+        try:
+            self.write_queue.put_nowait(update)
+        except Queue.Full:
+            self.dropped_updates += 1
+            config_cdash.LOG.warning('Cache manifest write queue full. Dropped {} updates'.format(self.dropped_updates))
+
+    def write_batch(self, connection, updates):
+        """ Module to merge the updates of the same segment and write them in one transaction """
+        # {key: (operation, ManifestEntry or (hits, last_access))} in the order the keys were last updated
+        pending = collections.OrderedDict()
+        for operation, key, value in updates:
+            if operation == CLEAR:
+                pending.clear()
+                pending[None] = (CLEAR, None)
+                continue
+            previous_operation, previous_value = pending.pop(key, (None, None))
+            if operation == TOUCH:
+                if previous_operation == PUT:
+                    previous_value.hits += 1
+                    previous_value.last_access = value
+                    pending[key] = (PUT, previous_value)
+                    continue
+                if previous_operation == REMOVE:
+                    pending[key] = (REMOVE, None)
+                    continue
+                hits = previous_value[0] if previous_operation == TOUCH else 0
+                pending[key] = (TOUCH, (hits + 1, value))
+            else:
+                pending[key] = (operation, value)
+        if None in pending:
+            connection.execute(CLEAR_QUERY)
+            del pending[None]
+        delete_rows, insert_rows, update_rows = [], [], []
+        for key, (operation, value) in pending.items():
+            if operation == REMOVE:
+                delete_rows.append((key,))
+            elif operation == PUT:
+                insert_rows.append(value.as_row())
+            else:
+                hits, last_access = value
+                update_rows.append((hits, last_access, key))
+        connection.executemany(DELETE_QUERY, delete_rows)
+        connection.executemany(INSERT_QUERY, insert_rows)
+        connection.executemany(UPDATE_QUERY, update_rows)
+        connection.commit()
+
+    def writer_function(self):
+        """ Thread that writes the queued updates to CACHEMANIFEST.
+        Updates are written in batches of up to CACHE_MANIFEST_WRITE_BATCH updates or every
+        CACHE_MANIFEST_WRITE_INTERVAL seconds
+        """
+        connection = create_db.create_db(self.database, config_cdash.CACHE_MANIFEST_TABLES)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL;')
+            connection.execute('PRAGMA synchronous=NORMAL;')
+        except sqlite3.OperationalError as error:
+            config_cdash.LOG.warning('Unable to enable WAL mode for {}: {}'.format(self.database, error))
+        while not (self.stop.is_set() and self.write_queue.empty()):
+            try:
+                updates = [self.write_queue.get(timeout=config_cdash.CACHE_MANIFEST_WRITE_INTERVAL)]
+            except Queue.Empty:
+                continue
+            # Collect the updates for up to CACHE_MANIFEST_WRITE_INTERVAL seconds
+            flush_time = time.time() + config_cdash.CACHE_MANIFEST_WRITE_INTERVAL
+            while len(updates) < config_cdash.CACHE_MANIFEST_WRITE_BATCH and not self.stop.is_set():
+                remaining_time = flush_time - time.time()
+                if remaining_time <= 0:
+                    break
+                try:
+                    updates.append(self.write_queue.get(timeout=remaining_time))
+                except Queue.Empty:
+                    break
+            try:
+                self.write_batch(connection, updates)
+            except sqlite3.Error as error:
+                config_cdash.LOG.error('Unable to write {} updates to {}: {}'.format(len(updates), self.database,
+                                                                                    error))
+        connection.close()
+
+    def terminate(self):
+        """ Write the queued updates and stop the writer """
+        self.stop.set()
+        if self.writer_thread:
+            self.writer_thread.join()
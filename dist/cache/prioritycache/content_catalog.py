@@ -0,0 +1,256 @@
+__author__ = 'pjuluri'
+
+"""
+Catalog of the content served by the cache, built from the MPD files fetched from the content server.
+    - The MPD files are kept in memory with an ETag to answer the If-None-Match requests of the clients
+    - The segment paths of every representation are precompiled from the SegmentTemplate of the MPD
+      Eg: 'bunny_$Bandwidth$bps/BigBuckBunny_4s$Number$.m4s' at 45226 bps is split into the prefix
+      'bunny_45226bps/BigBuckBunny_4s' and the suffix '.m4s'
+    - A request path is mapped to (title, bitrate index, segment number, origin url) with a dictionary lookup
+      on its prefix and suffix
+    - Every MPD added to the catalog is appended to config_cdash.CATALOG_LOG_FILE (one JSON line per MPD).
+      The log is replayed when the cache starts
+"""
+import collections
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from StringIO import StringIO
+import config_cdash
+import read_mpd
+
+# segment_number is None for the initialization segments
+SegmentInfo = collections.namedtuple('SegmentInfo', ['title', 'bitrate_index', 'segment_number', 'origin_url'])
+
+
+class MpdEntry():
+    """ MPD file as received from the content server """
+    def __init__(self, mpd_path, mpd_data, http_headers, folder, title=None):
+        """
+        :param mpd_path: Request path of the MPD file
+        :param folder: Folder of the video on the content server (config_cdash.MPD_SOURCES)
+        :param title: Name of the title in the catalog. None if the MPD could not be added to the catalog
+        """
+        self.mpd_path = mpd_path
+        self.data = mpd_data
+        self.http_headers = dict(http_headers)
+        self.folder = folder
+        self.title = title
+        # The ETag of the content server if any. Otherwise the MD5 of the MPD
+        self.etag = self.http_headers.get('etag') or '"{}"'.format(hashlib.md5(mpd_data).hexdigest())
+        self.http_headers['etag'] = self.etag
+
+    def matches(self, if_none_match):
+        """ Returns True if the If-None-Match header of the request matches the ETag of the MPD """
+        etags = [etag.strip() for etag in if_none_match.split(',')]
+        if '*' in etags:
+            return True
+        # Weak comparison
+        return self.etag.replace('W/', '') in [etag.replace('W/', '') for etag in etags]
+
+
+class Representation():
+    """ Precompiled segment paths of one bitrate of a title """
+    def __init__(self, title_name, bitrate, bitrate_index, media_template, init_template, origin):
+        """
+        :param media_template: SegmentTemplate media attribute. Eg: 'bunny_$Bandwidth$bps/BigBuckBunny_4s$Number$.m4s'
+        :param origin: URL of the folder of the title on the content server
+        """
+        self.title_name = title_name
+        self.bitrate = bitrate
+        self.bitrate_index = bitrate_index
+        media_template = media_template.replace('$Bandwidth$', str(bitrate))
+        self.prefix, _, self.suffix = media_template.partition('$Number$')
+        self.init_path = None
+        if init_template:
+            self.init_path = init_template.replace('$Bandwidth$', str(bitrate))
+        self.origin = origin
+
+    def get_path(self, segment_number):
+        return ''.join((self.prefix, str(segment_number), self.suffix))
+
+
+class Title():
+    """ A video of the catalog with its representations """
+    def __init__(self, name, dash_playback_object, origin):
+        """
+        :param dash_playback_object: DashPlayback object of read_mpd
+        :param origin: URL of the folder of the title on the content server
+        """
+        video = dash_playback_object.video
+        self.name = name
+        self.origin = origin
+        self.media_template = video['base_url']
+        self.bitrates = sorted(video['bandwidth_list'])
+        self.segment_duration = video['duration'] / video['timescale']
+        self.start = video['start']
+        self.end = self.start + int(math.ceil(dash_playback_object.playback_duration / self.segment_duration)) - 1
+        self.representations = [Representation(name, bitrate, bitrate_index, self.media_template,
+                                               video['initialization'], origin)
+                                for bitrate_index, bitrate in enumerate(self.bitrates)]
+
+    def get_segment_path(self, bitrate_index, segment_number):
+        """ :return: The path of the segment or None if the title has no such segment """
+        if not self.start <= segment_number <= self.end:
+            return None
+        return self.representations[bitrate_index].get_path(segment_number)
+
+
+class ContentCatalog():
+    def __init__(self, log_file=config_cdash.CATALOG_LOG_FILE):
+        self.log_file = log_file
+        self.lock = threading.Lock()
+        # {mpd_path: MpdEntry}
+        self.mpds = {}
+        # {title name: Title}
+        self.titles = {}
+        # {media template: title name}. MPD files with the same segments share the title
+        self.templates = {}
+        # {(prefix, suffix): Representation} and {init path: Representation}
+        self.prefixes = {}
+        self.init_paths = {}
+        # Replaced (not modified) when a suffix is added. The lookups iterate over it without the lock
+        self.suffixes = ()
+
+    def load(self):
+        """ Module to replay the catalog log. Later lines replace the earlier lines of the same MPD
+        :return: Number of MPD files in the catalog
+        """
+        try:
+            log_handle = open(self.log_file, 'rb')
+        except IOError:
+            config_cdash.LOG.warning('Could not find the catalog log {}. Starting with an empty catalog'.format(
+                self.log_file))
+            return 0
+        with log_handle:
+            for line_number, line in enumerate(log_handle, 1):
+                try:
+                    record = json.loads(line)
+                    # json returns unicode. The paths, URLs and headers are str in the cache
+                    http_headers = dict((header.encode('utf-8'), header_value.encode('utf-8'))
+                                        for header, header_value in record['http_headers'].items())
+                    self.add_mpd(record['mpd'].encode('utf-8'), record['data'].encode('utf-8'), http_headers,
+                                 record['folder'].encode('utf-8'), persist=False)
+                except (ValueError, KeyError, AttributeError) as error:
+                    # The last line is incomplete if the cache stopped while writing it
+                    config_cdash.LOG.warning('Skipping line {} of the catalog log: {}'.format(line_number, error))
+        config_cdash.LOG.info('Loaded {} MPD files and {} titles from the catalog log'.format(len(self.mpds),
+                                                                                              len(self.titles)))
+        return len(self.mpds)
+
+    def get_origin(self, folder):
+        """ :return: URL of the folder on the content server """
+        return config_cdash.CONTENT_SERVER + folder
+
+    def get_mpd(self, mpd_path):
+        """ :return: MpdEntry of the MPD file or None if it is not in the catalog """
+        return self.mpds.get(mpd_path)
+
+    def get_title(self, title_name):
+        return self.titles[title_name]
+
+    def add_mpd(self, mpd_path, mpd_data, http_headers, folder, persist=True):
+        """ Module to add the MPD file and its title to the catalog
+        :param mpd_data: The MPD file (str)
+        :param folder: Folder of the video on the content server
+        :param persist: Append the MPD to the catalog log
+        :return: MpdEntry
+        """
+        try:
+            dash_playback_object = read_mpd.read_mpd(StringIO(mpd_data))
+        except (SyntaxError, KeyError, ValueError) as error:
+            config_cdash.LOG.error('Unable to parse the MPD {}: {}'.format(mpd_path, error))
+            dash_playback_object = None
+        with self.lock:
+            title_name = None
+            if dash_playback_object:
+                title_name = self.add_title(mpd_path, dash_playback_object, self.get_origin(folder))
+            mpd_entry = MpdEntry(mpd_path, mpd_data, http_headers, folder, title_name)
+            self.mpds[mpd_path] = mpd_entry
+            if persist:
+                self.append_log(mpd_entry)
+        return mpd_entry
+
+    def add_title(self, mpd_path, dash_playback_object, origin):
+        """ Module to add the title of the MPD. Called with the lock held
+        :return: Name of the title or None if the segments of the MPD are not supported
+        """
+        video = dash_playback_object.video
+        media_template = video['base_url']
+        if (not media_template or '$Number$' not in media_template or not video['bandwidth_list'] or
+                not video['duration'] or not dash_playback_object.playback_duration):
+            config_cdash.LOG.warning('MPD {} has no SegmentTemplate with $Number$. Its segments are not cached'.format(
+                mpd_path))
+            return None
+        title_name = self.templates.get(media_template)
+        if title_name is None:
+            title_name = os.path.splitext(mpd_path)[0]
+        title = Title(title_name, dash_playback_object, origin)
+        if title_name in self.titles:
+            self.remove_representations(self.titles[title_name])
+        self.titles[title_name] = title
+        self.templates[media_template] = title_name
+        suffixes = set(self.suffixes)
+        for representation in title.representations:
+            self.prefixes[(representation.prefix, representation.suffix)] = representation
+            if representation.init_path:
+                self.init_paths[representation.init_path] = representation
+            suffixes.add(representation.suffix)
+        self.suffixes = tuple(suffixes)
+        config_cdash.LOG.info('Added the title {} with {} representations and segments {} to {} to the catalog'.format(
+            title_name, len(title.representations), title.start, title.end))
+        return title_name
+
+    def remove_representations(self, title):
+        """ Module to remove the representations of the title before it is updated. Called with the lock held """
+        for representation in title.representations:
+            self.prefixes.pop((representation.prefix, representation.suffix), None)
+            self.init_paths.pop(representation.init_path, None)
+
+    def append_log(self, mpd_entry):
+        """ Module to append the MPD to the catalog log. Called with the lock held """
+        record = {'mpd': mpd_entry.mpd_path,
+                  'folder': mpd_entry.folder,
+                  'http_headers': mpd_entry.http_headers,
+                  'data': mpd_entry.data.decode('utf-8'),
+                  'time': time.time()}
+        try:
+            with open(self.log_file, 'ab') as log_handle:
+                log_handle.write(json.dumps(record) + '\n')
+        except (IOError, UnicodeDecodeError) as error:
+            config_cdash.LOG.error('Unable to append {} to the catalog log: {}'.format(mpd_entry.mpd_path, error))
+
+    def lookup(self, path):
+        """ Module to map the request path to the segment
+        :param path: Request path. Eg: 'bunny_45226bps/BigBuckBunny_4s1.m4s'
+        :return: SegmentInfo or None if the path is not a segment of the catalog
+        """
+        representation = self.init_paths.get(path)
+        if representation:
+            return SegmentInfo(representation.title_name, representation.bitrate_index, None,
+                               representation.origin + path)
+        for suffix in self.suffixes:
+            if not path.endswith(suffix):
+                continue
+            stem = path[:len(path) - len(suffix)] if suffix else path
+            number_start = len(stem)
+            while number_start > 0 and stem[number_start - 1].isdigit():
+                number_start -= 1
+            # The prefix itself may end with digits (Eg: 'Valkaama_4$Number$.m4s'). Try the longer prefixes as well
+            for split in range(number_start, len(stem)):
+                representation = self.prefixes.get((stem[:split], suffix))
+                if not representation or str(int(stem[split:])) != stem[split:]:
+                    continue
+                title = self.titles.get(representation.title_name)
+                segment_number = int(stem[split:])
+                if not title or not title.start <= segment_number <= title.end:
+                    return None
+                return SegmentInfo(title.name, representation.bitrate_index, segment_number,
+                                   representation.origin + path)
+        return None
+
+
+CATALOG = ContentCatalog()
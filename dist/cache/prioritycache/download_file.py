@@ -8,13 +8,48 @@ Contact Email: pjuluri@umkc.edu
 """
 
 import urllib2
+import httplib
+import socket
+import threading
+import collections
 import timeit
 import os
 import config_cdash
+import cache_metrics
 import errno
 import urlparse
 
-DOWNLOAD_CHUNK = 1024
+
+class ConnectionPool():
+    """ Pool of persistent (keep-alive) HTTP connections to the content servers.
+    Connections are checked out by one download at a time and returned once the response is read completely.
+    """
+    def __init__(self, max_idle=config_cdash.ORIGIN_MAX_IDLE_CONNECTIONS):
+        self.lock = threading.Lock()
+        self.max_idle = max_idle
+        # {(scheme, netloc): [idle connections]}
+        self.idle = collections.defaultdict(list)
+
+    def get(self, origin):
+        """ :param origin: (scheme, netloc) of the content server """
+        with self.lock:
+            if self.idle[origin]:
+                return self.idle[origin].pop()
+        scheme, netloc = origin
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=config_cdash.ORIGIN_TIMEOUT)
+        return httplib.HTTPConnection(netloc, timeout=config_cdash.ORIGIN_TIMEOUT)
+
+    def put(self, origin, connection):
+        with self.lock:
+            if len(self.idle[origin]) < self.max_idle:
+                self.idle[origin].append(connection)
+                return
+        connection.close()
+
+
+CONNECTION_POOL = ConnectionPool()
+
 
 def make_sure_path_exists(folder_path):
     """ Module to make sure the path exists if not create the folder path
@@ -27,40 +62,109 @@ def make_sure_path_exists(folder_path):
             config_cdash.LOG.error('Unable to create the cache folder {}'.format(folder_path))
             raise
 
-def download_file(segment_url, segment_filepath):
-    """ Module to download the segment """
+
+def open_url(segment_url):
+    """ Module to send the GET request on a pooled connection.
+    A request on a connection that was closed by the content server while idle is retried once.
+    :return: (origin, connection, response)
+    """
+    parsed_uri = urlparse.urlparse(segment_url)
+    origin = (parsed_uri.scheme, parsed_uri.netloc)
+    request_path = parsed_uri.path
+    if parsed_uri.query:
+        request_path = '?'.join((request_path, parsed_uri.query))
+    for attempt in range(2):
+        connection = CONNECTION_POOL.get(origin)
+        try:
+            connection.request('GET', request_path)
+            response = connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if attempt:
+                raise
+            continue
+        if response.status != httplib.OK:
+            response.read()
+            if response.will_close:
+                connection.close()
+            else:
+                CONNECTION_POOL.put(origin, connection)
+            raise urllib2.HTTPError(segment_url, response.status, response.reason, response.msg, None)
+        return origin, connection, response
+
+
+def remove_temporary_file(temporary_filepath):
+    """ Module to delete the temporary file of a failed download """
+    try:
+        os.remove(temporary_filepath)
+    except OSError:
+        config_cdash.LOG.error('Unable to delete the temporary file {}'.format(temporary_filepath))
+
+
+def download_file(segment_url, segment_filepath, in_flight=None):
+    """ Module to download the segment. The segment is written to a temporary file that is renamed to
+    segment_filepath once the download is complete, so segment_filepath never holds a partial segment.
+    Raises the error if the download fails
+    :param in_flight: InFlightDownload that receives the headers and the data chunks as they arrive
+    :return: (segment_filepath, http_headers)
+    """
+    # Start the timer for download. Includes the connection and the time to the first byte
+    download_start_time = timeit.default_timer()
     # Connecting to the content server
     try:
-        connection = urllib2.urlopen(segment_url)
-    except urllib2.HTTPError:
+        origin, connection, response = open_url(segment_url)
+    except (urllib2.HTTPError, httplib.HTTPException, socket.error):
         config_cdash.LOG.error("Unable to connect to the content server. {}".format(segment_url))
         raise
     # Retrieving the content length
-    content_length = connection.headers['content-length']
-    http_headers = dict(connection.headers)
-    parsed_uri = urlparse.urlparse(segment_url)
-    segment_path = '{uri.path}'.format(uri=parsed_uri)
-    while segment_path.startswith('/'):
-        segment_path = segment_path[1:]
+    content_length = response.getheader('content-length')
+    http_headers = dict(response.msg)
+    if in_flight:
+        in_flight.set_headers(http_headers)
     make_sure_path_exists(os.path.dirname(segment_filepath))
+    # Deleted at the next start of the cache if it is left behind (it is not in the cache manifest)
+    temporary_filepath = segment_filepath + config_cdash.DOWNLOAD_TEMPORARY_SUFFIX
     try:
-        segment_file_handle = open(segment_filepath, 'wb')
+        segment_file_handle = open(temporary_filepath, 'wb')
     except IOError:
-        config_cdash.LOG.error('Unable to open local file for writing: {}'.format(segment_filepath))
-        return None
+        config_cdash.LOG.error('Unable to open local file for writing: {}'.format(temporary_filepath))
+        connection.close()
+        raise
     segment_size = 0
-    # Start the timer for download
-    download_start_time = timeit.default_timer()
-    # Downloading the segment form the content server in chunks of size DOWNLOAD_CHUNK
-    while True:
-        segment_data = connection.read(DOWNLOAD_CHUNK)
-        segment_size += len(segment_data)
-        segment_file_handle.write(segment_data)
-        if len(segment_data) < DOWNLOAD_CHUNK:
-            break
-    connection.close()
-    download_time = timeit.default_timer() - download_start_time
+    # Downloading the segment form the content server in chunks of size DOWNLOAD_CHUNK_SIZE
+    try:
+        while True:
+            segment_data = response.read(config_cdash.DOWNLOAD_CHUNK_SIZE)
+            if not segment_data:
+                break
+            segment_size += len(segment_data)
+            segment_file_handle.write(segment_data)
+            if in_flight:
+                in_flight.append(segment_data)
+        # read() returns '' when the content server closes the connection before the end of the segment
+        if content_length is not None and segment_size != int(content_length):
+            raise httplib.HTTPException('Received {} of the {} bytes of the segment'.format(segment_size,
+                                                                                          content_length))
+    except (httplib.HTTPException, socket.error, IOError):
+        config_cdash.LOG.error('Connection to the content server lost while downloading {}'.format(segment_url))
+        connection.close()
+        segment_file_handle.close()
+        remove_temporary_file(temporary_filepath)
+        raise
     segment_file_handle.close()
-    config_cdash.LOG.info('Retrieved the segment {} of size \  '
-                          '{} in time {} from the content server'.format(segment_url, segment_size, download_time))
-    return segment_filepath, http_headers
\ No newline at end of file
+    try:
+        os.rename(temporary_filepath, segment_filepath)
+    except OSError:
+        config_cdash.LOG.error('Unable to move the downloaded segment to {}'.format(segment_filepath))
+        remove_temporary_file(temporary_filepath)
+        raise
+    # Reuse the connection for the next download unless the content server closes it
+    if response.will_close:
+        connection.close()
+    else:
+        CONNECTION_POOL.put(origin, connection)
+    download_time = timeit.default_timer() - download_start_time
+    cache_metrics.ORIGIN_DOWNLOAD_TIME.observe(download_time)
+    config_cdash.LOG.debug('Retrieved the segment %s of size %s (content-length %s) in time %s '
+                           'from the content server', segment_url, segment_size, content_length, download_time)
+    return segment_filepath, http_headers
@@ -0,0 +1,117 @@
+__author__ = 'pjuluri'
+
+"""
+Registry entry for the segments that are being downloaded from the content server.
+All the requests for a segment that is already downloading wait on the same InFlightDownload
+and can be served from the data received so far instead of waiting for the file on the harddisk.
+"""
+import threading
+import config_cdash
+
+
+class InFlightDownload():
+    """ Future for a segment download.
+    The downloader calls set_headers, append (for every chunk) and finally finish or fail.
+    The waiting requests use wait, wait_headers or iter_data.
+    The data received is kept in memory until the download is done and no request is reading it.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.condition = threading.Condition()
+        self.http_headers = None
+        self.chunks = []
+        self.size = 0
+        # Number of requests reading the chunks
+        self.readers = 0
+        self.done = False
+        self.error = None
+        self.result = None
+        # (code, client_id) of the requests that joined the download
+        self.joined = []
+
+    def set_headers(self, http_headers):
+        with self.condition:
+            self.http_headers = http_headers
+            self.condition.notify_all()
+
+    def append(self, data):
+        with self.condition:
+            self.chunks.append(data)
+            self.size += len(data)
+            self.condition.notify_all()
+
+    def finish(self, result):
+        """ :param result: (local_filepath, http_headers) of the downloaded segment """
+        with self.condition:
+            self.result = result
+            self.done = True
+            self.release_chunks()
+            self.condition.notify_all()
+
+    def fail(self, error):
+        with self.condition:
+            self.error = error
+            self.done = True
+            self.release_chunks()
+            self.condition.notify_all()
+
+    def release_chunks(self):
+        """ Drop the data received once the download is done and no request is reading it.
+        Called with the condition held
+        """
+        if self.done and not self.readers:
+            self.chunks = None
+
+    def wait(self):
+        """ Wait until the segment is on the harddisk
+        :return: (local_filepath, http_headers)
+        """
+        with self.condition:
+            while not self.done:
+                self.condition.wait()
+            if self.error:
+                raise self.error
+            return self.result
+
+    def wait_headers(self):
+        """ Wait for the HTTP headers of the content server """
+        with self.condition:
+            while self.http_headers is None and not self.done:
+                self.condition.wait()
+            if self.http_headers is None:
+                raise self.error
+            return self.http_headers
+
+    def iter_data(self):
+        """ Generator for the segment data as it arrives from the content server.
+        The requests that start reading after the download is complete read the file on the harddisk
+        """
+        with self.condition:
+            local_filepath = None
+            if self.done and not self.error:
+                local_filepath = self.result[0]
+            else:
+                self.readers += 1
+        if local_filepath:
+            with open(local_filepath, 'rb') as segment_file:
+                for data in iter(lambda: segment_file.read(config_cdash.DOWNLOAD_CHUNK_SIZE), ''):
+                    yield data
+            return
+        index = 0
+        try:
+            while True:
+                with self.condition:
+                    while not self.done and index == len(self.chunks):
+                        self.condition.wait()
+                    if self.error:
+                        raise self.error
+                    chunks = self.chunks[index:]
+                    index += len(chunks)
+                if not chunks:
+                    return
+                for data in chunks:
+                    yield data
+        finally:
+            with self.condition:
+                self.readers -= 1
+                self.release_chunks()
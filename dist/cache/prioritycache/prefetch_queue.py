@@ -0,0 +1,174 @@
+__author__ = 'pjuluri'
+
+"""
+Pre-fetch queue ordered by deadline.
+The deadline of a segment is the time at which the earliest session that wants it is expected to request it:
+    last request time of the session + (segment_number - playhead) * SEGMENT_DURATION
+Segments that all the interested sessions have moved past or switched bitrate away from are cancelled when
+they reach the head of the queue. Segments whose deadline moved back are demoted.
+"""
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+import config_cdash
+from content_catalog import CATALOG
+from prefetch_scheme import get_segment_info
+
+
+class PrefetchTask():
+    """ A segment to be pre-fetched and the sessions that want it """
+    def __init__(self, segment_path, video_id, bitrate, segment_number):
+        self.segment_path = segment_path
+        self.video_id = video_id
+        self.bitrate = bitrate
+        self.segment_number = segment_number
+        self.deadline = None
+        self.sessions = set()
+
+
+class DeadlinePrefetchQueue():
+    """ Priority queue of PrefetchTasks shared by the pre-fetch workers """
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        # {segment_path: PrefetchTask}
+        self.tasks = {}
+        # {client_id: (video_id, playhead, bitrate, last_seen)}
+        self.sessions = {}
+        self.last_expiry = time.time()
+        self.cancelled = 0
+        self.demoted = 0
+
+    def __contains__(self, segment_path):
+        with self.condition:
+            return segment_path in self.tasks
+
+    def qsize(self):
+        with self.condition:
+            return len(self.tasks)
+
+    def update_session(self, client_id, current_request, next_bitrate):
+        """ Update the playhead of the session with the segment it requested.
+        The playhead of an initialization segment is just before the first segment of the video
+        :param next_bitrate: The bitrate the session is expected to request next
+        """
+        segment = CATALOG.lookup(current_request)
+        if not segment:
+            return
+        playhead = segment.segment_number
+        if playhead is None:
+            playhead = CATALOG.get_title(segment.title).start - 1
+        now = time.time()
+        with self.condition:
+            self.sessions[client_id] = (segment.title, playhead, next_bitrate, now)
+            if now - self.last_expiry > config_cdash.PREFETCH_SESSION_TIMEOUT:
+                self.expire_sessions(now)
+
+    def expire_sessions(self, now):
+        """ Drop the sessions that have been idle for PREFETCH_SESSION_TIMEOUT. Called with the lock held """
+        for client_id, (_, _, _, last_seen) in self.sessions.items():
+            if now - last_seen > config_cdash.PREFETCH_SESSION_TIMEOUT:
+                del self.sessions[client_id]
+        self.last_expiry = now
+
+    def put(self, segment_path, client_id):
+        """ Queue the segment for pre-fetch on behalf of the session """
+        try:
+            segment_number, bitrate, video_id, _ = get_segment_info(segment_path)
+        except (KeyError, ValueError, IndexError):
+            config_cdash.LOG.error('Unable to queue invalid pre-fetch request {}'.format(segment_path))
+            return
+        with self.condition:
+            task = self.tasks.get(segment_path)
+            if not task:
+                task = PrefetchTask(segment_path, video_id, bitrate, segment_number)
+                self.tasks[segment_path] = task
+            task.sessions.add(client_id)
+            deadline = self.get_deadline(task)
+            if deadline is None:
+                deadline = time.time()
+            if task.deadline is None or deadline < task.deadline:
+                task.deadline = deadline
+                heapq.heappush(self.heap, (deadline, next(self.counter), task))
+                self.condition.notify()
+
+    def wants(self, client_id, task):
+        """ Returns True if the session still needs the segment of the task """
+        session = self.sessions.get(client_id)
+        if not session:
+            return False
+        video_id, playhead, bitrate, _ = session
+        return video_id == task.video_id and playhead < task.segment_number and bitrate == task.bitrate
+
+    def get_deadline(self, task):
+        """ Earliest deadline of the sessions that want the task, None if no session wants it """
+        deadlines = []
+        for client_id in task.sessions:
+            if self.wants(client_id, task):
+                _, playhead, _, last_seen = self.sessions[client_id]
+                deadlines.append(last_seen + (task.segment_number - playhead) * config_cdash.SEGMENT_DURATION)
+        return min(deadlines) if deadlines else None
+
+    def get(self):
+        """ Block until a segment is to be pre-fetched
+        :return: The segment path with the earliest deadline
+        """
+        with self.condition:
+            while True:
+                while not self.heap:
+                    self.condition.wait()
+                deadline, _, task = heapq.heappop(self.heap)
+                if self.tasks.get(task.segment_path) is not task or deadline != task.deadline:
+                    # Stale entry of a task that was re-queued with an earlier deadline
+                    continue
+                task.sessions = set(client_id for client_id in task.sessions if self.wants(client_id, task))
+                if not task.sessions:
+                    del self.tasks[task.segment_path]
+                    self.cancelled += 1
+                    config_cdash.LOG.debug('Cancelled stale pre-fetch %s', task.segment_path)
+                    continue
+                current_deadline = self.get_deadline(task)
+                if self.heap and current_deadline > self.heap[0][0]:
+                    task.deadline = current_deadline
+                    heapq.heappush(self.heap, (current_deadline, next(self.counter), task))
+                    self.demoted += 1
+                    continue
+                del self.tasks[task.segment_path]
+                return task.segment_path
+
+
+TEST_MPD = """<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" minBufferTime="PT1.500000S" type="static" mediaPresentationDuration="PT0H0M40.00S" profiles="urn:mpeg:dash:profile:isoff-live:2011">
+  <Period duration="PT0H0M40.00S">
+    <AdaptationSet segmentAlignment="true" group="1" par="16:9">
+      <SegmentTemplate timescale="96" media="bunny_$Bandwidth$bps/BigBuckBunny_4s$Number$.m4s" startNumber="1" duration="384" initialization="bunny_$Bandwidth$bps/BigBuckBunny_4s_init.mp4" />
+      <Representation id="45226bps" mimeType="video/mp4" codecs="avc1.42c01f" startWithSAP="1" bandwidth="45226" />
+      <Representation id="88783bps" mimeType="video/mp4" codecs="avc1.42c01f" startWithSAP="1" bandwidth="88783" />
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+def test():
+    """ The pre-fetch of the first segment queued after the initialization segment is not cancelled """
+    if not config_cdash.LOG:
+        config_cdash.LOG = logging.getLogger(config_cdash.LOG_NAME)
+    CATALOG.add_mpd('BigBuckBunny_4s.mpd', TEST_MPD, {}, 'BigBuckBunny/', persist=False)
+    prefetch_queue = DeadlinePrefetchQueue()
+    client_id = ('user', 'session')
+    prefetch_queue.update_session(client_id, 'bunny_45226bps/BigBuckBunny_4s_init.mp4', 45226)
+    prefetch_queue.put('bunny_45226bps/BigBuckBunny_4s1.m4s', client_id)
+    assert prefetch_queue.get() == 'bunny_45226bps/BigBuckBunny_4s1.m4s'
+    prefetch_queue.update_session(client_id, 'bunny_45226bps/BigBuckBunny_4s1.m4s', 88783)
+    prefetch_queue.put('bunny_88783bps/BigBuckBunny_4s2.m4s', client_id)
+    assert prefetch_queue.get() == 'bunny_88783bps/BigBuckBunny_4s2.m4s'
+    assert prefetch_queue.cancelled == 0
+    print 'OK'
+
+if __name__ == "__main__":
+    sys.exit(test())
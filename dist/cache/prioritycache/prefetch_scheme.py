@@ -5,48 +5,58 @@ The prefetch schemes used at the Cache
     BASIC: Prefetch the next segment of the current bitrate
     SMART: Prefetch the next segment based on throughput
 """
-import os
 import config_cdash
+from content_catalog import CATALOG
 
 
 def get_prefetch(video_request, pre_fetch_scheme, throughput):
     """
     sample_request = /media/TheSwissAccount/4sec/swiss_88745bps/TheSwissAccount_4s1.m4s
     :param file_path: File request path
-    :return: return the request for the next bitrate
+    :return: return the request for the next bitrate. (None, bitrate) after the last segment of the video
     """
-    segment_number, current_bitrate, video_id, available_bitrates = get_segment_info(video_request)
-    if 'init' in video_request:
-        next_segment = '1'
+    segment = CATALOG.lookup(video_request)
+    if not segment:
+        raise KeyError('Segment {} is not in the catalog'.format(video_request))
+    title = CATALOG.get_title(segment.title)
+    available_bitrates = title.bitrates
+    current_bitrate = available_bitrates[segment.bitrate_index]
+    segment_number = segment.segment_number
+    if segment.segment_number is None:
+        # Initialization segment. The first segment at the lowest bitrate follows
+        segment_number = title.start - 1
         next_bitrate = available_bitrates[0]
     elif 'SMART' in pre_fetch_scheme.upper():
-        config_cdash.LOG.info('Pre-fetch with SMART throughput = {}'.format(throughput))
+        config_cdash.LOG.debug('Pre-fetch with SMART throughput = %s', throughput)
         if throughput > current_bitrate * config_cdash.BASIC_UPPER_THRESHOLD:
-            config_cdash.LOG.info('SMART throughput > 1.2* current bitrate= {},{}'.format(throughput,current_bitrate * config_cdash.BASIC_UPPER_THRESHOLD))
+            config_cdash.LOG.debug('SMART throughput > 1.2* current bitrate= %s,%s',
+                                   throughput, current_bitrate * config_cdash.BASIC_UPPER_THRESHOLD)
             if current_bitrate == available_bitrates[-1]:
                 next_bitrate = current_bitrate
-                config_cdash.LOG.info('Sticking to max:')
+                config_cdash.LOG.debug('Sticking to max:')
             else:
-                config_cdash.LOG.info('not the last bitrate')
+                config_cdash.LOG.debug('not the last bitrate')
                 try:    
                     current_index = available_bitrates.index(current_bitrate)
                     next_bitrate = available_bitrates[current_index + 1]
                     if throughput < next_bitrate * config_cdash.BASIC_UPPER_THRESHOLD:
-                        config_cdash.LOG.info('SMART throughput <= 1.2* next bitrate= {},{}'.format(throughput,next_bitrate * config_cdash.BASIC_UPPER_THRESHOLD))
+                        config_cdash.LOG.debug('SMART throughput <= 1.2* next bitrate= %s,%s',
+                                               throughput, next_bitrate * config_cdash.BASIC_UPPER_THRESHOLD)
                         next_bitrate = current_bitrate
                     else:
-                        config_cdash.LOG.info('Increasing bitrate')
+                        config_cdash.LOG.debug('Increasing bitrate')
                 except ValueError:
                     current_index = available_bitrates[0]
-                    config_cdash.LOG.info('first bitrate for error')
+                    config_cdash.LOG.debug('first bitrate for error')
         else:
-            config_cdash.LOG.info('SMART throughput <= 1.2* current bitrate= {},{}'.format(throughput,current_bitrate * config_cdash.BASIC_UPPER_THRESHOLD))
+            config_cdash.LOG.debug('SMART throughput <= 1.2* current bitrate= %s,%s',
+                                   throughput, current_bitrate * config_cdash.BASIC_UPPER_THRESHOLD)
             if current_bitrate==available_bitrates[-1]:
                 if throughput > current_bitrate * config_cdash.BASIC_LOWER_THRESHOLD:
                     next_bitrate = current_bitrate
-                    config_cdash.LOG.info('Sticking to max neverrrrrrrrrrrrrrrrrrr')
+                    config_cdash.LOG.debug('Sticking to max neverrrrrrrrrrrrrrrrrrr')
             for index, bitrate in enumerate(available_bitrates[1:], 1):
-                config_cdash.LOG.info('not the last bitrate')
+                config_cdash.LOG.debug('not the last bitrate')
                 if bitrate >= current_bitrate and throughput < bitrate * config_cdash.BASIC_UPPER_THRESHOLD:
                      next_bitrate = current_bitrate
                      # do not use current bitrate to avoid oscillations
@@ -55,47 +65,47 @@ def get_prefetch(video_request, pre_fetch_scheme, throughput):
                      next_bitrate = bitrate
                 else:
                     next_bitrate = available_bitrates[index - 1]
-                    config_cdash.LOG.info('Decreasing bitrate')
+                    config_cdash.LOG.debug('Decreasing bitrate')
                     break
     else:
-        config_cdash.LOG.info('Pre-fetch with BASIC')
+        config_cdash.LOG.debug('Pre-fetch with BASIC')
         next_bitrate = current_bitrate
-    next_segment = str(segment_number + 1)
-    next_segment_name = ''.join((config_cdash.VIDEO_CACHE_CONTENT[video_id]['string-match'], next_segment, '.m4s'))
-    current_dir = os.path.dirname(video_request)
-    next_dir = current_dir.replace(str(current_bitrate), str(next_bitrate))
-    next_file_path = '/'.join((next_dir, next_segment_name))
-    config_cdash.LOG.info("Using {} pre_fetch_scheme the next_bitrate = {} and next_file_path = {}".format(
-        pre_fetch_scheme, next_bitrate, next_file_path))
+    next_file_path = title.get_segment_path(available_bitrates.index(next_bitrate), segment_number + 1)
+    config_cdash.LOG.debug("Using %s pre_fetch_scheme the next_bitrate = %s and next_file_path = %s",
+                           pre_fetch_scheme, next_bitrate, next_file_path)
     return next_file_path, next_bitrate
 
 
-def get_segment_info(url):
+def get_lookahead(segment_path, depth):
     """
-    Module to parse the URL to retrieve the segment number and bitrate
-    Example: 'swiss_88745bps/TheSwissAccount_4s1.m4s' returns (1, 88745)
-    :param url: Segment URL (Eg: 'swiss_88745bps/TheSwissAccount_4s1.m4s)
-    :return: A tuple with Segment_number, bitrate
+    Module to get the segments that follow a segment at the same bitrate
+    Example: ('swiss_88745bps/TheSwissAccount_4s1.m4s', 2) returns
+             ['swiss_88745bps/TheSwissAccount_4s2.m4s', 'swiss_88745bps/TheSwissAccount_4s3.m4s']
+    :param segment_path: Segment URL
+    :param depth: Number of segments
+    :return: List of the segment paths. Ends with the last segment of the video
     """
-    video_request_array = url.split("/")
-    video_id, bitrate_string = video_request_array[0].split("_")
-
-    # Parse the segment number
-    segment_string = video_request_array[1]
-    segment_number = segment_string.replace(config_cdash.VIDEO_CACHE_CONTENT[video_id]['string-match'], '')
-    segment_number = segment_number.replace('.m4s', '')
-    segment_number = int(''.join([i for i in segment_number if i.isdigit()]))
-
-    available_bitrates = config_cdash.VIDEO_CACHE_CONTENT[video_id]['available-bitrate']
-
-    # parse the bitrate
-    bitrate = int("".join([ch for ch in bitrate_string if ch.isdigit()]))
-    return segment_number, bitrate, video_id, available_bitrates
-
-
-
-
-
-
+    segment = CATALOG.lookup(segment_path)
+    if not segment or segment.segment_number is None:
+        return []
+    title = CATALOG.get_title(segment.title)
+    return [title.get_segment_path(segment.bitrate_index, next_segment)
+            for next_segment in range(segment.segment_number + 1,
+                                      min(segment.segment_number + depth, title.end) + 1)]
 
 
+def get_segment_info(url):
+    """
+    Module to look up the segment number and bitrate of the URL in the catalog
+    Example: 'swiss_88745bps/TheSwissAccount_4s1.m4s' returns (1, 88745, 'TheSwissAccount_4s', [88745, ...])
+    :param url: Segment URL (Eg: 'swiss_88745bps/TheSwissAccount_4s1.m4s)
+    :return: A tuple with Segment_number, bitrate, title, available bitrates
+             Raises KeyError for the URLs that are not in the catalog and ValueError for initialization segments
+    """
+    segment = CATALOG.lookup(url)
+    if not segment:
+        raise KeyError('Segment {} is not in the catalog'.format(url))
+    if segment.segment_number is None:
+        raise ValueError('{} is an initialization segment'.format(url))
+    available_bitrates = CATALOG.get_title(segment.title).bitrates
+    return segment.segment_number, available_bitrates[segment.bitrate_index], segment.title, available_bitrates
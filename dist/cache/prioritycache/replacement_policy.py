@@ -0,0 +1,355 @@
+__author__ = 'pjuluri'
+
+"""
+The replacement policies used by the PriorityCache
+    LRU: Evict the least recently used segment
+    LFU: Evict the least frequently used segment (ties broken by age)
+    DASH: Evict the segment that is least likely to be requested again based on the
+          popularity of its bitrate, the distance from the playheads of the active sessions
+          and whether it was pre-fetched and never used
+LRU and LFU are O(1) per operation. DASH is O(log n) per add and touch plus a score evaluation, which is
+O(number of sessions of the video). Its victim re-scores at most DASH_VICTIM_RESCORE_LIMIT entries.
+The victim of an empty policy is None.
+"""
+import collections
+import heapq
+import itertools
+import time
+import config_cdash
+from prefetch_scheme import get_segment_info
+
+
+class CacheStats():
+    """ Hit/miss counters for a cache index """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.byte_hits = 0
+        self.byte_misses = 0
+        self.prefetch_hits = 0
+        self.prefetched_bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.wasted_prefetch_bytes = 0
+
+    def record_hit(self, size, code):
+        if code == config_cdash.FETCH_CODE:
+            self.hits += 1
+            self.byte_hits += size
+        elif code == config_cdash.PREFETCH_CODE:
+            self.prefetch_hits += 1
+
+    def record_miss(self, size, code):
+        if code == config_cdash.FETCH_CODE:
+            self.misses += 1
+            self.byte_misses += size
+        elif code == config_cdash.PREFETCH_CODE:
+            self.prefetched_bytes += size
+
+    def record_eviction(self, size, unused_prefetch):
+        self.evictions += 1
+        self.evicted_bytes += size
+        if unused_prefetch:
+            self.wasted_prefetch_bytes += size
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.0
+
+    def byte_hit_ratio(self):
+        total = self.byte_hits + self.byte_misses
+        return self.byte_hits / float(total) if total else 0.0
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        stats['hit_ratio'] = self.hit_ratio()
+        stats['byte_hit_ratio'] = self.byte_hit_ratio()
+        return stats
+
+
+class LRUPolicy():
+    """ Least recently used. The OrderedDict keeps the keys in the order of their last access """
+    name = 'LRU'
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+
+    def add(self, key, code=None, client_id=None):
+        self.entries[key] = None
+
+    def touch(self, key, code=None, client_id=None):
+        del self.entries[key]
+        self.entries[key] = None
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def victim(self):
+        return next(iter(self.entries), None)
+
+
+class LFUPolicy():
+    """ Least frequently used with O(1) frequency buckets.
+    Keys with the same use count are evicted in the order they reached that count.
+    """
+    name = 'LFU'
+
+    def __init__(self):
+        self.frequency = {}
+        self.buckets = collections.defaultdict(collections.OrderedDict)
+        self.min_frequency = 0
+
+    def add(self, key, code=None, client_id=None):
+        self.frequency[key] = 1
+        self.buckets[1][key] = None
+        self.min_frequency = 1
+
+    def touch(self, key, code=None, client_id=None):
+        frequency = self.frequency[key]
+        bucket = self.buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[frequency]
+            if self.min_frequency == frequency:
+                self.min_frequency = frequency + 1
+        self.frequency[key] = frequency + 1
+        self.buckets[frequency + 1][key] = None
+
+    def remove(self, key):
+        frequency = self.frequency.pop(key, None)
+        if frequency is None:
+            return
+        bucket = self.buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[frequency]
+            if self.min_frequency == frequency and self.buckets:
+                self.min_frequency = min(self.buckets)
+
+    def victim(self):
+        if not self.buckets:
+            return None
+        if self.min_frequency not in self.buckets:
+            self.min_frequency = min(self.buckets)
+        return next(iter(self.buckets[self.min_frequency]))
+
+
+class DashPriorityPolicy():
+    """ Adaptation-aware priority. The value of a segment is
+        DASH_POPULARITY_WEIGHT * (share of the requests for the video that use its bitrate) +
+        DASH_PLAYHEAD_WEIGHT * 1/(1 + distance to the closest playhead behind it)
+    scaled by DASH_UNUSED_PREFETCH_PENALTY if it was pre-fetched, never requested and every live playhead
+    of the video is past it.
+    Initialization segments are never preferred for eviction.
+    The scores are kept in a heap and re-evaluated lazily when a segment reaches the top.
+    """
+    name = 'DASH'
+
+    def __init__(self, unused_prefetch=None):
+        """
+        :param unused_prefetch: Set of the pre-fetched keys that were never requested. Kept by the CacheIndex
+        """
+        self.heap = []
+        self.versions = {}
+        self.counter = itertools.count()
+        self.segment_info = {}
+        self.unused_prefetch = unused_prefetch if unused_prefetch is not None else set()
+        # Request counters per (video_id, bitrate) and per video_id
+        self.bitrate_requests = collections.defaultdict(int)
+        self.video_requests = collections.defaultdict(int)
+        # Playheads: {video_id: {client_id: (segment_number, last_seen)}}
+        self.playheads = collections.defaultdict(dict)
+
+    def parse_key(self, key):
+        """ Returns (video_id, bitrate, segment_number, is_init) or None for unknown keys """
+        if key in self.segment_info:
+            return self.segment_info[key]
+        try:
+            segment_number, bitrate, video_id, _ = get_segment_info(key)
+            info = (video_id, bitrate, segment_number, False)
+        except ValueError:
+            # Initialization segment
+            info = (None, None, None, True)
+        except (KeyError, IndexError):
+            info = None
+        self.segment_info[key] = info
+        return info
+
+    def record_request(self, key, code, client_id):
+        """ Update the popularity and playhead of the client for fetch requests """
+        if code != config_cdash.FETCH_CODE:
+            return
+        info = self.parse_key(key)
+        if not info:
+            return
+        video_id, bitrate, segment_number, is_init = info
+        if is_init:
+            return
+        self.bitrate_requests[(video_id, bitrate)] += 1
+        self.video_requests[video_id] += 1
+        if client_id:
+            self.playheads[video_id][client_id] = (segment_number, time.time())
+
+    def score(self, key):
+        """ Higher score means the segment is more likely to be requested again """
+        info = self.segment_info.get(key)
+        if not info:
+            return 0.0
+        video_id, bitrate, segment_number, is_init = info
+        if is_init:
+            return float('inf')
+        popularity = 0.0
+        if self.video_requests[video_id]:
+            popularity = self.bitrate_requests[(video_id, bitrate)] / float(self.video_requests[video_id])
+        proximity = 0.0
+        # A live playhead at or behind the segment may still request it
+        requested_later = False
+        now = time.time()
+        playheads = self.playheads.get(video_id, {})
+        for client_id, (playhead, last_seen) in list(playheads.items()):
+            if now - last_seen > config_cdash.DASH_PLAYHEAD_TIMEOUT:
+                del playheads[client_id]
+                continue
+            distance = segment_number - playhead
+            if distance >= 0:
+                requested_later = True
+                proximity = max(proximity, 1.0 / (1 + distance))
+        score = config_cdash.DASH_POPULARITY_WEIGHT * popularity + config_cdash.DASH_PLAYHEAD_WEIGHT * proximity
+        if key in self.unused_prefetch and not requested_later:
+            score *= config_cdash.DASH_UNUSED_PREFETCH_PENALTY
+        return score
+
+    def push(self, key, score):
+        version = next(self.counter)
+        self.versions[key] = version
+        heapq.heappush(self.heap, (score, version, key))
+        # Drop the stale heap entries once they outnumber the live ones
+        if len(self.heap) > 2 * len(self.versions) + 64:
+            self.heap = [(s, v, k) for s, v, k in self.heap if self.versions.get(k) == v]
+            heapq.heapify(self.heap)
+
+    def add(self, key, code=None, client_id=None):
+        self.parse_key(key)
+        self.record_request(key, code, client_id)
+        self.push(key, self.score(key))
+
+    def touch(self, key, code=None, client_id=None):
+        self.record_request(key, code, client_id)
+        self.push(key, self.score(key))
+
+    def remove(self, key):
+        self.versions.pop(key, None)
+        self.segment_info.pop(key, None)
+
+    def victim(self):
+        rescored = 0
+        while self.heap:
+            score, version, key = self.heap[0]
+            if self.versions.get(key) != version:
+                heapq.heappop(self.heap)
+                continue
+            # The score changes as the playheads move and the popularity shifts. Re-insert the entry with its
+            # current score and look at the top again until the top entry is up to date or the limit is reached
+            if rescored == config_cdash.DASH_VICTIM_RESCORE_LIMIT:
+                return key
+            current_score = self.score(key)
+            rescored += 1
+            if current_score != score:
+                heapq.heappop(self.heap)
+                self.push(key, current_score)
+                continue
+            return key
+        return None
+
+
+POLICIES = {LRUPolicy.name: LRUPolicy,
+            LFUPolicy.name: LFUPolicy,
+            DashPriorityPolicy.name: DashPriorityPolicy}
+
+
+def create_policy(policy_name, unused_prefetch=None):
+    """ Module to create a replacement policy from its name (LRU, LFU, DASH)
+    :param unused_prefetch: Set of the pre-fetched keys that were never requested (used by DASH)
+    """
+    try:
+        policy_class = POLICIES[policy_name.upper()]
+    except KeyError:
+        config_cdash.LOG.error('Unknown replacement policy {}. Using LRU'.format(policy_name))
+        return LRUPolicy()
+    if policy_class is DashPriorityPolicy:
+        return policy_class(unused_prefetch)
+    return policy_class()
+
+
+class CacheIndex():
+    """ Byte-budgeted index of the cached keys.
+    Holds the size of every key and evicts keys chosen by the replacement policy
+    until the new key fits in max_bytes. Used for the cache itself and for the shadow
+    indexes that replay the same requests with other policies for comparison.
+    """
+    def __init__(self, policy_name, max_bytes):
+        # Pre-fetched keys that were never requested. Shared with the DASH policy
+        self.unused_prefetch = set()
+        self.policy = create_policy(policy_name, self.unused_prefetch)
+        self.name = self.policy.name
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.sizes = {}
+        self.stats = CacheStats()
+
+    def __contains__(self, key):
+        return key in self.sizes
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def lookup(self, key, code, client_id=None):
+        """ Returns True and updates the policy if the key is in the index """
+        if not self.touch(key, code, client_id):
+            return False
+        self.stats.record_hit(self.sizes[key], code)
+        return True
+
+    def touch(self, key, code, client_id=None):
+        """ Returns True and updates the policy if the key is in the index. The hit counters are not updated """
+        if key not in self.sizes:
+            return False
+        if code == config_cdash.FETCH_CODE:
+            self.unused_prefetch.discard(key)
+        self.policy.touch(key, code, client_id)
+        return True
+
+    def insert(self, key, size, code, client_id=None):
+        """ Add a key of the given size.
+        :return: List of the keys evicted to make room
+        """
+        evicted = []
+        if key in self.sizes:
+            self.remove(key)
+        self.stats.record_miss(size, code)
+        while self.sizes and self.current_bytes + size > self.max_bytes:
+            victim = self.policy.victim()
+            if victim is None:
+                break
+            self.stats.record_eviction(self.sizes[victim], victim in self.unused_prefetch)
+            self.remove(victim)
+            evicted.append(victim)
+        self.sizes[key] = size
+        self.current_bytes += size
+        if code == config_cdash.PREFETCH_CODE:
+            self.unused_prefetch.add(key)
+        self.policy.add(key, code, client_id)
+        return evicted
+
+    def remove(self, key):
+        size = self.sizes.pop(key, None)
+        if size is None:
+            return
+        self.current_bytes -= size
+        self.unused_prefetch.discard(key)
+        self.policy.remove(key)
+
+    def access(self, key, size, code, client_id=None):
+        """ Replay a request on a metadata only (shadow) index """
+        if not self.lookup(key, code, client_id):
+            self.insert(key, size, code, client_id)
@@ -0,0 +1,178 @@
+__author__ = 'pjuluri'
+
+"""
+Per-session throughput state.
+Every (username, session_id) keeps a ring buffer of its recent throughput samples and the current
+Holt forecast/trend. Idle sessions are expired after THROUGHPUT_SESSION_TIMEOUT seconds.
+The samples are persisted to the THROUGHPUTDATA table by a background writer in batches.
+"""
+import collections
+import sqlite3
+import threading
+import time
+import Queue
+import config_cdash
+import create_db
+
+INSERT_QUERY = ('INSERT INTO THROUGHPUTDATA(ENTRYID, USERNAME, SESSIONID, REQUESTSIZE, REQUESTTIME, THROUGHPUT, '
+                'C_THROUGHPUT, TREND, FORECAST) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);')
+
+
+class ThroughputSample():
+    """ Throughput measured for one segment request. Maps to a row of THROUGHPUTDATA """
+    def __init__(self, entry_id, username, session_id, request_size, request_time, throughput, client_throughput):
+        self.entry_id = entry_id
+        self.username = username
+        self.session_id = session_id
+        self.request_size = request_size
+        self.request_time = request_time
+        self.throughput = throughput
+        self.client_throughput = client_throughput
+        self.trend = None
+        self.forecast = None
+
+    def as_row(self):
+        return (self.entry_id, self.username, self.session_id, self.request_size, self.request_time,
+                self.throughput, self.client_throughput, self.trend, self.forecast)
+
+
+class SessionState():
+    """ Recent samples and the latest forecast of a session """
+    def __init__(self, history):
+        self.samples = collections.deque(maxlen=history)
+        self.forecast = 0.0
+        self.trend = 0.0
+        self.last_seen = time.time()
+
+
+class ThroughputStore():
+    def __init__(self, database=config_cdash.THROUGHPUT_DATABASE, history=config_cdash.THROUGHPUT_HISTORY):
+        """ Start the store and the background writer for the database.
+        :param database: sqlite database file. The samples are not persisted if None
+        :param history: Number of samples kept per session
+        """
+        self.history = history
+        self.lock = threading.Lock()
+        # {(username, session_id): SessionState}
+        self.sessions = {}
+        self.last_expiry = time.time()
+        self.dropped_rows = 0
+        self.database = database
+        self.write_queue = Queue.Queue(maxsize=config_cdash.THROUGHPUT_WRITE_QUEUE_LIMIT)
+        self.stop = threading.Event()
+        self.writer_thread = None
+        if database:
+            self.writer_thread = threading.Thread(target=self.writer_function, args=())
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+
+    def get_session(self, username, session_id):
+        """ Get the state of the session. Called with the lock held """
+        session = self.sessions.get((username, session_id))
+        if not session:
+            session = SessionState(self.history)
+            self.sessions[(username, session_id)] = session
+        return session
+
+    def add_sample(self, entry_id, username, session_id, request_size, request_time, throughput, client_throughput):
+        """ Module to add a throughput sample for the session
+        :return: ThroughputSample
+        """
+        sample = ThroughputSample(entry_id, username, session_id, request_size, request_time, throughput,
+                                  client_throughput)
+        now = time.time()
+        with self.lock:
+            session = self.get_session(username, session_id)
+            session.samples.append(sample)
+            session.last_seen = now
+            if now - self.last_expiry > config_cdash.THROUGHPUT_SESSION_TIMEOUT:
+                self.expire_sessions(now)
+        return sample
+
+    def expire_sessions(self, now):
+        """ Drop the sessions that have been idle for THROUGHPUT_SESSION_TIMEOUT. Called with the lock held """
+        for client_id, session in self.sessions.items():
+            if now - session.last_seen > config_cdash.THROUGHPUT_SESSION_TIMEOUT:
+                del self.sessions[client_id]
+        self.last_expiry = now
+
+    def get_throughput(self, username, session_id, limit=None, scheme='average'):
+        """ Module to get the throughput of the session from the recent samples
+        :param limit: Number of recent samples considered. All the samples in the history if None
+        :param scheme: 'average' or 'harmonic_mean'
+        """
+        with self.lock:
+            session = self.get_session(username, session_id)
+            throughput_list = [sample.throughput for sample in session.samples]
+        if limit:
+            throughput_list = throughput_list[-limit:]
+        if not throughput_list:
+            return None
+        if scheme == 'harmonic_mean':
+            if 0 in throughput_list:
+                return 0.0
+            return len(throughput_list) / sum(1.0 / throughput for throughput in throughput_list)
+        return sum(throughput_list) / float(len(throughput_list))
+
+    def get_forecast(self, username, session_id):
+        """ :return: (forecast, trend) computed for the previous sample of the session """
+        with self.lock:
+            session = self.get_session(username, session_id)
+            return session.forecast, session.trend
+
+    def update_forecast(self, sample, forecast, trend):
+        """ Module to set the forecast and trend of the sample and its session """
+        sample.forecast = forecast
+        sample.trend = trend
+        with self.lock:
+            session = self.get_session(sample.username, sample.session_id)
+            session.forecast = forecast
+            session.trend = trend
+
+    def write(self, sample):
+        """ Queue the sample to be written to the database """
+        if not self.writer_thread:
+            return
+        try:
+            self.write_queue.put_nowait(sample.as_row())
+        except Queue.Full:
+            self.dropped_rows += 1
+            config_cdash.LOG.warning('Throughput write queue full. Dropped {} rows'.format(self.dropped_rows))
+
+    def writer_function(self):
+        """ Thread that writes the queued rows to THROUGHPUTDATA with executemany.
+        Rows are written in batches of up to THROUGHPUT_WRITE_BATCH rows or every THROUGHPUT_WRITE_INTERVAL seconds
+        """
+        connection = create_db.create_db(self.database, config_cdash.THROUGHPUT_TABLES)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL;')
+            connection.execute('PRAGMA synchronous=NORMAL;')
+        except sqlite3.OperationalError as error:
+            config_cdash.LOG.warning('Unable to enable WAL mode for {}: {}'.format(self.database, error))
+        while not (self.stop.is_set() and self.write_queue.empty()):
+            try:
+                rows = [self.write_queue.get(timeout=config_cdash.THROUGHPUT_WRITE_INTERVAL)]
+            except Queue.Empty:
+                continue
+            # Collect the rows for up to THROUGHPUT_WRITE_INTERVAL seconds
+            flush_time = time.time() + config_cdash.THROUGHPUT_WRITE_INTERVAL
+            while len(rows) < config_cdash.THROUGHPUT_WRITE_BATCH and not self.stop.is_set():
+                remaining_time = flush_time - time.time()
+                if remaining_time <= 0:
+                    break
+                try:
+                    rows.append(self.write_queue.get(timeout=remaining_time))
+                except Queue.Empty:
+                    break
+            try:
+                connection.executemany(INSERT_QUERY, rows)
+                connection.commit()
+            except sqlite3.Error as error:
+                config_cdash.LOG.error('Unable to write {} rows to {}: {}'.format(len(rows), self.database, error))
+        connection.close()
+
+    def terminate(self):
+        """ Write the queued rows and stop the writer """
+        self.stop.set()
+        if self.writer_thread:
+            self.writer_thread.join()
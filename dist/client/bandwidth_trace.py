@@ -0,0 +1,105 @@
+"""
+    Module for the trace-driven bandwidth shaping of the segment downloads.
+    A trace file has one period per line: <duration in seconds> <bandwidth in bits per second>
+    Lines starting with '#' are ignored. The trace is repeated once it ends.
+"""
+from __future__ import division
+import bisect
+import threading
+import time
+
+
+class BandwidthTrace():
+    """ Piecewise constant bandwidth over time """
+    def __init__(self, periods):
+        """
+        :param periods: List of (duration in seconds, bandwidth in bits per second)
+        """
+        if not periods or not any(bandwidth > 0 for _, bandwidth in periods):
+            raise ValueError("The trace needs at least one period with a non-zero bandwidth")
+        self.periods = [(float(duration), float(bandwidth)) for duration, bandwidth in periods]
+        # Start time of each period
+        self.start_times = []
+        total_duration = 0.0
+        for duration, _ in self.periods:
+            self.start_times.append(total_duration)
+            total_duration += duration
+        self.total_duration = total_duration
+
+    @classmethod
+    def load(cls, trace_file):
+        """ Module to read the trace from the trace file """
+        periods = []
+        with open(trace_file) as trace_file_handle:
+            for line in trace_file_handle:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                duration, bandwidth = line.split()[:2]
+                periods.append((float(duration), float(bandwidth)))
+        return cls(periods)
+
+    def save(self, trace_file):
+        with open(trace_file, 'w') as trace_file_handle:
+            trace_file_handle.write("# duration(s) bandwidth(bits/s)\n")
+            for duration, bandwidth in self.periods:
+                trace_file_handle.write("{} {}\n".format(duration, int(bandwidth)))
+
+    def locate(self, trace_time):
+        """ :return: (index of the period, time elapsed in the period) at trace_time """
+        trace_time %= self.total_duration
+        index = bisect.bisect_right(self.start_times, trace_time) - 1
+        return index, trace_time - self.start_times[index]
+
+    def bandwidth_at(self, trace_time):
+        index, _ = self.locate(trace_time)
+        return self.periods[index][1]
+
+    def average_bandwidth(self):
+        return sum(duration * bandwidth for duration, bandwidth in self.periods) / self.total_duration
+
+    def transfer_time(self, start_time, bits):
+        """ Module to get the time to transfer the bits over the trace starting at start_time
+        :return: Transfer time in seconds
+        """
+        index, offset = self.locate(start_time)
+        elapsed = 0.0
+        while bits > 0:
+            duration, bandwidth = self.periods[index]
+            available_time = duration - offset
+            if bandwidth > 0:
+                if available_time * bandwidth >= bits:
+                    return elapsed + bits / bandwidth
+                bits -= available_time * bandwidth
+            elapsed += available_time
+            index = (index + 1) % len(self.periods)
+            offset = 0.0
+        return elapsed
+
+
+class BandwidthShaper():
+    """ Delays the reads of the downloads so that the data arrives at the rate of the trace.
+    The trace is the bandwidth of the whole link: the concurrent downloads (PARALLEL mode) share it.
+    """
+    def __init__(self, trace, clock=time):
+        self.trace = trace
+        self.clock = clock
+        self.lock = threading.Lock()
+        # The trace starts with the first download
+        self.start_time = clock.time()
+        # Time at which the bits read so far on the link have arrived
+        self.link_time = self.start_time
+
+    def throttle(self, transfer_start, bits):
+        """ Module to wait until `bits` just read would have arrived over the link.
+        The reads of all the downloads are queued on the link in the order of the calls
+        :param transfer_start: Time of the request of the download. The link is idle before it if nothing is queued
+        :param bits: Bits of the read
+        """
+        with self.lock:
+            self.link_time = max(self.link_time, transfer_start)
+            self.link_time += self.trace.transfer_time(self.link_time - self.start_time, bits)
+            finish_time = self.link_time
+        delay = finish_time - self.clock.time()
+        if delay > 0:
+            self.clock.sleep(delay)
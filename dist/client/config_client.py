@@ -73,6 +73,7 @@ JSON_HANDLE = dict()
 JSON_HANDLE['playback_info'] = {'start_time': None,
                                 'end_time': None,
                                 'initial_buffering_duration': None,
+                                'time_to_first_segment': None,
                                 'interruptions': {'count': 0, 'events': list(), 'total_duration': 0},
                                 'up_shifts': 0,
                                 'down_shifts': 0,
@@ -90,3 +91,15 @@ RE_BUFFERING_COUNT = 0.8
 BASIC_DELTA_COUNT = 10
 MAX_BUFFER_SIZE = 60
 INITIAL_BUFFERING_COUNT = 2
+
+# Segment downloads
+# Reuse the HTTP connections (keep-alive) for the segment requests
+KEEP_ALIVE = True
+MAX_IDLE_CONNECTIONS = 8
+CONNECTION_TIMEOUT = 10
+# Size (in bytes) of the reads of the segment data
+SEGMENT_READ_SIZE = 256 * 1024
+# Keep the segments in memory only instead of writing them to disk
+IN_MEMORY_SEGMENTS = False
+# Number of segments downloaded in parallel while the buffer is below MAX_BUFFER_SIZE. 1 downloads one at a time
+PARALLEL_SEGMENTS = 1
@@ -15,15 +15,29 @@ EXIT_STATES = ['STOP', 'END']
 
 class DashPlayer:
     """ DASH buffer class """
-    def __init__(self, video_length, segment_duration):
+    def __init__(self, video_length, segment_duration, virtual_clock=None, playback_info=None):
+        """
+        :param virtual_clock: VirtualClock for the virtual-clock mode. The player does not start a thread and the
+                              playback is advanced with run_until(). Real time (player thread) if None
+        :param playback_info: dict to record the playback statistics in. Default: JSON_HANDLE['playback_info']
+        """
         config_client.LOG.info("Initializing the Buffer")
         self.player_thread = None
         self.playback_start_time = None
         self.playback_duration = video_length
         self.segment_duration = segment_duration
+        self.virtual_clock = virtual_clock
+        self.clock = virtual_clock or time
+        if playback_info is None:
+            playback_info = config_client.JSON_HANDLE['playback_info']
+        self.playback_info = playback_info
         # Timers to keep track of playback time and the actual time
-        self.playback_timer = StopWatch()
+        self.playback_timer = StopWatch(self.clock)
+        self.start_time = None
         self.actual_start_time = None
+        # Virtual-clock mode: time at which the segment being played ends and start of the current interruption
+        self.segment_end = None
+        self.interruption_start = None
         # Playback State
         self.playback_state = "INITIALIZED"
         self.playback_state_lock = threading.Lock()
@@ -64,7 +78,7 @@ class DashPlayer:
 
     def initialize_player(self):
         """Method that update the current playback time"""
-        start_time = time.time()
+        start_time = self.clock.time()
         initial_wait = 0
         paused = False
         buffering = False
@@ -74,14 +88,14 @@ class DashPlayer:
             # Video stopped by the user
             if self.playback_state == "END":
                 config_client.LOG.info("Finished playback of the video: {} seconds of video played for {} seconds".format(
-                    self.playback_duration, time.time() - start_time))
+                    self.playback_duration, self.clock.time() - start_time))
                 self.playback_timer.pause()
                 return "STOPPED"
 
             if self.playback_state == "STOP":
                 # If video is stopped quit updating the playback time and exit player
                 config_client.LOG.info("Player Stopped at time {}".format(
-                    time.time() - start_time))
+                    self.clock.time() - start_time))
                 self.playback_timer.pause()
                 self.log_entry("Stopped")
                 return "STOPPED"
@@ -103,8 +117,8 @@ class DashPlayer:
                         self.playback_timer.time()))
                     self.playback_timer.pause()
                     buffering = True
-                    interruption_start = time.time()
-                    config_client.JSON_HANDLE['playback_info']['interruptions']['count'] += 1
+                    interruption_start = self.clock.time()
+                    self.playback_info['interruptions']['count'] += 1
                 # If the size of the buffer is greater than the RE_BUFFERING_DURATION then start playback
                 else:
                     # If the RE_BUFFERING_DURATION is greate than the remiang length of the video then do not wait
@@ -114,22 +128,23 @@ class DashPlayer:
                             and self.buffer.qsize() > 0)):
                         buffering = False
                         if interruption_start:
-                            interruption_end = time.time()
+                            interruption_end = self.clock.time()
                             interruption = interruption_end - interruption_start
-                            interruption_start = None
-                            config_client.JSON_HANDLE['playback_info']['interruptions']['events'].append(
+                            self.playback_info['interruptions']['events'].append(
                                 (interruption_start, interruption_end))
-                            config_client.JSON_HANDLE['playback_info']['interruptions']['total_duration'] += interruption
+                            interruption_start = None
+                            self.playback_info['interruptions']['total_duration'] += interruption
                             config_client.LOG.info("Duration of interruption = {}".format(interruption))
                         self.set_state("PLAY")
                         self.log_entry("Buffering-Play")
 
             if self.playback_state == "INITIAL_BUFFERING":
                 if self.buffer.qsize() < config_client.INITIAL_BUFFERING_COUNT:
-                    initial_wait = time.time() - start_time
+                    initial_wait = self.clock.time() - start_time
                     continue
                 else:
                     config_client.LOG.info("Initial Waiting Time = {}".format(initial_wait))
+                    self.playback_info['initial_buffering_duration'] = initial_wait
                     self.set_state("PLAY")
                     self.log_entry("InitialBuffering-Play")
 
@@ -162,7 +177,7 @@ class DashPlayer:
                     while self.playback_timer.time() < future:
                         # If playback hasn't started yet, set the playback_start_time
                         if not self.playback_start_time:
-                            self.playback_start_time = time.time()
+                            self.playback_start_time = self.clock.time()
                             config_client.LOG.info("Started playing with representation {} at {}".format(
                                 play_segment['bitrate'], self.playback_timer.time()))
 
@@ -192,9 +207,11 @@ class DashPlayer:
         """
         # Acquire Lock on the buffer and add a segment to it
         if not self.actual_start_time:
-            self.actual_start_time = time.time()
+            self.actual_start_time = self.clock.time()
+            if self.start_time is not None:
+                self.playback_info['time_to_first_segment'] = self.actual_start_time - self.start_time
         config_client.LOG.info("Writing segment {} at time {}".format(segment['segment_number'],
-                                                                    time.time() - self.actual_start_time))
+                                                                    self.clock.time() - self.actual_start_time))
         self.buffer_lock.acquire()
         self.buffer.put(segment)
         self.buffer_lock.release()
@@ -204,17 +221,96 @@ class DashPlayer:
             segment['playback_length'], self.buffer_length))
         self.buffer_length_lock.release()
         self.log_entry(action="Writing", bitrate=segment['bitrate'])
+        if self.virtual_clock:
+            self.run_until(self.clock.time())
 
     def start(self):
         """ Start playback"""
+        self.start_time = self.clock.time()
+        self.playback_info['start_time'] = self.start_time
         self.set_state("INITIAL_BUFFERING")
         self.log_entry("Starting")
         config_client.LOG.info("Starting the Player")
+        if self.virtual_clock:
+            return
         self.player_thread = threading.Thread(target=self.initialize_player)
         self.player_thread.daemon = True
         self.player_thread.start()
         self.log_entry(action="Starting")
 
+    def run_until(self, end_time):
+        """ Virtual-clock mode: play the buffer up to end_time and advance the clock to it.
+            Used in place of the player thread. The clock is moved to every state change on the way
+            so that the playback timer and the logs see the time of the change.
+        """
+        while self.playback_state not in EXIT_STATES:
+            now = self.clock.time()
+            if self.playback_state == "INITIAL_BUFFERING":
+                if self.buffer.qsize() < self.initial_buffer:
+                    break
+                self.playback_info['initial_buffering_duration'] = now - self.start_time
+                config_client.LOG.info("Initial Waiting Time = {}".format(now - self.start_time))
+                self.set_state("PLAY")
+                self.log_entry("InitialBuffering-Play")
+            elif self.playback_state == "BUFFERING":
+                remaining_playback_time = self.playback_duration - self.playback_timer.time()
+                if not ((self.buffer.qsize() >= config_client.RE_BUFFERING_COUNT) or (
+                        config_client.RE_BUFFERING_COUNT * self.segment_duration >= remaining_playback_time
+                        and self.buffer.qsize() > 0)):
+                    break
+                interruption = now - self.interruption_start
+                self.playback_info['interruptions']['events'].append((self.interruption_start, now))
+                self.playback_info['interruptions']['total_duration'] += interruption
+                self.interruption_start = None
+                config_client.LOG.info("Duration of interruption = {}".format(interruption))
+                self.set_state("PLAY")
+                self.log_entry("Buffering-Play")
+            elif self.playback_state == "PLAY":
+                if self.segment_end is None:
+                    if self.buffer.qsize() == 0:
+                        config_client.LOG.info("Buffer empty after {} seconds of playback".format(
+                            self.playback_timer.time()))
+                        self.playback_timer.pause()
+                        self.set_state("BUFFERING")
+                        self.log_entry("Play-Buffering")
+                        self.interruption_start = now
+                        self.playback_info['interruptions']['count'] += 1
+                        continue
+                    self.current_segment = self.buffer.get()
+                    if not self.playback_start_time:
+                        self.playback_start_time = now
+                    self.log_entry(action="StillPlaying", bitrate=self.current_segment["bitrate"])
+                    self.segment_end = now + self.current_segment['playback_length']
+                    self.playback_timer.start()
+                if self.segment_end > end_time:
+                    break
+                self.virtual_clock.advance_to(self.segment_end)
+                self.segment_end = None
+                self.buffer_length -= int(self.current_segment['playback_length'])
+                if self.playback_timer.time() >= self.playback_duration:
+                    self.playback_timer.pause()
+                    self.set_state("END")
+                    self.log_entry("TheEnd")
+                elif self.segment_limit and int(self.current_segment['segment_number']) >= self.segment_limit:
+                    self.playback_timer.pause()
+                    self.set_state("STOP")
+                    self.log_entry("Stopped")
+            else:
+                break
+        self.virtual_clock.advance_to(end_time)
+
+    def finish(self):
+        """ Virtual-clock mode: play the rest of the buffer once all the segments are written """
+        if self.playback_state == "INITIAL_BUFFERING" and self.buffer.qsize():
+            # Fewer segments than the initial buffer in the video
+            self.initial_buffer = self.buffer.qsize()
+        while self.playback_state not in EXIT_STATES and (self.segment_end is not None or self.buffer.qsize()):
+            self.run_until(self.segment_end or self.clock.time())
+        if self.playback_state not in EXIT_STATES:
+            self.playback_timer.pause()
+            self.stop()
+        self.playback_info['end_time'] = self.clock.time()
+
     def stop(self):
         """Method to stop the playback"""
         self.set_state("STOP")
@@ -227,7 +323,7 @@ class DashPlayer:
         if self.buffer_log_file:
             header_row = None
             if self.actual_start_time:
-                log_time = time.time() - self.actual_start_time
+                log_time = self.clock.time() - self.actual_start_time
             else:
                 log_time = 0
             if not os.path.exists(self.buffer_log_file):
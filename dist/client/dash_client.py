@@ -21,10 +21,14 @@ import sys
 import errno
 import timeit
 import httplib
+import socket
 from string import ascii_letters, digits
 from argparse import ArgumentParser
+from multiprocessing.pool import ThreadPool
 import basic_dash
 import config_client
+import dash_transport
+from bandwidth_trace import BandwidthTrace, BandwidthShaper
 import dash_buffer
 from configure_log_file import configure_log_file, write_json
 import time
@@ -37,7 +41,6 @@ except NameError:
 
 # Constants
 DEFAULT_PLAYBACK = 'BASIC'
-DOWNLOAD_CHUNK = 1024
 
 # Globals for arg parser with the default values
 # Not sure if this is the correct way ....
@@ -46,10 +49,14 @@ LIST = False
 PLAYBACK = DEFAULT_PLAYBACK
 DOWNLOAD = False
 SEGMENT_LIMIT = None
+TRACE = None
+IN_MEMORY = config_client.IN_MEMORY_SEGMENTS
+PARALLEL = config_client.PARALLEL_SEGMENTS
+# BandwidthShaper for the downloads when a TRACE is given
+SHAPER = None
 download_rate = None
 sizes=[]
 seg_time=[]
-start=[]
 
 class DashPlayback:
     """
@@ -113,40 +120,67 @@ def id_generator(id_size=6):
     return 'TEMP_' + ''.join(random.choice(ascii_letters+digits) for _ in range(id_size))
 
 
-def download_segment(segment_url, dash_folder):
-    """ Module to download the segment """
+def download_segment(segment_url, dash_folder, headers):
+    """ Module to download the segment on a keep-alive connection
+    :param headers: Request headers (see get_request_headers)
+    :return: SegmentDownload. The data is also written to a file in dash_folder unless IN_MEMORY is set
+             None if the segment could not be downloaded
+    """
     try:
-        #time.sleep(2)
-        segment_opener = get_opener()
-        #T1=time.time()
-        #config_client.LOG.info("T1 = {}".format(T1))
-        #start.append(T1)
-        connection = segment_opener.open(segment_url)
+        segment_download = dash_transport.download(segment_url, headers, SHAPER)
     except urllib2.HTTPError, error:
         config_client.LOG.error("Unable to download DASH Segment {} HTTP Error:{} ".format(
             segment_url, str(error.code)))
         return None
-    parsed_uri = urlparse.urlparse(segment_url)
-    segment_path = '{uri.path}'.format(uri=parsed_uri)
-    while segment_path.startswith('/'):
-        segment_path = segment_path[1:]        
-    segment_filename = os.path.join(dash_folder, os.path.basename(segment_path))
-    make_sure_path_exists(os.path.dirname(segment_filename))
-    segment_file_handle = open(segment_filename, 'wb')
-    segment_size = 0
-    while True:
-        segment_data = connection.read(DOWNLOAD_CHUNK)
-        segment_size += len(segment_data)
-        segment_file_handle.write(segment_data)
-        if len(segment_data) < DOWNLOAD_CHUNK:
-            break
-    T5=time.time()
-    config_client.LOG.info("T5 = {}".format(T5))
-    #time.sleep (5.0 / 1000.0);
-    connection.close()
-    segment_file_handle.close()
-    sizes.append(segment_size)
-    return segment_size, segment_filename
+    except (httplib.HTTPException, socket.error), error:
+        config_client.LOG.error("Unable to download DASH Segment {}: {}".format(segment_url, error))
+        return None
+    config_client.LOG.info("T5 = {}".format(segment_download.end_time))
+    if not IN_MEMORY:
+        parsed_uri = urlparse.urlparse(segment_url)
+        segment_path = '{uri.path}'.format(uri=parsed_uri)
+        while segment_path.startswith('/'):
+            segment_path = segment_path[1:]
+        segment_filename = os.path.join(dash_folder, os.path.basename(segment_path))
+        make_sure_path_exists(os.path.dirname(segment_filename))
+        with open(segment_filename, 'wb') as segment_file_handle:
+            segment_file_handle.write(segment_download.data)
+        segment_download.filename = segment_filename
+    return segment_download
+
+
+def download_segments(segment_urls, dash_folder, download_pool=None):
+    """ Module to download the segments. In parallel with the download_pool if there are more than one
+    :return: List of SegmentDownload (None for the segments that could not be downloaded) in the order of the urls
+    """
+    headers = get_request_headers()
+    if len(segment_urls) == 1 or not download_pool:
+        return [download_segment(segment_url, dash_folder, dict(headers)) for segment_url in segment_urls]
+    return download_pool.map(lambda segment_url: download_segment(segment_url, dash_folder, dict(headers)),
+                             segment_urls)
+
+
+def get_segment_times(segment_downloads):
+    """ Module to get the download time of each segment of a batch.
+    Segments downloaded in parallel share the bandwidth. The time of the batch is divided between the
+    segments by their size so that size/time is the throughput of the batch for every segment.
+    """
+    if len(segment_downloads) == 1:
+        return [segment_downloads[0].download_time()]
+    batch_time = (max(download.end_time for download in segment_downloads) -
+                  min(download.start_time for download in segment_downloads))
+    batch_size = sum(download.size for download in segment_downloads)
+    return [batch_time * download.size / batch_size for download in segment_downloads]
+
+
+def get_batch_size(dash_player, segment_duration, parallel):
+    """ Module to get the number of segments to download in parallel.
+    Up to `parallel` segments while the buffer has room for them (MAX_BUFFER_SIZE)
+    """
+    if parallel <= 1:
+        return 1
+    room = int((dash_player.max_buffer_size - dash_player.buffer_length) / segment_duration)
+    return max(1, min(parallel, room))
 
 
 def make_sure_path_exists(path):
@@ -184,7 +218,8 @@ def start_playback(dp_object, domain, playback_type=None, download=False):
     dash_player.start()
     # A folder to save the segments in
     file_identifier = id_generator()
-    config_client.LOG.info("The segments are stored in %s" % file_identifier)
+    if not IN_MEMORY:
+        config_client.LOG.info("The segments are stored in %s" % file_identifier)
     # dp_list = defaultdict(defaultdict)
     bitrates = dp_object.video['bandwidth_list']
     bitrates.sort()
@@ -199,9 +234,10 @@ def start_playback(dp_object, domain, playback_type=None, download=False):
     # Delay in terms of the number of segments
     delay = 0
     segment_duration = 0
-    segment_download_time = None
     # Start playback of all the segments
     downloaded_duration = 0
+    # Downloads the next segments in parallel when PARALLEL > 1
+    download_pool = ThreadPool(PARALLEL) if PARALLEL > 1 else None
     # for segment_number, segment in enumerate(dp_list, int(dp_object.video['start'])):
     segment_number = dp_object.video['start']
     while downloaded_duration < dp_object.playback_duration:
@@ -238,13 +274,28 @@ def start_playback(dp_object, domain, playback_type=None, download=False):
                     playback_type))
                 #global download_rate
                 current_bitrate, average_dwn_time, download_rate = basic_dash.basic_dash(segment_number, bitrates, average_dwn_time,
-                                                                          segment_download_time, current_bitrate)
-        segment_path = read_mpd.get_segment_path(dp_object.video, dp_object.playback_duration,current_bitrate,
-                                                 segment_number)
-        #segment_path = "bunny_88783bps/BigBuckBunny_4s1.m4s"
-        #segment_path = "bunny_88783bps/BigBuckBunny_4s1.m4s"
-        segment_url = urlparse.urljoin(domain, segment_path)
-        config_client.LOG.info("{}: Segment URL = {}".format(playback_type.upper(), segment_url))
+                                                                          recent_download_sizes,
+                                                                          previous_segment_times, current_bitrate)
+        # The segments of the batch are downloaded at the selected bitrate
+        segment_urls = []
+        batch_duration = downloaded_duration
+        for batch_number in range(segment_number, segment_number + get_batch_size(dash_player, video_segment_duration,
+                                                                                  PARALLEL)):
+            if SEGMENT_LIMIT and batch_number > int(SEGMENT_LIMIT):
+                break
+            if batch_duration >= dp_object.playback_duration:
+                break
+            segment_path = read_mpd.get_segment_path(dp_object.video, dp_object.playback_duration, current_bitrate,
+                                                     batch_number)
+            if not segment_path:
+                break
+            segment_urls.append(urlparse.urljoin(domain, segment_path))
+            batch_duration += video_segment_duration
+        if not segment_urls:
+            config_client.LOG.info("No more segments to download")
+            break
+        for segment_url in segment_urls:
+            config_client.LOG.info("{}: Segment URL = {}".format(playback_type.upper(), segment_url))
         if delay:
             delay_start = time.time()
             config_client.LOG.info("SLEEPING for {}seconds ".format(delay*segment_duration))
@@ -253,52 +304,60 @@ def start_playback(dp_object, domain, playback_type=None, download=False):
             delay = 0
             config_client.LOG.debug("SLEPT for {}seconds ".format(time.time() - delay_start))
         try:
-            segment_size, segment_filename = download_segment(segment_url, file_identifier)
-            config_client.LOG.info("{}: Downloaded segment {}".format(playback_type.upper(), segment_url))
+            segment_downloads = download_segments(segment_urls, file_identifier, download_pool)
         except IOError, e:
             config_client.LOG.error("Unable to save segment %s" % e)
             return None
-        T4=time.time()
-        config_client.LOG.info("T4 = {}".format(T4))
-        segment_download_time = T4 - start[-1]
-        seg_time.append(segment_download_time)
-        previous_segment_times.append(segment_download_time)
-        recent_download_sizes.append(segment_size)
-        # Updating the JSON information
-        segment_name = os.path.split(segment_url)[1]
-        if "segment_info" not in config_client.JSON_HANDLE:
-            config_client.JSON_HANDLE["segment_info"] = list()
-        config_client.JSON_HANDLE["segment_info"].append((segment_name, current_bitrate, segment_size,
-                                                          segment_download_time))
-        total_downloaded += segment_size
-        config_client.LOG.info("{} : The total downloaded = {}, segment_size = {}, segment_number = {}".format(
-            playback_type.upper(),
-            total_downloaded, segment_size, segment_number))
-        segment_info = {'playback_length': dp_object.video['duration']/dp_object.video['timescale'],
-                        'size': segment_size,
-                        'bitrate': current_bitrate,
-                        'data': segment_filename,
-                        'URI': segment_url,
-                        'segment_number': segment_number}
-        segment_duration = segment_info['playback_length']
-        dash_player.write(segment_info)
-        segment_files.append(segment_filename)
-        config_client.LOG.info("Downloaded %s. Size = %s in %s seconds" % (
-            segment_url, segment_size, str(segment_download_time)))
-        downloaded_duration += segment_duration
-        segment_number += 1
-        if previous_bitrate:
-            if previous_bitrate < current_bitrate:
-                config_client.JSON_HANDLE['playback_info']['up_shifts'] += 1
-            elif previous_bitrate > current_bitrate:
-                config_client.JSON_HANDLE['playback_info']['down_shifts'] += 1
-            previous_bitrate = current_bitrate
+        if None in segment_downloads:
+            return None
+        for segment_download, segment_download_time in zip(segment_downloads,
+                                                           get_segment_times(segment_downloads)):
+            segment_url = segment_download.url
+            segment_size = segment_download.size
+            config_client.LOG.info("{}: Downloaded segment {}".format(playback_type.upper(), segment_url))
+            sizes.append(segment_size)
+            seg_time.append(segment_download_time)
+            previous_segment_times.append(segment_download_time)
+            recent_download_sizes.append(segment_size)
+            # Updating the JSON information
+            segment_name = os.path.split(segment_url)[1]
+            if "segment_info" not in config_client.JSON_HANDLE:
+                config_client.JSON_HANDLE["segment_info"] = list()
+            config_client.JSON_HANDLE["segment_info"].append((segment_name, current_bitrate, segment_size,
+                                                              segment_download_time))
+            total_downloaded += segment_size
+            config_client.LOG.info("{} : The total downloaded = {}, segment_size = {}, segment_number = {}".format(
+                playback_type.upper(),
+                total_downloaded, segment_size, segment_number))
+            segment_info = {'playback_length': dp_object.video['duration']/dp_object.video['timescale'],
+                            'size': segment_size,
+                            'bitrate': current_bitrate,
+                            'data': segment_download.data if IN_MEMORY else segment_download.filename,
+                            'URI': segment_url,
+                            'segment_number': segment_number}
+            segment_duration = segment_info['playback_length']
+            dash_player.write(segment_info)
+            if not IN_MEMORY:
+                segment_files.append(segment_download.filename)
+            config_client.LOG.info("Downloaded %s. Size = %s in %s seconds" % (
+                segment_url, segment_size, str(segment_download_time)))
+            downloaded_duration += segment_duration
+            segment_number += 1
+            if previous_bitrate:
+                if previous_bitrate < current_bitrate:
+                    config_client.JSON_HANDLE['playback_info']['up_shifts'] += 1
+                elif previous_bitrate > current_bitrate:
+                    config_client.JSON_HANDLE['playback_info']['down_shifts'] += 1
+                previous_bitrate = current_bitrate
+    if download_pool:
+        download_pool.close()
 
     # waiting for the player to finish playing
     while dash_player.playback_state not in dash_buffer.EXIT_STATES:
         time.sleep(1)
     write_json()
-    if not download:
+    dash_transport.CONNECTION_POOL.close()
+    if not download and not IN_MEMORY:
         clean_files(file_identifier)
 
 
@@ -333,38 +392,36 @@ def create_arguments(parser):
     parser.add_argument('-d', '--DOWNLOAD', action='store_true',
                         default=False,
                         help="Keep the video files after playback. When we set to False all the files are deleted after the video session.")
-
-
-def get_opener():
+    parser.add_argument('-t', '--TRACE',
+                        default=TRACE,
+                        help="Bandwidth trace file. The segment downloads are shaped to the bandwidth of the trace.")
+    parser.add_argument('-i', '--IN_MEMORY', action='store_true',
+                        default=IN_MEMORY,
+                        help="Keep the segments in memory only. Nothing is written to disk.")
+    parser.add_argument('-k', '--PARALLEL', type=int,
+                        default=PARALLEL,
+                        help="Number of segments downloaded in parallel while the buffer has room for them.")
+
+
+def get_request_headers():
     """
-    Module to create an Urllib2 opener with the cookies
-    :return:
+    Module to get the request headers of the segment downloads with the cookies and the throughput
+    of the previous download. The 'Time' header is set when the request is sent
+    :return: dict
     """
-    global download_rate
-    Cookie_dict=config_client.COOKIE_FIELDS
-    #config_client.LOG.info("no time = {}".format(Cookie_dict))
-    T1=time.time()
-    config_client.LOG.info("T1 = {}".format(T1))
-    start.append(T1)
-    Cookie_dict['Time']=T1
-    config_client.LOG.info("Time added = {}".format(Cookie_dict['Time']))
-    #Cookie_dict['Time'] = str(datetime.datetime.time(datetime.datetime.now()))
-    #config_client.LOG.info("time added = {}".format(Cookie_dict['Time']))
+    request_headers = dict(config_client.COOKIE_FIELDS)
     if download_rate:
-        Cookie_dict['Throughput']= download_rate
-        config_client.LOG.info("Throughput added = {}".format(Cookie_dict['Throughput']))
+        request_headers['Throughput'] = download_rate
+        config_client.LOG.info("Throughput added = {}".format(request_headers['Throughput']))
     if sizes:
-        Cookie_dict['segment_size']= (sizes[-1]*8)
-        config_client.LOG.info("segment_size added = {}".format(Cookie_dict['segment_size']))
+        request_headers['segment_size'] = (sizes[-1]*8)
+        config_client.LOG.info("segment_size added = {}".format(request_headers['segment_size']))
     if seg_time:
-         Cookie_dict['seg_time']= seg_time[-1]
-         config_client.LOG.info("segment_time added = {}".format(Cookie_dict['seg_time']))
-    url_opener = urllib2.build_opener()
-    config_client.LOG.info("Cookie info = {}".format(Cookie_dict))
-    for cookie_field in Cookie_dict:
-        config_client.LOG.info("Cookie for append = {}".format(cookie_field))
-        url_opener.addheaders.append((cookie_field,Cookie_dict[cookie_field]))
-    return url_opener
+        request_headers['seg_time'] = seg_time[-1]
+        config_client.LOG.info("segment_time added = {}".format(request_headers['seg_time']))
+    config_client.LOG.info("Cookie info = {}".format(request_headers))
+    return request_headers
+
 
 def get_opener_mpd():
     """
@@ -385,6 +442,7 @@ def get_opener_mpd():
 
 def main():
     """ Main Program wrapper """
+    global SHAPER
     # configure the log file
     # Create arguments
     parser = ArgumentParser(description='Process Client parameters')
@@ -396,6 +454,9 @@ def main():
     if not MPD:
         print "ERROR: Please provide the URL to the MPD file. Try Again.."
         return None
+    if TRACE:
+        SHAPER = BandwidthShaper(BandwidthTrace.load(TRACE))
+        config_client.LOG.info('Shaping the downloads to the bandwidth trace %s' % TRACE)
     config_client.LOG.info('Downloading MPD file %s' % MPD)
     # Retrieve the MPD files for the video
     mpd_opener = get_opener_mpd()
@@ -0,0 +1,159 @@
+"""
+    Transport for the segment downloads of the DASH client.
+    Segments are requested on persistent (keep-alive) HTTP connections and read with large reads into a
+    buffer allocated for the Content-Length of the response.
+"""
+import collections
+import httplib
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+import config_client
+
+
+class ConnectionPool():
+    """ Pool of persistent (keep-alive) HTTP connections to the servers.
+        A connection is used by one download at a time and returned once the response is read completely.
+    """
+    def __init__(self, max_idle=config_client.MAX_IDLE_CONNECTIONS):
+        self.lock = threading.Lock()
+        self.max_idle = max_idle
+        # {(scheme, netloc): [idle connections]}
+        self.idle = collections.defaultdict(list)
+
+    def get(self, origin):
+        """ :param origin: (scheme, netloc) of the server """
+        with self.lock:
+            if self.idle[origin]:
+                return self.idle[origin].pop()
+        scheme, netloc = origin
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=config_client.CONNECTION_TIMEOUT)
+        return httplib.HTTPConnection(netloc, timeout=config_client.CONNECTION_TIMEOUT)
+
+    def put(self, origin, connection):
+        with self.lock:
+            if len(self.idle[origin]) < self.max_idle:
+                self.idle[origin].append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """ Close the idle connections """
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+
+CONNECTION_POOL = ConnectionPool()
+
+
+class SegmentDownload():
+    """ A downloaded segment and the times of its request """
+    def __init__(self, url, data, start_time, end_time):
+        """
+        :param data: bytearray with the segment
+        :param start_time: Time at which the request was sent (T1)
+        :param end_time: Time at which the last byte was received (T4)
+        """
+        self.url = url
+        self.data = data
+        self.size = len(data)
+        self.start_time = start_time
+        self.end_time = end_time
+        # File the segment is written to (None when the segment is kept in memory)
+        self.filename = None
+
+    def download_time(self):
+        return self.end_time - self.start_time
+
+
+def open_url(url, headers):
+    """ Module to send the GET request on a pooled connection.
+    A request on a connection that was closed by the server while idle is retried once.
+    :param headers: dict of the request headers. The 'Time' header is set to the time the request is sent
+    :return: (origin, connection, response, request time)
+    """
+    parsed_uri = urlparse.urlparse(url)
+    origin = (parsed_uri.scheme, parsed_uri.netloc)
+    request_path = parsed_uri.path
+    if parsed_uri.query:
+        request_path = '?'.join((request_path, parsed_uri.query))
+    for attempt in range(2):
+        connection = CONNECTION_POOL.get(origin)
+        request_time = time.time()
+        headers['Time'] = request_time
+        try:
+            connection.request('GET', request_path, headers=headers)
+            response = connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if attempt:
+                raise
+            continue
+        if response.status != httplib.OK:
+            response.read()
+            release_connection(origin, connection, response)
+            raise urllib2.HTTPError(url, response.status, response.reason, response.msg, None)
+        return origin, connection, response, request_time
+
+
+def release_connection(origin, connection, response):
+    """ Module to return the connection to the pool once the response is read, unless the server closes it """
+    if response.will_close or not config_client.KEEP_ALIVE:
+        connection.close()
+    else:
+        CONNECTION_POOL.put(origin, connection)
+
+
+def read_response(response, shaper=None, transfer_start=None, read_size=config_client.SEGMENT_READ_SIZE):
+    """ Module to read the body of the response into a buffer allocated for the Content-Length.
+    httplib of Python 2 has no readinto, so the reads of read_size bytes are copied into the buffer.
+    :param shaper: BandwidthShaper that delays the reads (None for no shaping)
+    :return: bytearray
+    """
+    content_length = response.getheader('content-length')
+    if content_length is None:
+        # Unknown length (chunked or closed by the server)
+        data = bytearray()
+        while True:
+            chunk = response.read(read_size)
+            if not chunk:
+                break
+            data.extend(chunk)
+            if shaper:
+                shaper.throttle(transfer_start, len(chunk) * 8)
+        return data
+    size = int(content_length)
+    data = bytearray(size)
+    data_view = memoryview(data)
+    received = 0
+    while received < size:
+        chunk = response.read(min(read_size, size - received))
+        if not chunk:
+            raise httplib.IncompleteRead(bytes(data[:received]), size - received)
+        data_view[received:received + len(chunk)] = chunk
+        received += len(chunk)
+        if shaper:
+            shaper.throttle(transfer_start, len(chunk) * 8)
+    return data
+
+
+def download(url, headers, shaper=None):
+    """ Module to download the url on a keep-alive connection
+    :param headers: dict of the request headers
+    :return: SegmentDownload
+    """
+    origin, connection, response, request_time = open_url(url, headers)
+    try:
+        data = read_response(response, shaper, request_time)
+    except (httplib.HTTPException, socket.error):
+        connection.close()
+        raise
+    end_time = time.time()
+    release_connection(origin, connection, response)
+    return SegmentDownload(url, data, request_time, end_time)
@@ -1,11 +1,31 @@
 import time
 
 
+class VirtualClock():
+    """ Clock that only moves when it is advanced. Has the time() and sleep() of the time module
+        so that it can be used in place of it to run a player faster than real time
+    """
+    def __init__(self, start_time=0.0):
+        self.current_time = float(start_time)
+
+    def time(self):
+        return self.current_time
+
+    def sleep(self, seconds):
+        self.advance_to(self.current_time + seconds)
+
+    def advance_to(self, new_time):
+        """ Move the clock forward to new_time. The clock never moves back """
+        if new_time > self.current_time:
+            self.current_time = new_time
+
+
 class StopWatch():
     """ Implements a stop watch function
         Modified from http://code.activestate.com/recipes/124894-stopwatch-in-tkinter/
     """
-    def __init__(self):
+    def __init__(self, clock=time):
+        self.clock = clock
         self.start_time = 0.0
         self.elapsed_time = 0.0
         self.running = 0
@@ -13,18 +33,18 @@ class StopWatch():
     def start(self):
         """ Start the stopwatch, ignore if running. """
         if not self.running:
-            self.start_time = time.time() - self.elapsed_time
+            self.start_time = self.clock.time() - self.elapsed_time
             self.running = 1
     
     def pause(self):
         """ Stop the stopwatch, ignore if already paused."""
         if self.running:
-            self.elapsed_time = time.time() - self.start_time
+            self.elapsed_time = self.clock.time() - self.start_time
             self.running = 0
     
     def reset(self):
         """ Reset the stopwatch. """
-        self.start_time = time.time()
+        self.start_time = self.clock.time()
         self.elapsed_time = 0.0
 
     def time(self):
@@ -32,5 +52,5 @@ class StopWatch():
         :return: elapsed time
         """
         if self.running:
-            self.elapsed_time = time.time() - self.start_time
+            self.elapsed_time = self.clock.time() - self.start_time
         return int(self.elapsed_time)